@@ -1,17 +1,20 @@
 import os
+import queue
+import pickle
+import threading
 
 import pandas as pd
 import numpy as np
-import matplotlib.pyplot as plt
-from tqdm import tqdm
-tqdm.pandas()
 
 from portfolio import Portfolio
-from utils import generate_option_ticker_vectorized
+from utils import generate_option_ticker_vectorized, find_indices_closest_to_zero_sum, blackscholes_price, get_strike, OptionPriceCube
+from utils.column_registry import ColumnRegistry
+from utils.vol_smile import fit_vol_smiles, smile_vols, log_moneyness, implied_vols_from_prices
+from utils.data_schema import compact_option_data, compact_main_df, memory_report, STRIKE_SCALE, MAIN_DF_FLOAT32_COLS
 
 
 class Backtest:
-    def __init__(self, portfolio: Portfolio, asset_data, data_api, option_data=None):
+    def __init__(self, portfolio: Portfolio, asset_data, data_api, option_data=None, compact_schema=False):
         self.portfolio = portfolio
         self.portfolio.record_date(asset_data['Date'].values)
         self.main_df = asset_data.copy()    # backtest details for all days, length = number of days
@@ -19,6 +22,24 @@ class Backtest:
         self.dates = asset_data['Date']
         self.option_data = option_data      # option chain data for all days, length = number of days * number of available/choosen options on each day
         self.issues = []
+        self.compact_schema = compact_schema    # store option_data and derived main_df columns with compact dtypes, see utils.data_schema
+        self.schema_memory_report = None
+        self.vol_smiles = None          # per-day smiles fitted to fetched option prices, see price_fallbacks_with_smiles
+        self.n_priced_days = 0          # date cursors: number of days in main_df whose option prices have been fetched / simulated by run
+        self.n_simulated_days = 0
+        self.checkpoint_path = None
+        self.checkpoint_every = None
+        self.checkpoint_fetch_days = None       # days of option prices fetched between two checkpoints when get_option_price isn't given chunk_days
+        self.contract_index = None              # utils.ContractIndex, if set only listed contracts are requested
+        self.rebalance_config = None            # see config.rebalance_config, None never rebalances
+        self.bs_config = None                   # bs_config of get_option_price, also used to mark option positions held overnight
+        self.nav_floor = None                   # stop rules of run: stop at the close NAV falls below nav_floor or drawdown from the peak NAV exceeds max_drawdown
+        self.max_drawdown = None
+        self.stop_reason = None                 # why run stopped early, None if it didn't
+        self.strike_columns = None              # [(option_type, strike column of main_df)] of the options fetched for strategies 2 and 3, None is the selected call and put
+        self.columns = ColumnRegistry(self)     # derived columns of main_df, computed lazily when needed
+        self.columns.register(['call_price_at_close', 'put_price_at_close'], inputs=['Close', 'selected_call_strike', 'selected_put_strike'],
+                              func=Backtest.compute_option_price_at_expiration)
 
     
     def add_option_data(self, option_data):
@@ -30,16 +51,53 @@ class Backtest:
         this function will search option prices from option_data (generated by BS model) and add option price columns to Backtest.main_df
         """
         self.add_option_data(option_data)
+        cube = OptionPriceCube.build(self.option_data['Date'].values, np.rint(self.option_data['Strike_price'].values * STRIKE_SCALE),
+                                     self.option_data['Option_type'].values, self.option_data['Option_Value'].values)
+        day_positions = cube.day_positions(self.main_df['Date'].values)
 
         for option_type in ['call', 'put']:
-            sub_df = self.option_data[self.option_data['Option_type'] == option_type]
-            temp_df = pd.merge(self.main_df, sub_df,  how='left', left_on=['Date', f"selected_{option_type}_strike"], right_on = ['Date', 'Strike_price'])
-            self.main_df[f"{option_type}_price_at_{spot_price.lower()}"] = temp_df['Option_Value']
+            self.main_df[f"{option_type}_price_at_{spot_price.lower()}"] = cube.lookup(day_positions, self.main_df[f"selected_{option_type}_strike"].values, option_type)
+
+
+    def compact_option_data(self):
+        """
+        convert self.option_data to the compact schema and record its memory footprint before and after in self.schema_memory_report
+        """
+        before = self.option_data
+        self.option_data = compact_option_data(before)
+        self.record_memory_report(memory_report({'option_data': before}, {'option_data': self.option_data}))
+
+
+    def compact_main_df(self):
+        """
+        downcast descriptive columns of self.main_df which are not used by the simulation, see utils.data_schema.compact_main_df
+        """
+        before = self.main_df.copy()
+        compact_main_df(self.main_df)
+        self.columns.touch([col for col in MAIN_DF_FLOAT32_COLS if col in self.main_df.columns])
+        self.record_memory_report(memory_report({'main_df': before}, {'main_df': self.main_df}))
+
+
+    def record_memory_report(self, report: pd.DataFrame):
+        if self.schema_memory_report is None:
+            self.schema_memory_report = report
+        else:
+            # keep one row per DataFrame, the latest one wins (e.g. the last chunk of option_data)
+            kept = self.schema_memory_report.drop(report.index, errors='ignore')
+            self.schema_memory_report = pd.concat([kept, report])
+
+
+    @staticmethod
+    def compute_option_price_at_expiration(df):
+        return {
+            'call_price_at_close': np.maximum(df['Close'] - df['selected_call_strike'], 0),
+            'put_price_at_close': np.maximum(df['selected_put_strike'] - df['Close'], 0)
+        }
 
 
     def update_option_price_at_expiration(self):
-        self.main_df['call_price_at_close'] = np.maximum(self.main_df['Close'] - self.main_df['selected_call_strike'], 0)
-        self.main_df['put_price_at_close'] = np.maximum(self.main_df['selected_put_strike'] - self.main_df['Close'], 0)
+        # only recomputed if the selected strikes or close prices changed since the last time
+        self.columns.compute(['call_price_at_close', 'put_price_at_close'])
 
 
     def save_main_df_to_csv(self, filename='backtest_main_df.csv'):
@@ -49,17 +107,34 @@ class Backtest:
 
 
     def run(self, Strategy, simulation_days=None):
-        if simulation_days is None:
-            simulation_days = len(self.main_df)
-            
-        start_index = self.main_df.index[0]
-        end_index = start_index + simulation_days - 1
-        if end_index > self.main_df.index[-1]:
-            end_index = self.main_df.index[-1]
-
-        for index, row in self.main_df.loc[start_index:end_index].iterrows():
+        """
+        Run the strategy on the days in main_df that have not been simulated yet (see self.n_simulated_days),
+        so a backtest resumed from a checkpoint or extended by Backtest.extend continues where it stopped.
+        If a stop rule is set (nav_floor, max_drawdown), the run stops at the first close meeting it and the reason is kept in self.stop_reason.
+        """
+        Strategy.register_columns(self.columns)
+        self.columns.compute(Strategy.required_columns)
+
+        remaining_days = len(self.main_df) - self.n_simulated_days
+        if simulation_days is None or simulation_days > remaining_days:
+            simulation_days = remaining_days
+
+        days_df = self.main_df.iloc[self.n_simulated_days: self.n_simulated_days + simulation_days]
+        rebalance_trades = self.schedule_rebalancing(Strategy, days_df)
+        peak_nav = max(self.portfolio.nav_history)
+
+        for position, (index, row) in enumerate(days_df.iterrows()):
             Strategy.execute(row)
+            if position in rebalance_trades:
+                self.portfolio.rebalance(row['Date'], Strategy.asset, row['Close'], rebalance_trades[position])
             price_dict = {'equity': {Strategy.asset: row['Close']}}
+            if 'option' in self.portfolio.positions:
+                # option positions held overnight, e.g. longer-dated options
+                self.portfolio.settle_expired_options(row['Date'], row['Close'])
+            if 'option' in self.portfolio.positions:
+                if self.bs_config is None:
+                    raise ValueError("Option positions are held overnight, please set Backtest.bs_config to mark them to market")
+                price_dict['option'] = self.portfolio.mark_options_to_market(row['Date'], row['Close'], self.bs_config, self.data_api)
             has_asset_class = set(self.portfolio.positions.keys())
             asset_class_in_dict = set(price_dict.keys())
             if has_asset_class != asset_class_in_dict:
@@ -67,6 +142,115 @@ class Backtest:
                          f"portfolio contains asset classes: {has_asset_class}.")
                 raise ValueError(error)
             self.portfolio.update(price_dict, Strategy.asset)
+            self.n_simulated_days += 1
+            if self.checkpoint_every and self.n_simulated_days % self.checkpoint_every == 0:
+                self.save_checkpoint()
+            peak_nav = max(peak_nav, self.portfolio.nav_history[-1])
+            self.stop_reason = self.check_stop_rules(row['Date'], peak_nav)
+            if self.stop_reason:
+                break
+
+        if self.checkpoint_path:
+            self.save_checkpoint()
+
+
+    def check_stop_rules(self, date, peak_nav):
+        """
+        Returns the reason to stop the simulation after the close of date, None if no stop rule is met.
+        """
+        nav = self.portfolio.nav_history[-1]
+        if self.nav_floor is not None and nav < self.nav_floor:
+            return f"NAV {nav:.6f} fell below the floor {self.nav_floor} on {date}"
+        drawdown = 1 - nav / peak_nav
+        if self.max_drawdown is not None and drawdown > self.max_drawdown:
+            return f"Drawdown {drawdown:.6f} exceeded {self.max_drawdown} on {date}"
+        return None
+
+
+    def schedule_rebalancing(self, Strategy, days_df):
+        """
+        Returns {position in days_df: equity quantity after rebalancing at the close} of the days rebalanced by self.rebalance_config.
+        The schedule of all days is computed before the daily loop, see Portfolio.rebalance_schedule.
+        """
+        if not self.rebalance_config or self.rebalance_config['rule'] is None or days_df.empty:
+            return {}
+
+        if Strategy.cash_flow_column is not None:
+            self.columns.compute([Strategy.cash_flow_column])
+            cash_flows = self.main_df.loc[days_df.index, Strategy.cash_flow_column].values
+        else:
+            cash_flows = np.zeros(len(days_df))
+        # if the days are a chunk of main_df, the next day tells whether the last day ends a calendar period
+        end = self.n_simulated_days + len(days_df)
+        next_date = self.main_df['Date'].values[end] if end < len(self.main_df) else None
+        schedule = self.portfolio.rebalance_schedule(days_df['Date'].values, days_df['Close'].values, cash_flows, Strategy.asset, self.rebalance_config,
+                                                     next_date=next_date, day_offset=self.n_simulated_days)
+        return dict(zip(schedule['trades']['position'].values, schedule['trades']['quantity_after'].values))
+
+
+    def enable_checkpoints(self, path, every_n_days=20, fetch_chunk_days=20):
+        """
+        Save a checkpoint to path after every chunk of fetched option prices, every every_n_days simulated days and at the end of run.
+        get_option_price fetches fetch_chunk_days days at a time if not given chunk_days, so a crash while fetching loses one chunk at most.
+        """
+        self.checkpoint_path = path
+        self.checkpoint_every = every_n_days
+        self.checkpoint_fetch_days = fetch_chunk_days
+
+
+    def save_checkpoint(self, path=None):
+        """
+        Save the state of the backtest and its portfolio (positions, margin, cash, histories, transaction history and date cursors).
+        Prices cached by data_api (PolygonAPI(cache_prices=True)) are saved too, so fetched prices are not requested again after resuming.
+        The file is replaced atomically, a crash while saving keeps the previous checkpoint.
+        """
+        path = path or self.checkpoint_path
+        if path is None:
+            raise ValueError('No checkpoint path, please use enable_checkpoints or give a path')
+
+        data_api = self.data_api
+        state = {'backtest': self, 'price_cache': getattr(data_api, 'price_cache', None)}
+
+        temp_path = path + '.tmp'
+        self.data_api = None        # API clients are not saved
+        try:
+            with open(temp_path, 'wb') as f:
+                pickle.dump(state, f, protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            self.data_api = data_api
+        os.replace(temp_path, path)
+
+
+    @classmethod
+    def load_checkpoint(cls, path, data_api):
+        """
+        Restore a backtest saved by save_checkpoint. Strategies only hold a reference to the portfolio,
+        create them again with the restored backtest.portfolio, e.g. ZeroCostCollar0DTE(backtest.portfolio, 'SPY', backtest.main_df).
+        """
+        with open(path, 'rb') as f:
+            state = pickle.load(f)
+
+        price_cache = state['price_cache']
+        if price_cache and getattr(data_api, 'price_cache', None) is not None:
+            data_api.price_cache.update(price_cache)
+
+        backtest = state['backtest']
+        backtest.data_api = data_api
+        return backtest
+
+
+    def extend(self, asset_data: pd.DataFrame):
+        """
+        Append the days in asset_data after the last day in main_df, e.g. to extend a completed backtest to a new end_date.
+        Only the new days are fetched by get_option_price and simulated by run.
+        """
+        new_data = asset_data[asset_data['Date'] > self.dates.values[-1]]
+        if new_data.empty:
+            return
+        self.portfolio.extend_dates(new_data['Date'].values)
+        self.main_df = pd.concat([self.main_df, new_data])
+        self.dates = pd.concat([self.dates, new_data['Date']])
+        self.columns.touch(new_data.columns)
 
 
     def get_issues(self):
@@ -104,6 +288,7 @@ class Backtest:
 
         dates_series = self.generate_dates_series_for_plot(length=nav_l)
 
+        import matplotlib.pyplot as plt     # imported on first use to keep importing the backtest engine fast
         plt.figure(figsize=(16, 8))
         plt.plot(dates_series, port_nav, color=[0.2, 0.2, 1, 0.9], linestyle='-', label='IMMF')
         plt.plot(dates_series, normalized_benchmark, color=[0.2, 0.7, 0.2, 0.9], linestyle='-', label='SPY')
@@ -123,6 +308,7 @@ class Backtest:
         equity_exposure = self.portfolio.equity_exposure
         cash_exposure = self.portfolio.cash_exposure
 
+        import matplotlib.pyplot as plt
         plt.figure(figsize=(16, 8))
         plt.plot(dates_series, equity_exposure, color=[0.2, 0.2, 1, 0.9], linestyle='-', label='SPY Exposure')
         plt.plot(dates_series, cash_exposure, color=[0.2, 0.7, 0.2, 0.9], linestyle='-', label='Cash Exposure')
@@ -134,34 +320,55 @@ class Backtest:
         plt.show()
 
 
-    def generate_option_parameters(self, underlying_ticker, spot_price_col, strike_bound_config=None):
+    def generate_option_parameters(self, underlying_ticker, spot_price_col, strike_bound_config=None, day_indices=None):
+        """
+        Generate the option chain parameters (tickers, dates, types, strikes) used to fetch option prices and store them in self.option_data.
+
+        Parameters
+        ----------
+        day_indices: array_like, optional
+            Index labels of main_df for which the chain is generated. Default is all days in main_df.
+            Used by get_option_price to generate the chain a block of days at a time.
+        """
+        day_df = self.main_df if day_indices is None else self.main_df.loc[day_indices]
+        self.add_option_data(Backtest.build_option_parameters(day_df, underlying_ticker, spot_price_col, strike_bound_config, self.strike_columns))
+
+
+    @staticmethod
+    def build_option_parameters(day_df: pd.DataFrame, underlying_ticker, spot_price_col, strike_bound_config=None, strike_columns=None) -> pd.DataFrame:
+        """
+        Option chain parameters of the days in day_df (rows of main_df), see generate_option_parameters.
+        Without strike_bound_config, the options are given by the (option_type, strike column) pairs of strike_columns (see Backtest.strike_columns).
+        """
         spot_price_col = spot_price_col.title()
-        
+
         if strike_bound_config:
             # corresponds to strategy 1
             # For a specific day, generate calls first, then puts
-            spot_prices = self.main_df[spot_price_col].values
-            lower_values = spot_prices * (1 + strike_bound_config['lower_bound'])
-            upper_values = spot_prices * (1 + strike_bound_config['upper_bound'])
-            strike_ranges = [np.arange(int(low), int(high) + 1) for low, high in zip(lower_values, upper_values)]
-            n_strikes = [len(strikes) for strikes in strike_ranges]
-            expanded_strike_ranges = [np.tile(strikes, 2) for strikes in strike_ranges]  # expand for call and put. This is also the total number of options on each day
-            strikes = np.concatenate(expanded_strike_ranges)                            # total number of rows in the entire option chain data
-            option_types = np.concatenate([np.repeat(['call', 'put'], [n, n]) for n in n_strikes])
-            dates = np.repeat(self.main_df['Date'].values, [len(r) for r in expanded_strike_ranges])
-            spot_prices = np.repeat(self.main_df[spot_price_col].values, [len(r) for r in expanded_strike_ranges])
-            indices = np.repeat(self.main_df.index, [len(r) for r in expanded_strike_ranges])
+            spot_prices = day_df[spot_price_col].values
+            lower_strikes = (spot_prices * (1 + strike_bound_config['lower_bound'])).astype(int)
+            upper_strikes = (spot_prices * (1 + strike_bound_config['upper_bound'])).astype(int)
+            n_strikes = upper_strikes - lower_strikes + 1
+            n_options = 2 * n_strikes                                                   # expand for call and put. This is also the total number of options on each day
+            day_positions = np.repeat(np.arange(len(day_df)), n_options)               # total number of rows in the entire option chain data
+            day_offsets = np.concatenate([[0], np.cumsum(n_options)[:-1]])
+            position_in_day = np.arange(len(day_positions)) - np.repeat(day_offsets, n_options)
+            is_put = position_in_day >= n_strikes[day_positions]
+            strikes = lower_strikes[day_positions] + position_in_day - is_put * n_strikes[day_positions]
+            option_types = np.where(is_put, 'put', 'call')
+            dates = day_df['Date'].values[day_positions]
+            spot_prices = spot_prices[day_positions]
+            indices = day_df.index.values[day_positions]
 
         else:
-            # corresponds to strategy 2
-            # Generate all calls together for all days first, then all puts
-            call_strikes = self.main_df['selected_call_strike'].values
-            put_strikes = self.main_df['selected_put_strike'].values
-            strikes = np.concatenate([call_strikes, put_strikes])
-            option_types = np.array(['call'] * len(call_strikes) + ['put'] * len(put_strikes))
-            dates = np.tile(self.main_df['Date'].values, 2)
-            spot_prices = np.tile(self.main_df[spot_price_col].values, 2)
-            indices = np.tile(self.main_df.index, 2)
+            # corresponds to strategy 2 (and the legs of strategy 3)
+            # Generate the options of the first strike column for all days first (all calls for strategy 2), then the next column
+            strike_columns = strike_columns or [('call', 'selected_call_strike'), ('put', 'selected_put_strike')]
+            strikes = np.concatenate([day_df[col].values for _, col in strike_columns])
+            option_types = np.repeat([option_type for option_type, _ in strike_columns], len(day_df))
+            dates = np.tile(day_df['Date'].values, len(strike_columns))
+            spot_prices = np.tile(day_df[spot_price_col].values, len(strike_columns))
+            indices = np.tile(day_df.index, len(strike_columns))
 
         underlying_tickers = np.array([underlying_ticker] * len(strikes))
         option_tickers = generate_option_ticker_vectorized(underlying_tickers, dates, option_types, strikes)
@@ -175,16 +382,148 @@ class Backtest:
             'spot_price': spot_prices,
             'main_df_index': indices
             })
-        
-        self.add_option_data(option_data)
+
+        return option_data
+
+
+    def init_option_price_columns(self):
+        for option_type in ['call', 'put']:
+            col_name = f"{option_type}_price_at_open"
+            if col_name not in self.main_df.columns:
+                self.main_df[col_name] = np.nan
+        if 'bs_fallback' not in self.main_df.columns:
+            self.main_df['bs_fallback'] = False     # True if any option price fetched for that day was calculated by the BS model
+
+
+    def update_option_price_columns(self):
+        """
+        copy open prices in self.option_data to the call/put open price columns of main_df (the last option of each day and type),
+        and flag days with any option priced by the BS model
+        """
+        for option_type in ['call', 'put']:
+            sub_df = self.option_data[self.option_data['option_type'] == option_type].drop_duplicates('main_df_index', keep='last')
+            self.main_df.loc[sub_df['main_df_index'].values, f"{option_type}_price_at_open"] = sub_df['open_price'].values
+
+        if 'price_source' in self.option_data.columns:
+            is_bs = (self.option_data['price_source'] == 'bs').groupby(self.option_data['main_df_index'].values).any()
+            self.main_df.loc[is_bs.index, 'bs_fallback'] = is_bs.values
+
+        self.columns.touch(['call_price_at_open', 'put_price_at_open', 'bs_fallback'])
+
+
+    def fetch_option_prices(self, option_data, bs_config, open_price_config, strike_bound_config=None):
+        """
+        fetch prices of the options in option_data, adaptively from the money if strike_bound_config['adaptive'] is True. Returns the priced option data
+        """
+        if strike_bound_config and strike_bound_config.get('adaptive'):
+            return self.fetch_option_prices_adaptive(option_data, bs_config, open_price_config, strike_bound_config['cost_tolerance'], strike_bound_config.get('ring_width', 1))
+
+        option_data = self.fetch_listed_option_prices(option_data, bs_config, open_price_config)
+        if bs_config.get('vol_model') == 'smile':
+            self.price_fallbacks_with_smiles(option_data, bs_config)
+        return option_data
+
+
+    def fetch_listed_option_prices(self, option_data, bs_config, open_price_config):
+        """
+        fetch prices of the options in option_data, options known to be not listed by self.contract_index are priced by the BS model without requests
+        """
+        listed = None
+        if self.contract_index is not None:
+            listed = self.contract_index.is_listed(option_data['option_tickers'].values, option_data['date_from'].values)
+        return self.data_api.try_get_polygon_price_multithread(option_data, open_price_config['bar_multiplier'], open_price_config['bar_timespan'], 
+                                                              open_price_config['price_type'], bs_config, listed=listed)
+
+
+    def price_fallbacks_with_smiles(self, option_data, bs_config):
+        """
+        Re-price the options in option_data without price data (price_source 'bs') in one batch, with the vol given by the smile of their day
+        instead of the constant bs_config['vol']. Smiles are fitted to the implied vols of the fetched prices of the same day (see utils.vol_smile)
+        and cached in self.vol_smiles. Days without any fetched price keep using bs_config['vol'].
+        """
+        is_bs = (option_data['price_source'] == 'bs').values
+        if not is_bs.any():
+            return option_data
+
+        day_ids = option_data['main_df_index'].values
+        fit_mask = ~is_bs & np.isin(day_ids, day_ids[is_bs])       # only refit days which need a fallback
+        k = log_moneyness(get_strike(option_data).values, option_data['spot_price'].values, bs_config['time_to_expiration'], bs_config['r'], bs_config['q'])
+        if fit_mask.any():
+            smiles = fit_vol_smiles(day_ids[fit_mask], k[fit_mask], implied_vols_from_prices(option_data[fit_mask], bs_config))
+            cached = self.vol_smiles.drop(smiles.index, errors='ignore') if self.vol_smiles is not None else None
+            self.vol_smiles = pd.concat([cached, smiles]) if cached is not None else smiles
+
+        vols = smile_vols(self.vol_smiles, day_ids[is_bs], k[is_bs], bs_config['vol']) if self.vol_smiles is not None else bs_config['vol']
+        option_data.loc[is_bs, 'open_price'] = blackscholes_price(
+            K=get_strike(option_data).values[is_bs],
+            S=option_data['spot_price'].values[is_bs],
+            T=bs_config['time_to_expiration'],
+            vol=vols,
+            r=bs_config['r'],
+            q=bs_config['q'],
+            callput=np.asarray(option_data['option_type'].values[is_bs], dtype=str)
+        )
+        return option_data
+
+
+    def fetch_option_prices_adaptive(self, option_data, bs_config, open_price_config, cost_tolerance, ring_width=1):
+        """
+        Fetch the strategy 1 option chain outward from the money, ring by ring.
+        Ring r of a day contains the calls and puts with strikes whose distance to the spot price is in [r * ring_width, (r + 1) * ring_width).
+        After each ring, a day stops widening once its best zero-cost collar among the fetched options costs at most cost_tolerance in absolute value,
+        or once all strikes within the bounds are fetched. Returns the fetched options, options that are never fetched are removed.
+        """
+        rings = (np.abs(option_data['strike'].values - option_data['spot_price'].values) // ring_width).astype(int)
+        active_days = set(option_data['main_df_index'].values)
+        fetched = []
+
+        for ring in range(rings.max() + 1):
+            to_fetch = option_data[(rings == ring) & option_data['main_df_index'].isin(active_days).values]
+            if not to_fetch.empty:
+                fetched.append(self.fetch_listed_option_prices(to_fetch.copy(), bs_config, open_price_config))
+            if not fetched:         # no listed strike this close to the spot yet, widen the ring
+                continue
+            fetched_df = pd.concat(fetched)
+            if bs_config.get('vol_model') == 'smile':
+                self.price_fallbacks_with_smiles(fetched_df, bs_config)
+            cube = OptionPriceCube.from_option_data(fetched_df[fetched_df['main_df_index'].isin(active_days)])
+
+            for position, index in enumerate(cube.day_labels):
+                _, call_prices = cube.day_chain(position, 'call')
+                _, put_prices = cube.day_chain(position, 'put')
+                if len(call_prices) and len(put_prices):
+                    i, j = find_indices_closest_to_zero_sum(-call_prices, put_prices)
+                    if abs(put_prices[j] - call_prices[i]) <= cost_tolerance:
+                        active_days.discard(index)
+            if not active_days:
+                break
+
+        # keep the original order of the option chain, calls then puts by strike on each day
+        return fetched_df.loc[option_data.index.intersection(fetched_df.index)]
+
+
+    def iter_day_chunks(self, chunk_days=None, start=0):
+        """
+        Yield index labels of main_df from the start-th day in consecutive blocks of chunk_days days. Yield all these days at once if chunk_days is None.
+        """
+        days = self.main_df.index[start:]
+        if chunk_days is None:
+            if len(days):
+                yield days
+            return
+        if chunk_days <= 0:
+            raise ValueError('chunk_days must be a positive integer')
+        for chunk_start in range(0, len(days), chunk_days):
+            yield days[chunk_start: chunk_start + chunk_days]
                 
 
 
-    def get_option_price(self, underlying_ticker: str, bs_config: dict, open_price_config, strike_bound_config: dict=None, ): 
+    def get_option_price(self, underlying_ticker: str, bs_config: dict, open_price_config, strike_bound_config: dict=None, chunk_days: int=None, select_options_func=None): 
         
         """
         Fetch the price of a 0DTE (Zero Days to Expiration) option at market open using the Polygon.io API.
-        If price data is not available on Polygon.io, the BS model will be used to calculate price, which will print relevant info
+        If price data is not available on Polygon.io, the BS model will be used to calculate price. The source of every price is recorded in
+        option_data['price_source'] ('polygon', 'bs' or 'cache') and days with any BS price are flagged in main_df['bs_fallback'].
         
         Parameters
         ----------
@@ -195,6 +534,8 @@ class Backtest:
             The column in backtest's main_df that would be used as spot price in the BS model. This is also the time point used to fetch price data
     
         strike_bound_config:
+            zero_cost_search_config of strategy 1. If strike_bound_config['adaptive'] is True, strikes are fetched outward from the money 
+            and a day stops widening once a collar within strike_bound_config['cost_tolerance'] is found, see fetch_option_prices_adaptive.
         
         bar_multiplier : int, optional
             The duration of each bar in bar_timespan. This defines the time span for the aggregated bar data. Default is 3 seconds.
@@ -206,34 +547,141 @@ class Backtest:
             The price type used to determine the market ”opening price“. Possible values are 'open', 'high', 'low', 'close', and 'vwap'. Default is 'vwap'.
             'vwap' is the volume weighted average price, calculated by dividing the total dollar amount traded by the total volume traded during a bar.
 
+        chunk_days : int, optional
+            If given, the option chain is generated, fetched, selected and discarded chunk_days days at a time, so peak memory is bounded by 
+            the chunk size instead of the whole backtest period. Default is None, which processes all days at once,
+            or self.checkpoint_fetch_days days at a time if checkpoints are enabled (and select_options_func is given for strategy 1).
+
+        select_options_func : callable, optional
+            Called with this Backtest instance after the prices of each chunk are fetched, e.g. ZeroCostCollar0DTE.find_zero_cost_collar.
+            Required in chunked mode for strategy 1, because self.option_data only holds the last chunk afterwards and is then discarded.
+
+        Only days after self.n_priced_days are fetched, so a backtest resumed from a checkpoint or extended by Backtest.extend
+        doesn't fetch the same days again. A checkpoint is saved after every chunk if checkpoints are enabled.
+
         Example
         -------
         If `bar_multiplier` is set to 3 and `price_type` is 'vwap', the function will return the volume weighted average price within the first 3 seconds after the market opens at 9:30 AM ET.
         """
-        
-        self.generate_option_parameters(underlying_ticker, bs_config['spot_price_col'], strike_bound_config)
-        self.option_data, bs_days = self.data_api.try_get_polygon_price_multithread(self.option_data, open_price_config['bar_multiplier'], open_price_config['bar_timespan'], open_price_config['price_type'], bs_config)
-       
-        for option_type in ['call', 'put']:
-            col_name = f"{option_type}_price_at_open"
-            self.main_df[col_name] = np.nan
-
-        for index, row in self.option_data.iterrows():
-            main_df_index = row['main_df_index']
-            option_type = row['option_type']
-            price = row['open_price']
-            column_name = f"{option_type}_price_at_open"
-            self.main_df.at[main_df_index, column_name] = price
+        if chunk_days is None and self.checkpoint_path and (select_options_func is not None or not strike_bound_config):
+            chunk_days = self.checkpoint_fetch_days         # checkpoint the fetch progress after every chunk
+        if chunk_days is not None and strike_bound_config and select_options_func is None:
+            raise ValueError('select_options_func is required to fetch option prices in chunks for strategy 1')
+
+        self.bs_config = bs_config
+        self.init_option_price_columns()
+        n_bs_options = 0
+
+        for day_indices in self.iter_day_chunks(chunk_days, start=self.n_priced_days):
+            self.generate_option_parameters(underlying_ticker, bs_config['spot_price_col'], strike_bound_config, day_indices)
+            self.option_data = self.fetch_option_prices(self.option_data, bs_config, open_price_config, strike_bound_config)
+            n_bs_options += int((self.option_data['price_source'] == 'bs').sum())
+            if self.compact_schema:
+                self.compact_option_data()
+            self.update_option_price_columns()
+            if select_options_func is not None:
+                select_options_func(self)
+            self.n_priced_days += len(day_indices)
+            if self.checkpoint_path:
+                self.save_checkpoint()
+
+        if chunk_days is not None:
+            self.option_data = None         # the chain of the last chunk has been selected already, discard it
     
-        if bs_days:
+        self.print_price_sources(n_bs_options)
+
+
+    def print_price_sources(self, n_bs_options):
+        if n_bs_options:
             print('')
-            print("Used BS model on the following days and options:")
-            for day in bs_days:
-                print(day)
+            print(f"Used BS model for {n_bs_options} options on {int(self.main_df['bs_fallback'].sum())} days. "
+                  f"See main_df['bs_fallback'] and option_data['price_source'] for details.")
         else:
             print("BS model is not used. All prices are sourced from Polygon.io.")
 
 
+    def run_pipelined(self, Strategy, underlying_ticker: str, bs_config: dict, open_price_config, strike_bound_config: dict=None,
+                      select_options_func=None, chunk_days=20, prefetch_chunks=2):
+        """
+        Fetch option prices and run the strategy chunk_days days at a time, with the prices of the next chunks fetched by a background thread
+        while the current chunk is selected and simulated, so the network and the simulation overlap instead of running one after the other.
+
+        The fetching thread generates and prices the option chain of each chunk (see get_option_price) and puts it in a queue of at most
+        prefetch_chunks chunks, so it blocks when it is that far ahead of the simulation and memory is bounded by prefetch_chunks + 1 chunks.
+        This thread takes the chunks in order, updates the open price columns, selects options with select_options_func and runs the chunk.
+        If a chunk fails (e.g. a fetch error or not enough cash), fetching stops and the error is raised here.
+        If a stop rule is met (see run), the remaining chunks are neither fetched nor simulated.
+
+        Strategy 2 options must be selected before (Strategy.select_options), select_options_func is required for strategy 1
+        (e.g. ZeroCostCollar0DTE.find_zero_cost_collar). Days already priced but not simulated are run first without fetching.
+        """
+        if strike_bound_config and select_options_func is None:
+            raise ValueError('select_options_func is required to run strategy 1 pipelined')
+        if prefetch_chunks < 1:
+            raise ValueError('prefetch_chunks must be a positive integer')
+
+        self.bs_config = bs_config
+        self.init_option_price_columns()
+        if self.n_simulated_days < self.n_priced_days:
+            self.run(Strategy, self.n_priced_days - self.n_simulated_days)
+            if self.stop_reason:
+                return
+
+        day_chunks = list(self.iter_day_chunks(chunk_days, start=self.n_priced_days))
+        chain_inputs = self.main_df.iloc[self.n_priced_days:].copy()     # the fetching thread only reads this copy, main_df is written here
+        chunks = queue.Queue(maxsize=prefetch_chunks)
+        stop = threading.Event()
+
+        def put(item):
+            while not stop.is_set():
+                try:
+                    chunks.put(item, timeout=0.1)
+                    return True
+                except queue.Full:
+                    continue
+            return False
+
+        def fetch_chunks():
+            try:
+                for day_indices in day_chunks:
+                    option_data = Backtest.build_option_parameters(chain_inputs.loc[day_indices], underlying_ticker, bs_config['spot_price_col'],
+                                                                   strike_bound_config, self.strike_columns)
+                    if not put((day_indices, self.fetch_option_prices(option_data, bs_config, open_price_config, strike_bound_config))):
+                        return
+            except Exception as e:
+                put((None, e))
+                return
+            put((None, None))
+
+        fetcher = threading.Thread(target=fetch_chunks, daemon=True)
+        fetcher.start()
+        n_bs_options = 0
+        try:
+            while True:
+                day_indices, option_data = chunks.get()
+                if day_indices is None:
+                    if option_data is not None:
+                        raise option_data
+                    break
+                self.option_data = option_data
+                n_bs_options += int((option_data['price_source'] == 'bs').sum())
+                if self.compact_schema:
+                    self.compact_option_data()
+                self.update_option_price_columns()
+                if select_options_func is not None:
+                    select_options_func(self)
+                self.n_priced_days += len(day_indices)
+                self.run(Strategy, len(day_indices))
+                if self.stop_reason:
+                    break
+        finally:
+            stop.set()
+            fetcher.join()
+
+        self.option_data = None         # the chain of the last chunk has been selected already, discard it
+        self.print_price_sources(n_bs_options)
+
+
 
 
     """
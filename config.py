@@ -14,7 +14,10 @@ strategy_selected = 1
 # For Strategy 1
 zero_cost_search_config = {
     'upper_bound': 0.005,
-    'lower_bound': -0.005
+    'lower_bound': -0.005,
+    'adaptive': False,          # fetch strikes outward from the money and stop once a collar within cost_tolerance is found
+    'cost_tolerance': 0.01,
+    'ring_width': 1
 }
 
 # For Strategy 2
@@ -30,13 +33,32 @@ strike_selection_config = {
     'call_K_adjust': 0
 }
 
+# For Strategy 3, a structure of 0DTE options traded on the whole equity position every day
+structure_config = {
+    'base_price': 'Open',
+    'legs': 'collar'        # a preset in strategies.STRUCTURE_PRESETS ('collar', 'put_spread', 'seagull', 'iron_condor') or a list of legs:
+                            # {'option_type': 'put', 'side': 'long', 'ratio': 1, 'K_multiplier': 0.99, 'K_adjust': 0, 'K_method': 'floor'}
+}
+
+# Rebalancing of the equity position at the close, trades are scheduled before the simulation
+rebalance_config = {
+    'rule': None,           # None, 'calendar', 'band' (tolerance band) or 'calendar_band' (calendar days on which the drift exceeds tolerance)
+    'frequency': 'M',       # 'W', 'M', 'Q', 'Y' (last trading day of the period) or an int n (every n trading days)
+    'tolerance': 0.05       # max absolute drift of the equity or cash weight from portolio_weights_config
+}
+
+# Fetch option prices this many days at a time (memory bounded by the chunk, a checkpoint is saved after every chunk if enabled).
+# None fetches all days at once, or Backtest.checkpoint_fetch_days at a time when checkpoints are enabled
+fetch_chunk_days = None
+
 # Black-Scholes Model Assumptions
 bs_config = {
     'q': 0,
     'vol': 0.15,
     'r': 0.05,
     'time_to_expiration': 1/365,
-    'spot_price_col': 'open'        
+    'spot_price_col': 'open',
+    'vol_model': 'constant'         # 'constant' uses vol above for options without price data, 'smile' uses a smile fitted to the fetched prices of that day
 }
 
 # Option Open Price Reference
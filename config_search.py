@@ -0,0 +1,186 @@
+"""
+Adaptive search over strategy configs with successive halving and early stopping.
+
+Candidates are sampled from a search space and simulated on a short window first. Every run stops at the first close where NAV
+falls below the NAV floor (or the drawdown exceeds max_drawdown), so configs breaching the floor in their first months cost only
+the days until the breach. After each rung, the best 1/eta of the candidates that didn't breach are extended to a window eta times longer
+(Backtest.extend continues where they stopped, nothing is simulated twice). When breaches leave fewer survivors than that, the freed
+slots go to new candidates sampled around the survivors, which are simulated from the start of the backtest.
+
+    space = {
+        'collateral_ratio': (1.0, 1.5),                              # (low, high) is sampled uniformly
+        'zero_cost_search_config.lower_bound': (-0.05, -0.005),
+        'zero_cost_search_config.upper_bound': (0.005, 0.05),
+        'strategy_selected': [1]                                     # a list is sampled from its values
+    }
+    result = successive_halving(space, get_spy_data('0000-00-00', '9999-99-99'), PolygonAPI(api_key, cache_prices=True))
+    result['trials'].head(), result['best']
+
+Nested config keys are written as '<config key>.<key>'. If collateral_ratio is searched without the cash weight,
+the cash weight is collateral_ratio - equity weight, as Portfolio requires weights summing to collateral_ratio.
+"""
+import copy
+import math
+import random
+
+import pandas as pd
+
+from pipeline import make_config, prepare_backtest, extend_backtest, simulate, summarize, select_dates, NAV_FLOOR
+
+
+def sample_candidate(space: dict, rng: random.Random) -> dict:
+    """
+    Returns {parameter: value} with a value drawn for every parameter of space.
+    """
+    return {path: rng.choice(list(values)) if isinstance(values, list) else rng.uniform(*values) for path, values in space.items()}
+
+
+def perturb_candidate(params: dict, space: dict, rng: random.Random, scale=0.1) -> dict:
+    """
+    A candidate near params: numeric parameters move by a normal step of scale x the width of their range (clipped to the range),
+    list parameters move to a neighbouring value with probability 1/2.
+    """
+    new_params = {}
+    for path, values in space.items():
+        if isinstance(values, list):
+            position = values.index(params[path]) + rng.choice([-1, 0, 0, 1])
+            new_params[path] = values[min(max(position, 0), len(values) - 1)]
+        else:
+            low, high = values
+            new_params[path] = min(max(params[path] + rng.gauss(0, scale * (high - low)), low), high)
+    return new_params
+
+
+def candidate_config(params: dict, base_overrides: dict=None) -> dict:
+    """
+    Config of a candidate, params override base_overrides which override config.py.
+    """
+    overrides = copy.deepcopy(base_overrides or {})
+    for path, value in params.items():
+        key, _, sub_key = path.partition('.')
+        if sub_key:
+            overrides.setdefault(key, {})[sub_key] = value
+        else:
+            overrides[key] = value
+
+    config = make_config(overrides)
+    if 'collateral_ratio' in params and 'portolio_weights_config.cash' not in params:
+        weights = config['portolio_weights_config']
+        weights['cash'] = config['collateral_ratio'] - weights['equity']
+        config['collateral_ratio'] = sum(weights.values())      # the exact sum, Portfolio checks the weights sum to collateral_ratio
+    return config
+
+
+def window_end_dates(asset_data: pd.DataFrame, start_date, end_date, min_days, eta) -> list:
+    """
+    Last day of each rung: rung r covers the first min_days * eta ** r trading days, the last rung covers all days.
+    """
+    dates = select_dates(asset_data, start_date, end_date)['Date'].values
+    if len(dates) == 0:
+        raise ValueError(f"No trading days between {start_date} and {end_date}")
+
+    end_dates = []
+    n_days = min_days
+    while n_days < len(dates):
+        end_dates.append(dates[n_days - 1])
+        n_days *= eta
+    return end_dates + [dates[-1]]
+
+
+def run_trial(trial: dict, end_date, asset_data, data_api, nav_floor, max_drawdown):
+    """
+    Simulate a trial up to end_date, from the start of the backtest for a new trial, from the day it stopped otherwise.
+    """
+    trial['config']['end_date'] = end_date
+    if trial['backtest'] is None:
+        trial['backtest'], trial['strategy'] = prepare_backtest(trial['config'], asset_data, data_api)
+        trial['backtest'].nav_floor = nav_floor
+        trial['backtest'].max_drawdown = max_drawdown
+    else:
+        extend_backtest(trial['backtest'], trial['strategy'], trial['config'], asset_data)
+
+    n_days_before = trial['backtest'].n_simulated_days
+    error = None
+    try:
+        simulate(trial['backtest'], trial['strategy'])
+    except Exception as e:
+        error = str(e)      # e.g. not enough cash, the trial is eliminated like a breach
+    trial['metrics'] = summarize(trial['backtest'], error)
+    trial['simulated_days'] += trial['backtest'].n_simulated_days - n_days_before
+
+
+def trial_score(trial: dict, objective, nav_floor=NAV_FLOOR):
+    """
+    Trials whose NAV fell below nav_floor (the floor of the search), met a stop rule or failed rank last, the others by objective (higher is better).
+    """
+    metrics = trial['metrics']
+    breached = nav_floor is not None and metrics['min_nav'] < nav_floor
+    eliminated = breached or metrics['stop_reason'] is not None or metrics['error'] is not None
+    return (not eliminated, metrics[objective])
+
+
+def successive_halving(space: dict, asset_data: pd.DataFrame, data_api, base_overrides: dict=None, n_candidates=27, eta=3, min_days=21,
+                       nav_floor=NAV_FLOOR, max_drawdown=None, objective='final_nav', perturb_scale=0.1, seed=0) -> dict:
+    """
+    Search space (see module docstring) for the config with the best objective ('final_nav' or 'min_nav') that doesn't breach nav_floor.
+
+    Parameters
+    ----------
+    base_overrides: dict
+        Config overrides shared by all candidates (see pipeline.make_config), including start_date and end_date of the whole search.
+    n_candidates, eta, min_days: int
+        n_candidates are simulated on the first min_days trading days, the best 1/eta of them on eta times more days, and so on.
+    nav_floor, max_drawdown: float
+        Stop rules of every run (see Backtest.run). A trial meeting one is eliminated.
+
+    Returns
+    -------
+    dict
+        'trials': pd.DataFrame with the parameters, rung reached, simulated days and metrics of every trial, best first,
+        'best': parameters of the best trial that covered all days without being eliminated (None if none did),
+        'simulated_days': days simulated by the search, 'grid_days': days a full run of n_candidates candidates would simulate.
+    """
+    if objective not in ['final_nav', 'min_nav']:
+        raise ValueError("objective must be 'final_nav' or 'min_nav'")
+    rng = random.Random(seed)
+    base_config = make_config(base_overrides)
+    end_dates = window_end_dates(asset_data, base_config['start_date'], base_config['end_date'], min_days, eta)
+
+    def new_trial(params):
+        return {'params': params, 'config': candidate_config(params, base_overrides), 'backtest': None, 'strategy': None,
+                'metrics': None, 'rung': None, 'simulated_days': 0}
+
+    trials = [new_trial(sample_candidate(space, rng)) for _ in range(n_candidates)]
+    active = list(trials)
+    for rung, end_date in enumerate(end_dates):
+        for trial in active:
+            run_trial(trial, end_date, asset_data, data_api, nav_floor, max_drawdown)
+            trial['rung'] = rung
+        if rung == len(end_dates) - 1:
+            break
+
+        ranked = sorted(active, key=lambda trial: trial_score(trial, objective, nav_floor), reverse=True)
+        n_keep = max(math.ceil(len(active) / eta), 1)
+        survivors = [trial for trial in ranked[:n_keep] if trial_score(trial, objective, nav_floor)[0]]
+        # slots of eliminated trials go to new candidates near the survivors, simulated from the start on the next window
+        refills = [new_trial(perturb_candidate(rng.choice(survivors)['params'], space, rng, perturb_scale) if survivors else sample_candidate(space, rng))
+                   for _ in range(n_keep - len(survivors))]
+        trials += refills
+        active = survivors + refills
+
+    for trial in trials:
+        trial['backtest'] = trial['strategy'] = None        # release memory of the simulations
+    rows = [{**trial['params'], 'rung': trial['rung'], 'simulated_days': trial['simulated_days'], **trial['metrics'],
+             'breached_nav_floor': nav_floor is not None and trial['metrics']['min_nav'] < nav_floor}
+            for trial in sorted(trials, key=lambda trial: (trial['rung'],) + trial_score(trial, objective, nav_floor), reverse=True)]
+    trials_df = pd.DataFrame(rows)
+    finished = [trial for trial in trials if trial['rung'] == len(end_dates) - 1 and trial_score(trial, objective, nav_floor)[0]]
+    best = max(finished, key=lambda trial: trial_score(trial, objective, nav_floor)) if finished else None
+    n_days = len(select_dates(asset_data, base_config['start_date'], base_config['end_date']))
+
+    return {
+        'trials': trials_df,
+        'best': best['params'] if best else None,
+        'simulated_days': int(trials_df['simulated_days'].sum()),
+        'grid_days': n_candidates * n_days
+    }
@@ -0,0 +1,127 @@
+"""
+Sweeps of backtest configs over several hosts. Configs are submitted as jobs to a queue on a shared directory (utils.DirectoryJobQueue)
+or in a local SQLite database (utils.SQLiteJobQueue), workers on any number of hosts claim jobs with a lease, run them with
+pipeline.run_backtest and write one result row per config back to the queue. Jobs of workers which stopped renewing their lease
+(e.g. a crashed host) are requeued.
+
+Submit a sweep:
+    queue = open_job_queue('/mnt/shared/sweep-cr')
+    submit_sweep(queue, [{'collateral_ratio': c, 'portolio_weights_config': {'equity': 0.8, 'cash': c - 0.8}} for c in np.arange(1, 1.5, 0.01)])
+
+Start workers on every host mounting the queue directory, e.g. one per core:
+    python distributed_sweep.py /mnt/shared/sweep-cr --api-key <polygon api key> --workers 8
+
+Collect the results (also while workers are running):
+    sweep_results(queue)
+"""
+import os
+import time
+import socket
+import argparse
+import threading
+import concurrent.futures
+
+import pandas as pd
+
+from data_processing import get_spy_data
+from pipeline import make_config, run_backtest
+from utils import PolygonAPI, StageCache, open_job_queue
+
+
+def submit_sweep(queue, configs) -> list:
+    """
+    Submit one job per config, configs are overrides of config.py (see pipeline.make_config). Returns the job ids.
+    Configs already in the queue are not submitted again, so a sweep can be extended by submitting the whole grid again.
+    """
+    return queue.submit([make_config(config) for config in configs])
+
+
+def default_worker_id():
+    return f"{socket.gethostname()}-{os.getpid()}"
+
+
+def keep_lease(queue, job_id, worker_id, stop: threading.Event):
+    while not stop.wait(queue.lease_seconds / 3):
+        if not queue.heartbeat(job_id, worker_id):
+            return
+
+
+def run_worker(queue, data_api, asset_data: pd.DataFrame=None, worker_id=None, stage_cache: StageCache=None, poll_seconds=5,
+               stop_when_empty=True, max_jobs=None) -> int:
+    """
+    Claim and run jobs until the queue has no pending job (or forever if stop_when_empty is False). Returns the number of jobs completed.
+    The lease of the running job is renewed by a background thread. Simulation errors (e.g. not enough cash) are results,
+    other errors (e.g. fetching) are reported with queue.fail and the job is retried up to queue.max_attempts times.
+    """
+    asset_data = asset_data if asset_data is not None else get_spy_data('0000-00-00', '9999-99-99')
+    worker_id = worker_id or default_worker_id()
+    n_jobs = 0
+
+    while max_jobs is None or n_jobs < max_jobs:
+        job = queue.claim(worker_id)
+        if job is None:
+            if stop_when_empty and not queue.status()['running']:
+                break
+            time.sleep(poll_seconds)        # running jobs may still be requeued
+            continue
+
+        stop = threading.Event()
+        lease_keeper = threading.Thread(target=keep_lease, args=(queue, job['job_id'], worker_id, stop), daemon=True)
+        lease_keeper.start()
+        t0 = time.time()
+        try:
+            result = run_backtest(job['config'], asset_data, data_api, stage_cache=stage_cache)
+        except Exception as e:
+            queue.fail(job['job_id'], worker_id, f"{type(e).__name__}: {e}")
+            continue
+        finally:
+            stop.set()
+            lease_keeper.join()
+
+        # a result finished after the lease expired is discarded, the requeued job is run again
+        if queue.complete(job['job_id'], worker_id, {'job_id': job['job_id'], 'worker_id': worker_id, 'seconds': round(time.time() - t0, 4),
+                                                     'config': job['config'], 'metrics': result['metrics']}):
+            n_jobs += 1
+
+    return n_jobs
+
+
+def worker_process(queue_path, api_key=None, lease_seconds=300, stage_cache_path=None, poll_seconds=5, stop_when_empty=True) -> int:
+    """
+    Entry point of a worker process, with its own Polygon client and price cache.
+    """
+    queue = open_job_queue(queue_path, lease_seconds)
+    stage_cache = StageCache(stage_cache_path) if stage_cache_path else None
+    return run_worker(queue, PolygonAPI(api_key, cache_prices=True), stage_cache=stage_cache, poll_seconds=poll_seconds, stop_when_empty=stop_when_empty)
+
+
+def sweep_results(queue) -> pd.DataFrame:
+    """
+    One row per completed job: job_id, worker_id, seconds, the config with nested keys flattened (e.g. 'bs_config.vol') and the metrics
+    of pipeline.summarize.
+    """
+    results = queue.results()
+    if not results:
+        return pd.DataFrame()
+    configs = pd.json_normalize([result['config'] for result in results])
+    metrics = pd.DataFrame([result['metrics'] for result in results])
+    jobs = pd.DataFrame([{key: result[key] for key in ['job_id', 'worker_id', 'seconds']} for result in results])
+    return pd.concat([jobs, configs, metrics], axis=1)
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run sweep workers on a shared job queue.')
+    parser.add_argument('queue', help='directory of a DirectoryJobQueue, or a .sqlite/.db file of a SQLiteJobQueue')
+    parser.add_argument('--api-key', default=os.environ.get('POLYGON_API_KEY'))
+    parser.add_argument('--workers', type=int, default=1, help='number of worker processes on this host')
+    parser.add_argument('--lease-seconds', type=float, default=300)
+    parser.add_argument('--stage-cache', default=None, help='directory of a stage artifact cache (utils.StageCache), not cached if not given')
+    parser.add_argument('--poll-seconds', type=float, default=5)
+    parser.add_argument('--keep-running', action='store_true', help='wait for new jobs instead of stopping when the queue is empty')
+    args = parser.parse_args()
+
+    worker_args = (args.queue, args.api_key, args.lease_seconds, args.stage_cache, args.poll_seconds, not args.keep_running)
+    with concurrent.futures.ProcessPoolExecutor(args.workers) as executor:
+        n_jobs = sum(executor.map(worker_process, *zip(*[worker_args] * args.workers)))
+    print(f"{n_jobs} jobs run, queue status: {open_job_queue(args.queue).status()}")
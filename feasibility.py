@@ -0,0 +1,167 @@
+"""
+Check that a strategy has enough cash and margin for its orders on every day before running it.
+
+Portfolio.execute_orders rejects a basket when the cash left by the previous orders doesn't cover an order, and run stops there.
+The daily orders of a strategy (Strategy.order_schedule) are linear in the equity position, so the cash each order needs and
+releases is computed for all days and orders in one array pass, together with the cash at every open from the rebalance schedule
+(see utils.rebalance_schedule). All days without enough cash are returned at once, without simulating any day.
+
+After fetching, the check uses the fetched prices and is exact up to floating point rounding:
+    backtest, strategy = prepare_backtest(config, asset_data, data_api)
+    check_feasibility(backtest, strategy)
+
+Before fetching, option prices are estimated with the BS model of config['bs_config'], without any request, so a sweep can drop
+configs which would run out of cash:
+    configs = [config for config in configs if estimate_feasibility(config, asset_data).empty]
+"""
+import numpy as np
+import pandas as pd
+
+from backtest import Backtest
+from portfolio import ORDER_ACTIONS
+from pipeline import prepare_backtest, needs_initial_buy, initial_equity_quantity
+from utils.polygon_functions import add_prices_with_bs_fallback
+
+
+NO_REBALANCE = {'rule': None, 'frequency': 'M', 'tolerance': 0}
+
+
+def basket_requirements(orders: list) -> dict:
+    """
+    Cash needed by the orders of Strategy.order_schedule on every day, per unit of the underlying position, with the rules of
+    Portfolio.execute_orders: an order is accepted if the cash left by the previous orders of the day covers it.
+
+    Returns
+    -------
+    dict
+        'order_required_cash': (n_days, n_orders) cash needed at the open for each order to be accepted (-inf for sells),
+        'required_cash': (n_days,) cash needed at the open so that every order is accepted, NaN if a price is missing,
+        'net_cash_flow': (n_days,) cash received by the basket, 'margin': (n_days,) peak balance of the margin accounts of short orders.
+    """
+    amounts = np.column_stack([np.asarray(order['price'], dtype=float) * order.get('ratio', 1) for order in orders])
+    needs = np.empty_like(amounts)          # cash needed by each order
+    deltas = np.empty_like(amounts)         # cash received by each order
+    margin_changes = np.zeros_like(amounts)
+    margins = {}                            # {leg: margin balance per day}
+
+    for k, order in enumerate(orders):
+        amount, leverage = amounts[:, k], order.get('leverage', 1)
+        if order['action'] == 'buy':
+            needs[:, k] = amount / leverage
+            deltas[:, k] = -amount / leverage
+        elif order['action'] == 'sell':
+            needs[:, k] = np.where(np.isnan(amount), np.nan, -np.inf)
+            deltas[:, k] = amount
+        elif order['action'] == 'short':
+            needs[:, k] = amount / leverage
+            deltas[:, k] = amount - amount / leverage
+            margin_changes[:, k] = amount / leverage
+            margins[order['leg']] = margins.get(order['leg'], 0) + amount / leverage
+        elif order['action'] == 'cover_short':
+            margin = margins.pop(order['leg'], 0)          # the margin of the leg is released by the cover
+            needs[:, k] = amount - margin
+            deltas[:, k] = margin - amount
+            margin_changes[:, k] = -margin
+        else:
+            raise ValueError(f"Unknown action {order['action']}, please use one of {ORDER_ACTIONS}")
+
+    # cash needed at the open for order k: its need minus the cash received by the orders before it
+    required = needs - (np.cumsum(deltas, axis=1) - deltas)
+    return {
+        'order_required_cash': required,
+        'required_cash': required.max(axis=1),
+        'net_cash_flow': deltas.sum(axis=1),
+        'margin': np.cumsum(margin_changes, axis=1).max(axis=1)
+    }
+
+
+def check_feasibility(backtest: Backtest, strategy, all_days=False) -> pd.DataFrame:
+    """
+    Check the days of backtest not simulated yet, with the option prices in backtest.main_df (see Strategy.order_schedule)
+    and the equity buy at the first open and the rebalancing trades of backtest.rebalance_config run would execute.
+    Days after a violation are checked as if the orders of the violating day had been executed.
+
+    Returns
+    -------
+    pd.DataFrame
+        One row per day without enough cash (all days if all_days is True), indexed like main_df, with Date, cash_available
+        (cash at the open), cash_required, shortfall, margin (peak margin balance of the day) and reason: the first rejected order
+        (the order needing the most cash on feasible days), 'missing price' if an option price is NaN, 'rebalance' if a rebalancing trade at the close leaves negative cash, or 'initial buy'.
+    """
+    portfolio = backtest.portfolio
+    backtest.columns.compute(strategy.required_columns)
+    days_df = backtest.main_df.iloc[backtest.n_simulated_days:]
+    if days_df.empty:
+        return pd.DataFrame(columns=['Date', 'cash_available', 'cash_required', 'shortfall', 'margin', 'reason'])
+
+    orders = strategy.order_schedule(days_df)
+    basket = basket_requirements(orders)
+    if needs_initial_buy(backtest):
+        quantity = initial_equity_quantity(backtest)
+        initial_cash = portfolio._cash
+        cash = initial_cash - quantity * days_df['Open'].values[0]
+    else:
+        quantity = portfolio.positions['equity'][strategy.asset]
+        initial_cash = cash = portfolio._cash - portfolio._cash_liability
+
+    # cash and equity quantity at every close after rebalancing, the basket cash flows are proportional to the quantity
+    end = backtest.n_simulated_days + len(days_df)
+    next_date = backtest.main_df['Date'].values[end] if end < len(backtest.main_df) else None
+    schedule = portfolio.rebalance_schedule(days_df['Date'].values, days_df['Close'].values, basket['net_cash_flow'], strategy.asset,
+                                            backtest.rebalance_config or NO_REBALANCE, quantity, cash, next_date,
+                                            backtest.n_simulated_days)
+    quantities = np.concatenate([[quantity], schedule['quantity'][:-1]])
+    cash_available = np.concatenate([[cash], schedule['cash'][:-1]])
+    cash_required = quantities * basket['required_cash']
+
+    violations = np.isnan(cash_required) | (cash_available < cash_required)
+    order_required_cash = quantities[:, None] * np.where(np.isnan(basket['order_required_cash']), np.inf, basket['order_required_cash'])
+    rejected = order_required_cash > cash_available[:, None]
+    descriptions = np.array([f"{order['action']} {order['leg']}" for order in orders], dtype=object)
+    reasons = np.where(np.isnan(cash_required), 'missing price',
+                       descriptions[np.where(violations, rejected.argmax(axis=1), order_required_cash.argmax(axis=1))]).astype(object)
+
+    rebalanced = np.zeros(len(days_df), dtype=bool)
+    rebalanced[schedule['trades']['position'].values.astype(int)] = True
+    rebalance_violations = rebalanced & (schedule['cash'] < 0) & ~violations
+    reasons[rebalance_violations] = 'rebalance'
+    violations |= rebalance_violations
+    if cash < 0:
+        reasons[0] = 'initial buy'
+        cash_available[0], cash_required[0] = initial_cash, initial_cash - cash
+        violations[0] = True
+
+    result = pd.DataFrame({
+        'Date': days_df['Date'].values,
+        'cash_available': cash_available,
+        'cash_required': cash_required,
+        'shortfall': np.maximum(cash_required - cash_available, 0),
+        'margin': quantities * basket['margin'],
+        'reason': reasons
+    }, index=days_df.index)
+    result.loc[rebalance_violations, 'shortfall'] = -schedule['cash'][rebalance_violations]
+    if all_days:
+        result['feasible'] = ~violations
+        return result
+    return result[violations]
+
+
+class ModelPriceAPI:
+    """
+    Data API pricing every option with the BS model of bs_config without any request, like the fallback of PolygonAPI.
+    """
+    price_cache = None
+
+    def try_get_polygon_price_multithread(self, option_data_df, bar_multiplier, bar_timespan, price_type, bs_config, listed=None):
+        n_options = len(option_data_df)
+        return add_prices_with_bs_fallback(option_data_df, np.full(n_options, np.nan), np.full(n_options, 'bs', dtype=object), bs_config)
+
+
+def estimate_feasibility(config: dict, asset_data: pd.DataFrame, underlying_asset='SPY', all_days=False) -> pd.DataFrame:
+    """
+    check_feasibility of config before fetching anything: options are selected as in pipeline.fetch_and_select_options
+    with every open price given by the BS model of config['bs_config']. Fetched prices can differ, so days close to the limit
+    may pass here and fail in the simulation (or the other way around).
+    """
+    backtest, strategy = prepare_backtest(config, asset_data, ModelPriceAPI(), underlying_asset)
+    return check_feasibility(backtest, strategy, all_days)
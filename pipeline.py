@@ -0,0 +1,324 @@
+"""
+The backtest steps of main.ipynb packaged as functions, so a backtest can be run from a config dict (e.g. by the backtest server).
+Keys of a config dict are the names used in config.py. Missing keys fall back to the values in config.py.
+"""
+import os
+import math
+import copy
+import functools
+
+import numpy as np
+import pandas as pd
+
+import config as default_config
+from portfolio import Portfolio
+from backtest import Backtest
+from strategies import ZeroCostCollar0DTE, OptionStructure0DTE
+from utils import StageCache, frame_digest, source_digest
+
+
+CONFIG_KEYS = [
+    'start_date',
+    'end_date',
+    'initial_portfolio_nominal_value',
+    'collateral_ratio',
+    'portolio_weights_config',
+    'strategy_selected',
+    'zero_cost_search_config',
+    'strike_selection_config',
+    'structure_config',
+    'bs_config',
+    'open_price_config',
+    'rebalance_config',
+    'fetch_chunk_days'
+]
+
+NAV_FLOOR = 0.995
+
+# inputs of the cached stages, see stage_keys. The options stage doesn't depend on the portfolio, so a run with a different
+# collateral_ratio, weights or rebalance_config reuses its fetched prices and selected options and only simulates the portfolio
+STAGE_CONFIG_KEYS = {
+    'options': {1: ['strategy_selected', 'zero_cost_search_config', 'bs_config', 'open_price_config'],
+                2: ['strategy_selected', 'strike_selection_config', 'bs_config', 'open_price_config'],
+                3: ['strategy_selected', 'structure_config', 'bs_config', 'open_price_config']},
+    'simulation': ['initial_portfolio_nominal_value', 'collateral_ratio', 'portolio_weights_config', 'rebalance_config']
+}
+STAGE_SOURCES = {
+    'options': ['backtest.py', 'pipeline.py', 'strategies', 'utils'],
+    'simulation': ['backtest.py', 'pipeline.py', 'portfolio.py', 'strategies', 'utils']
+}
+
+
+def make_config(overrides: dict=None) -> dict:
+    """
+    Returns a config dict with the values in config.py updated by overrides.
+    Dict values (e.g. bs_config) are updated key by key, so overrides only need to contain the changed keys.
+    """
+    config = {key: copy.deepcopy(getattr(default_config, key)) for key in CONFIG_KEYS}
+    for key, value in (overrides or {}).items():
+        if key not in config:
+            raise ValueError(f"Unknown config key {key}, please use one of {CONFIG_KEYS}")
+        if isinstance(config[key], dict) and isinstance(value, dict):
+            config[key].update(value)
+        else:
+            config[key] = value
+
+    return config
+
+
+def select_dates(asset_data: pd.DataFrame, start_date: str, end_date: str) -> pd.DataFrame:
+    return asset_data[(asset_data['Date'] >= start_date) & (asset_data['Date'] <= end_date)]
+
+
+@functools.lru_cache(maxsize=None)
+def stage_code_version(stage) -> str:
+    """
+    Source digest of the code of a stage, computed once per process (modules are not reloaded).
+    """
+    repo_dir = os.path.dirname(os.path.abspath(__file__))
+    return source_digest([os.path.join(repo_dir, path) for path in STAGE_SOURCES[stage]])
+
+
+def stage_keys(config: dict, asset_data: pd.DataFrame, data_api, underlying_asset='SPY') -> dict:
+    """
+    Keys of the artifacts of a config in a StageCache: {'options': key of the backtest after fetching prices and selecting options,
+    'simulation': key of the result of simulate_and_summarize}. A key is the hash of the config keys in STAGE_CONFIG_KEYS,
+    the asset data of the backtest period, the data API class, the key of the previous stage and the source code of the stage.
+    """
+    if config['strategy_selected'] not in STAGE_CONFIG_KEYS['options']:
+        raise ValueError("Check config, strategy does not exist. ")
+
+    options_inputs = {
+        'config': {key: config[key] for key in STAGE_CONFIG_KEYS['options'][config['strategy_selected']]},
+        'asset_data': frame_digest(select_dates(asset_data, config['start_date'], config['end_date'])),
+        'underlying_asset': underlying_asset,
+        'data_api': type(data_api).__name__
+    }
+    options_key = StageCache.key('options', options_inputs, stage_code_version('options'))
+    simulation_inputs = {'options': options_key, 'config': {key: config[key] for key in STAGE_CONFIG_KEYS['simulation']}}
+
+    return {'options': options_key, 'simulation': StageCache.key('simulation', simulation_inputs, stage_code_version('simulation'))}
+
+
+def prepare_backtest(config: dict, asset_data: pd.DataFrame, data_api, underlying_asset='SPY', stage_cache: StageCache=None, keys: dict=None,
+                     fetch=True):
+    """
+    Create the portfolio, strategy and backtest, fetch option prices and select options.
+    asset_data can cover more dates than the backtest period, it's filtered by config['start_date'] and config['end_date'].
+    If stage_cache is given, fetched prices and selected options are restored from it when the options stage inputs didn't change
+    (see stage_keys, keys can be given if already computed), otherwise they are saved to it.
+    If fetch is False, option prices are not fetched, e.g. to fetch and simulate them together with simulate_pipelined.
+    """
+    asset_data = select_dates(asset_data, config['start_date'], config['end_date'])
+    portfolio = Portfolio(config['initial_portfolio_nominal_value'], config['portolio_weights_config'], config['collateral_ratio'])
+    strategy = make_strategy(config, portfolio, underlying_asset, asset_data)
+    backtest = Backtest(portfolio, asset_data, data_api)
+    backtest.rebalance_config = config['rebalance_config']
+
+    if not fetch:
+        return backtest, strategy
+    if stage_cache is None:
+        fetch_and_select_options(backtest, strategy, config, underlying_asset)
+        return backtest, strategy
+
+    key = (keys or stage_keys(config, asset_data, data_api, underlying_asset))['options']
+    artifact = stage_cache.get('options', key)
+    if artifact is None:
+        fetch_and_select_options(backtest, strategy, config, underlying_asset)
+        stage_cache.put('options', key, options_artifact(backtest))
+    else:
+        restore_options_artifact(backtest, strategy, artifact)
+
+    return backtest, strategy
+
+
+def make_strategy(config: dict, portfolio: Portfolio, underlying_asset: str, asset_data: pd.DataFrame):
+    """
+    OptionStructure0DTE with config['structure_config'] for strategy 3, ZeroCostCollar0DTE for strategies 1 and 2.
+    """
+    if config['strategy_selected'] == 3:
+        return OptionStructure0DTE(portfolio, underlying_asset, asset_data, config['structure_config'])
+    return ZeroCostCollar0DTE(portfolio, underlying_asset, asset_data)
+
+
+def options_artifact(backtest: Backtest) -> dict:
+    return {'main_df': backtest.main_df, 'option_data': backtest.option_data, 'n_priced_days': backtest.n_priced_days, 'bs_config': backtest.bs_config}
+
+
+def restore_options_artifact(backtest: Backtest, strategy: ZeroCostCollar0DTE, artifact: dict):
+    backtest.main_df = artifact['main_df']
+    backtest.option_data = artifact['option_data']
+    backtest.n_priced_days = artifact['n_priced_days']
+    backtest.bs_config = artifact['bs_config']
+    backtest.columns.touch(backtest.main_df.columns)
+    strategy.register_columns(backtest.columns)
+
+
+def extend_backtest(backtest: Backtest, strategy: ZeroCostCollar0DTE, config: dict, asset_data: pd.DataFrame, underlying_asset='SPY'):
+    """
+    Extend a completed (or checkpointed) backtest to config['end_date']. Only option prices of the new days are fetched,
+    call simulate afterwards to simulate the new days only.
+    """
+    backtest.extend(select_dates(asset_data, config['start_date'], config['end_date']))
+    fetch_and_select_options(backtest, strategy, config, underlying_asset)
+
+
+def fetch_and_select_options(backtest: Backtest, strategy: ZeroCostCollar0DTE, config: dict, underlying_asset='SPY'):
+    """
+    Fetch option prices of the days after backtest.n_priced_days and select options, config['fetch_chunk_days'] days at a time.
+    """
+    chunk_days = config.get('fetch_chunk_days')
+    if config['strategy_selected'] == 1:
+        backtest.get_option_price(underlying_asset, config['bs_config'], config['open_price_config'], config['zero_cost_search_config'],
+                                  chunk_days=chunk_days, select_options_func=strategy.find_zero_cost_collar)
+    elif config['strategy_selected'] == 2:
+        strategy.select_options(backtest, config['strike_selection_config'])
+        backtest.get_option_price(underlying_asset, config['bs_config'], config['open_price_config'], chunk_days=chunk_days)
+    elif config['strategy_selected'] == 3:
+        strategy.select_structure(backtest)
+        backtest.get_option_price(underlying_asset, config['bs_config'], config['open_price_config'], chunk_days=chunk_days,
+                                  select_options_func=strategy.update_leg_prices)
+    else:
+        raise ValueError("Check config, strategy does not exist. ")
+
+    # option prices at close and collar pnl are computed lazily, when needed by run or by backtest.columns.compute
+    strategy.register_columns(backtest.columns)
+
+
+def simulate(backtest: Backtest, strategy: ZeroCostCollar0DTE):
+    """
+    Buy and hold the underlying asset at market open on the first day, then run the strategy every day that has not been simulated yet.
+    """
+    portfolio = backtest.portfolio
+    if needs_initial_buy(backtest):
+        first_date = backtest.main_df['Date'].values[0]
+        strategy.execute_buy_and_hold_underlying('equity', first_date, backtest.main_df['Open'].values[0], initial_equity_quantity(backtest))
+    backtest.run(strategy)
+
+
+def simulate_pipelined(backtest: Backtest, strategy: ZeroCostCollar0DTE, config: dict, underlying_asset='SPY', chunk_days=20, prefetch_chunks=2):
+    """
+    Like fetch_and_select_options followed by simulate, but option prices of the next chunks of days are fetched in the background
+    while the current chunk is selected and simulated (see Backtest.run_pipelined). backtest is created by prepare_backtest(..., fetch=False).
+    """
+    if needs_initial_buy(backtest):
+        first_date = backtest.main_df['Date'].values[0]
+        strategy.execute_buy_and_hold_underlying('equity', first_date, backtest.main_df['Open'].values[0], initial_equity_quantity(backtest))
+
+    if config['strategy_selected'] == 1:
+        backtest.run_pipelined(strategy, underlying_asset, config['bs_config'], config['open_price_config'], config['zero_cost_search_config'],
+                               strategy.find_zero_cost_collar, chunk_days, prefetch_chunks)
+    elif config['strategy_selected'] == 2:
+        strategy.select_options(backtest, config['strike_selection_config'])
+        backtest.run_pipelined(strategy, underlying_asset, config['bs_config'], config['open_price_config'], chunk_days=chunk_days,
+                               prefetch_chunks=prefetch_chunks)
+    elif config['strategy_selected'] == 3:
+        strategy.select_structure(backtest)
+        backtest.run_pipelined(strategy, underlying_asset, config['bs_config'], config['open_price_config'], select_options_func=strategy.update_leg_prices,
+                               chunk_days=chunk_days, prefetch_chunks=prefetch_chunks)
+    else:
+        raise ValueError("Check config, strategy does not exist. ")
+
+
+def needs_initial_buy(backtest: Backtest) -> bool:
+    return backtest.n_simulated_days == 0 and 'equity' not in backtest.portfolio.positions
+
+
+def initial_equity_quantity(backtest: Backtest) -> int:
+    portfolio = backtest.portfolio
+    target_exposure = portfolio.initial_portfolio_nominal_value * portfolio.target_portfolio_weights['equity']
+    return math.floor(target_exposure / backtest.main_df['Open'].values[0])
+
+
+def sweep_rebalancing(backtest: Backtest, strategy: ZeroCostCollar0DTE, rebalance_configs: list) -> pd.DataFrame:
+    """
+    Evaluate rebalancing rules on the days not simulated yet without running the daily loop, one row per rebalance_config.
+    NAV is computed from the rebalance schedule (equity quantity and cash at every close), it does not check whether trades have enough cash.
+    """
+    portfolio = backtest.portfolio
+    days_df = backtest.main_df.iloc[backtest.n_simulated_days:]
+    backtest.columns.compute([strategy.cash_flow_column])
+    cash_flows = backtest.main_df.loc[days_df.index, strategy.cash_flow_column].values
+    if needs_initial_buy(backtest):
+        quantity = initial_equity_quantity(backtest)
+        cash = portfolio.cash - quantity * days_df['Open'].values[0]
+    else:
+        quantity, cash = None, None
+
+    rows = []
+    for rebalance_config in rebalance_configs:
+        schedule = portfolio.rebalance_schedule(days_df['Date'].values, days_df['Close'].values, cash_flows, strategy.asset, rebalance_config, quantity, cash,
+                                                day_offset=backtest.n_simulated_days)
+        nav = (schedule['cash'] + schedule['quantity'] * days_df['Close'].values) / portfolio.collateral_ratio / portfolio.shares
+        rows.append({
+            **rebalance_config,
+            'n_rebalances': len(schedule['trades']),
+            'min_nav': min(portfolio.nav_history[-1], nav.min()),
+            'final_nav': nav[-1],
+            'max_abs_drift': schedule['max_abs_drift'].max(),
+            'breached_nav_floor': min(portfolio.nav_history[-1], nav.min()) < NAV_FLOOR
+        })
+
+    return pd.DataFrame(rows)
+
+
+def summarize(backtest: Backtest, error: str=None) -> dict:
+    """
+    Metrics of a (possibly interrupted) simulation. NAV and exposure histories start with the initial values before the first day.
+    """
+    portfolio = backtest.portfolio
+    nav = np.asarray(portfolio.nav_history)
+    dates = backtest.dates.values[:len(nav) - 1]
+    min_nav_position = int(np.argmin(nav))
+
+    return {
+        'n_days': len(nav) - 1,
+        'start_date': dates[0] if len(dates) else None,
+        'end_date': dates[-1] if len(dates) else None,
+        'min_nav': float(nav.min()),
+        'min_nav_date': dates[min_nav_position - 1] if min_nav_position > 0 else None,
+        'final_nav': float(nav[-1]),
+        'breached_nav_floor': bool(nav.min() < NAV_FLOOR),
+        'stop_reason': backtest.stop_reason,
+        'error': error
+    }
+
+
+def simulate_and_summarize(backtest: Backtest, strategy: ZeroCostCollar0DTE) -> dict:
+    """
+    Simulate and return metrics and histories as plain Python objects, so it can run in a worker process.
+    If the simulation stops early (e.g. not enough cash), the histories up to that day are returned with the error message.
+    """
+    error = None
+    try:
+        simulate(backtest, strategy)
+    except Exception as e:
+        error = str(e)
+
+    portfolio = backtest.portfolio
+    return {
+        'metrics': summarize(backtest, error),
+        'dates': backtest.dates.values[:len(portfolio.nav_history) - 1].tolist(),
+        'nav': [float(value) for value in portfolio.nav_history],
+        'equity_exposure': [float(value) for value in portfolio.equity_exposure],
+        'cash_exposure': [float(value) for value in portfolio.cash_exposure]
+    }
+
+
+def run_backtest(config: dict, asset_data: pd.DataFrame, data_api, underlying_asset='SPY', stage_cache: StageCache=None) -> dict:
+    """
+    Prepare, simulate and summarize a backtest. With a stage_cache, the result of a config already run with the same inputs is
+    returned without fetching or simulating, and a config only changing portfolio keys (e.g. collateral_ratio) only simulates the portfolio.
+    """
+    if stage_cache is None:
+        backtest, strategy = prepare_backtest(config, asset_data, data_api, underlying_asset)
+        return simulate_and_summarize(backtest, strategy)
+
+    keys = stage_keys(config, asset_data, data_api, underlying_asset)
+    result = stage_cache.get('simulation', keys['simulation'])
+    if result is None:
+        backtest, strategy = prepare_backtest(config, asset_data, data_api, underlying_asset, stage_cache, keys)
+        result = simulate_and_summarize(backtest, strategy)
+        stage_cache.put('simulation', keys['simulation'], result)
+
+    return result
@@ -0,0 +1,259 @@
+"""
+A local stand-in for the Polygon.io REST API, to load test and benchmark the fetch layer offline and reproducibly.
+
+Record responses of the real API to an archive, with PolygonAPI(api_key, base_url='http://127.0.0.1:8766') pointed at the proxy:
+    python polygon_replay.py --archive data/polygon_archive.jsonl --record
+
+Replay them, with 50 +- 20 ms latency, 1% of 500 errors, 1% of 429 responses and at most 200 requests per second:
+    python polygon_replay.py --archive data/polygon_archive.jsonl --latency-ms 50 --jitter-ms 20 --error-rate 0.01 --rate-limit-rate 0.01 --max-rps 200
+
+PolygonAPI uses the replay server when created with base_url, or when the POLYGON_BASE_URL environment variable is set.
+Requests are matched on path and query parameters (not the API key). Requests not in the archive get an empty 'OK' response by default,
+which PolygonAPI handles as no data. GET /_stats returns the counts of requests, archive hits and misses and injected responses.
+"""
+import json
+import time
+import random
+import argparse
+import threading
+import urllib.error
+import urllib.request
+from urllib.parse import urlsplit, parse_qsl, urlencode
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8766
+UPSTREAM_URL = 'https://api.polygon.io'
+EMPTY_RESPONSE = {'status': 'OK', 'resultsCount': 0, 'results': []}
+
+
+def request_key(path):
+    """
+    Archive key of a request path: the path and its query parameters sorted, without the API key.
+    """
+    parts = urlsplit(path)
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True) if key != 'apiKey')
+    return parts.path + ('?' + urlencode(query) if query else '')
+
+
+class PolygonArchive:
+    """
+    Recorded responses in a JSON lines file, one {'key', 'status', 'body'} line per response. Later lines replace earlier ones.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.responses = {}         # {key: (status, body)}
+        self.lock = threading.Lock()
+        try:
+            with open(path) as f:
+                for line in f:
+                    if line.strip():
+                        record = json.loads(line)
+                        self.responses[record['key']] = (record['status'], record['body'])
+        except FileNotFoundError:
+            pass
+
+
+    def __len__(self):
+        return len(self.responses)
+
+
+    def get(self, key):
+        return self.responses.get(key)
+
+
+    def add(self, key, status, body: str):
+        with self.lock:
+            self.responses[key] = (status, body)
+            with open(self.path, 'a') as f:
+                f.write(json.dumps({'key': key, 'status': status, 'body': body}) + '\n')
+
+
+class ReplayRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        if self.path == '/_stats':
+            self.send_body(200, json.dumps(server.stats()))
+            return
+
+        server.count('requests')
+        server.throttle()
+        server.sleep_latency()
+
+        injected = server.draw_injection()
+        if injected == 'error':
+            self.send_body(500, json.dumps({'status': 'ERROR', 'error': 'injected error'}))
+            return
+        if injected == 'rate_limit':
+            self.send_body(429, json.dumps({'status': 'ERROR', 'error': 'injected rate limit'}), {'Retry-After': '0'})
+            return
+
+        key = request_key(self.path)
+        if server.upstream_url is not None:
+            status, body = server.fetch_upstream(self.path, self.headers.get('Authorization'))
+            if status < 500 and status != 429:
+                server.archive.add(key, status, body)
+            self.send_body(status, body)
+            return
+
+        response = server.archive.get(key)
+        if response is not None:
+            server.count('hits')
+            self.send_body(*response)
+        else:
+            server.count('misses')
+            if server.missing == 'empty':
+                self.send_body(200, json.dumps(EMPTY_RESPONSE))
+            else:
+                self.send_body(404, json.dumps({'status': 'NOT_FOUND', 'error': f"{key} is not in the archive"}))
+
+
+    def send_body(self, status, body: str, headers: dict=None):
+        data = body.encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class PolygonReplayServer(ThreadingHTTPServer):
+    """
+    HTTP server replaying archived Polygon responses (or recording them if upstream_url is given), with injected latency,
+    errors, 429 responses and a throughput cap. Injection draws use a random generator seeded with seed.
+
+    Parameters
+    ----------
+    latency_ms, jitter_ms: float
+        Every response is delayed by latency_ms plus a uniform random delay in [-jitter_ms, jitter_ms].
+    error_rate, rate_limit_rate: float
+        Share of requests answered with a 500 error / a 429 response (Retry-After: 0). The Polygon client retries both.
+    max_rps: float
+        Requests beyond max_rps requests per second wait for their turn. None is unlimited.
+    missing: str
+        Response to requests not in the archive, 'empty' (no results, handled as no data) or '404'.
+    """
+    daemon_threads = True
+
+    def __init__(self, archive_path, host=DEFAULT_HOST, port=DEFAULT_PORT, upstream_url=None, latency_ms=0, jitter_ms=0, error_rate=0,
+                 rate_limit_rate=0, max_rps=None, missing='empty', seed=0, verbose=False):
+        if missing not in ['empty', '404']:
+            raise ValueError("missing must be 'empty' or '404'")
+        self.archive = PolygonArchive(archive_path)
+        self.upstream_url = upstream_url
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self.rate_limit_rate = rate_limit_rate
+        self.max_rps = max_rps
+        self.missing = missing
+        self.verbose = verbose
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()       # earliest start time of the next request under max_rps
+        self.counts = {'requests': 0, 'hits': 0, 'misses': 0, 'error': 0, 'rate_limit': 0}
+        super().__init__((host, port), ReplayRequestHandler)
+
+
+    @property
+    def base_url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+    def count(self, name):
+        with self.lock:
+            self.counts[name] += 1
+
+
+    def stats(self):
+        with self.lock:
+            return {**self.counts, 'archived_responses': len(self.archive)}
+
+
+    def throttle(self):
+        if not self.max_rps:
+            return
+        with self.lock:
+            start = max(self.next_slot, time.monotonic())
+            self.next_slot = start + 1 / self.max_rps
+        time.sleep(max(start - time.monotonic(), 0))
+
+
+    def sleep_latency(self):
+        if not self.latency_ms and not self.jitter_ms:
+            return
+        with self.lock:
+            jitter = self.random.uniform(-self.jitter_ms, self.jitter_ms)
+        time.sleep(max(self.latency_ms + jitter, 0) / 1000)
+
+
+    def draw_injection(self):
+        with self.lock:
+            draw = self.random.random()
+            injected = 'error' if draw < self.error_rate else 'rate_limit' if draw < self.error_rate + self.rate_limit_rate else None
+            if injected:
+                self.counts[injected] += 1
+        return injected
+
+
+    def fetch_upstream(self, path, authorization):
+        request = urllib.request.Request(self.upstream_url + path, headers={'Authorization': authorization} if authorization else {})
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                return response.status, response.read().decode()
+        except urllib.error.HTTPError as e:
+            return e.code, e.read().decode()
+
+
+def start_replay_server(archive_path, port=0, **kwargs) -> PolygonReplayServer:
+    """
+    Start a PolygonReplayServer in a background thread (port 0 picks a free port), e.g. for benchmarks in a script:
+
+        server = start_replay_server('data/polygon_archive.jsonl', latency_ms=30, max_rps=100)
+        data_api = PolygonAPI('replay', base_url=server.base_url)
+        ...
+        server.shutdown()
+    """
+    server = PolygonReplayServer(archive_path, port=port, **kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Record or replay Polygon.io responses on a local server.')
+    parser.add_argument('--archive', default='data/polygon_archive.jsonl')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--record', action='store_true', help=f"forward requests to {UPSTREAM_URL} and archive the responses")
+    parser.add_argument('--latency-ms', type=float, default=0)
+    parser.add_argument('--jitter-ms', type=float, default=0)
+    parser.add_argument('--error-rate', type=float, default=0)
+    parser.add_argument('--rate-limit-rate', type=float, default=0)
+    parser.add_argument('--max-rps', type=float, default=None)
+    parser.add_argument('--missing', default='empty', choices=['empty', '404'])
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--verbose', action='store_true')
+    args = parser.parse_args()
+
+    server = PolygonReplayServer(args.archive, args.host, args.port, UPSTREAM_URL if args.record else None, args.latency_ms, args.jitter_ms,
+                                 args.error_rate, args.rate_limit_rate, args.max_rps, args.missing, args.seed, args.verbose)
+    mode = 'Recording to' if args.record else f"Replaying {len(server.archive)} responses from"
+    print(f"{mode} {args.archive} on {server.base_url}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
@@ -1,8 +1,12 @@
 import os
 
+import numpy as np
 import pandas as pd
 
-from utils import AssetClassValidator as ACV
+from utils import AssetClassValidator as ACV, OptionBook, compute_drift, rebalance_schedule, rebalance_orders, target_quantity
+
+
+ORDER_ACTIONS = ('buy', 'sell', 'short', 'cover_short')
 
 
 
@@ -33,6 +37,8 @@ class Portfolio:
         self.cash_exposure = [portfolio_weights_config['cash']]
         self.transaction_history = {}
         self.dates = None
+        self.positions_version = 0          # incremented whenever positions change, the option book is only rebuilt if it changed
+        self.option_book = OptionBook()
         
 
     @property
@@ -69,6 +75,19 @@ class Portfolio:
             raise Exception("record_date method has already been run.")
 
 
+    def extend_dates(self, new_dates):
+        """
+        Append dates after the recorded backtest period, used when a completed backtest is extended to a new end date.
+        """
+        if self.dates is None:
+            raise Exception("dates have not been recorded by record_date function")
+        if len(new_dates) and new_dates[0] <= self.dates[-1]:
+            raise ValueError(f"New dates must be after the last recorded date {self.dates[-1]}")
+        self.dates = np.concatenate([self.dates, new_dates])
+        for date in new_dates:
+            self.transaction_history[date] = []
+
+
     def check_date(self, date):
         if self.dates is None:
             raise Exception("dates have not been recorded by record_date function")
@@ -117,6 +136,7 @@ class Portfolio:
         if not self.has_asset(asset_class, asset, attribute='_positions'):
             self._positions[asset_class][asset] = 0
         self._positions[asset_class][asset] += quantity_change
+        self.positions_version += 1
 
 
     @ACV.validate_asset_class
@@ -221,12 +241,140 @@ class Portfolio:
             del self._margin[asset_class][asset]
 
 
+    def execute_orders(self, date, orders, raise_on_reject=False):
+        """
+        Validate and apply a basket of orders atomically in one pass.
+
+        Orders are checked in the given order against the cash, positions and margin left by the previous orders of the basket,
+        with the same rules as buy, sell, short and cover_short. If any order is rejected, nothing is applied.
+
+        Parameters
+        ----------
+        date: str
+            Execution date of all orders.
+        orders: list of dict
+            Each order has keys 'action' ('buy', 'sell', 'short' or 'cover_short'), 'asset_class', 'asset', 'price', 'quantity'
+            and optionally 'leverage' (buy and short only, default 1).
+        raise_on_reject: bool
+            Raise an Exception with the reasons instead of returning a result with rejected orders.
+
+        Returns
+        -------
+        dict
+            'executed': whether the basket was applied, 'rejected': boolean mask of rejected orders, 
+            'reasons': reason of each rejected order (None for accepted orders).
+        """
+        self.check_date(date)
+
+        cash = self._cash
+        cash_liability = self._cash_liability
+        new_positions = {}      # {(asset_class, asset): quantity after the basket}
+        new_margin = {}         # {(asset_class, asset): margin balance after the basket}
+        rejected = np.zeros(len(orders), dtype=bool)
+        reasons = [None] * len(orders)
+        transactions = []
+
+        for i, order in enumerate(orders):
+            action, asset_class, asset = order['action'], order['asset_class'], order['asset']
+            price, quantity, leverage = order['price'], order['quantity'], order.get('leverage', 1)
+            key = (asset_class, asset)
+            position = new_positions.get(key, self._positions.get(asset_class, {}).get(asset, 0))
+            margin = new_margin.get(key, self._margin.get(asset_class, {}).get(asset, 0))
+
+            if action not in ORDER_ACTIONS:
+                reasons[i] = f"Unknown action {action}, please use one of {ORDER_ACTIONS}"
+            elif asset_class not in ACV.allowed_asset_classes:
+                reasons[i] = f'Asset class {asset_class} is not allowed, please check utils.asset_class_validator.AssetClassValidator'
+            elif quantity <= 0:
+                reasons[i] = 'The quantity must be positive'
+
+            elif action == 'buy':
+                notional_cost = price * quantity
+                cash_needed = notional_cost / leverage
+                if cash >= cash_needed:
+                    cash -= cash_needed
+                    cash_liability += notional_cost - cash_needed
+                    new_positions[key] = position + quantity
+                    transactions.append(f"bought {quantity} {asset} at {round(price, 4)} on {date}.")
+                else:
+                    reasons[i] = (f"Not enough buying power to buy {quantity} {asset} at {round(price, 4)} on {date}. "
+                                  f"Available cash: {round(cash, 2)}, Required: {round(cash_needed, 2)}, Leverage: {leverage}")
+
+            elif action == 'sell':
+                if position >= quantity:
+                    cash += price * quantity
+                    new_positions[key] = position - quantity
+                    transactions.append(f"sold {quantity} {asset} at {round(price, 4)} on {date}, remaining quantity: {position - quantity}")
+                else:
+                    reasons[i] = (f"Not enough {asset} to sell at {round(price, 4)} on {date}. "
+                                  f"Available: {position}, Intend to sell: {quantity}")
+
+            elif action == 'short':
+                proceed = price * quantity
+                required_margin = proceed / leverage
+                if cash >= required_margin:
+                    cash += proceed - required_margin      # available to cash
+                    new_margin[key] = margin + required_margin
+                    new_positions[key] = position - quantity
+                    transactions.append(f"shorted {quantity} {asset} at {round(price, 4)} on {date}.")
+                else:
+                    reasons[i] = (f"Not enough cash to short {quantity} {asset} at {round(price, 4)} on {date}. "
+                                  f"Available cash: {round(cash, 2)}, Required magin: {round(required_margin, 2)}, Leverage: {leverage}")
+
+            elif action == 'cover_short':
+                if margin == 0:
+                    reasons[i] = f"No margin account for {asset}. "
+                elif position > -quantity:
+                    reasons[i] = (f"The order quantity is larger than the short position in {asset}. "
+                                  f"Short position: {position}, Intend to cover: {quantity}")
+                else:
+                    cover_ratio = quantity / -position          # same rounding as cover_short
+                    cash_released = margin * cover_ratio
+                    if cash < price * quantity - cash_released:
+                        reasons[i] = (f"Trying to cover short position in {asset} on {date}, but cash is not enough. "
+                                      f"Total cash needed: {round(price * quantity, 2)}, margin account balance: {round(margin, 2)}, cash balance: {round(cash, 2)}")
+                    else:
+                        cash += cash_released          # same order of operations as cover_short, which releases margin before buying
+                        cash -= price * quantity
+                        new_positions[key] = position + quantity
+                        # a fully covered position releases its whole margin account
+                        new_margin[key] = 0 if new_positions[key] == 0 else margin - cash_released
+                        transactions.append(f"bought {quantity} {asset} at {round(price, 4)} on {date}.")
+
+            rejected[i] = reasons[i] is not None
+
+        if rejected.any():
+            if raise_on_reject:
+                raise Exception(' '.join(reason for reason in reasons if reason))
+            return {'executed': False, 'rejected': rejected, 'reasons': reasons}
+
+        self._cash = cash
+        self._cash_liability = cash_liability
+        for (asset_class, asset), quantity in new_positions.items():
+            self._positions.setdefault(asset_class, {})[asset] = quantity
+        self.positions_version += 1
+        for (asset_class, asset), balance in new_margin.items():
+            if balance == 0:
+                self._margin.get(asset_class, {}).pop(asset, None)
+            else:
+                self._margin.setdefault(asset_class, {})[asset] = balance
+        self.transaction_history[date].extend(transactions)
+
+        return {'executed': True, 'rejected': rejected, 'reasons': reasons}
+
+
     def get_port_value(self, asset_price_dict):
         total_value = self._cash - self._cash_liability
 
         for asset_class in asset_price_dict:
             ACV.is_valid_asset_class(asset_class)
 
+            if isinstance(asset_price_dict[asset_class], OptionBook):
+                # the whole option book is valued with its marks in one array operation
+                self.sync_option_book()
+                total_value += asset_price_dict[asset_class].value()
+                continue
+
             for asset, quantity in self._positions[asset_class].items():
                 if quantity == 0:
                     continue
@@ -269,12 +417,66 @@ class Portfolio:
         self.cash_exposure.append(self._cash / self.initial_portfolio_nominal_value)
 
 
-    def check_weights():
-        pass
+    def sync_option_book(self):
+        self.option_book.sync(self.positions.get('option', {}), self.positions_version)
 
 
-    def rebalance():
-        pass
+    def settle_expired_options(self, date, spot_price):
+        """
+        Close option positions expiring on or before date at their intrinsic value, as one basket of orders.
+        """
+        self.sync_option_book()
+        book = self.option_book
+        expired = book.expired(date)
+        if not expired.any():
+            return
+
+        intrinsic_values = book.intrinsic_values(spot_price)
+        orders = [{'action': 'sell' if quantity > 0 else 'cover_short', 'asset_class': 'option', 'asset': ticker, 'price': price, 'quantity': abs(quantity)}
+                  for ticker, quantity, price in zip(book.tickers[expired], book.quantities[expired], intrinsic_values[expired])]
+        self.execute_orders(date, orders, raise_on_reject=True)
+
+
+    def mark_options_to_market(self, date, spot_price, bs_config, data_api=None, fetch=False):
+        """
+        Mark all option positions at the close of date (see OptionBook.mark_to_market).
+        Returns the option book, which can be used as the 'option' entry of an asset_price_dict.
+        """
+        self.sync_option_book()
+        self.option_book.mark_to_market(date, spot_price, bs_config, data_api, fetch)
+        return self.option_book
+
+
+    def check_weights(self, asset_price_dict, asset):
+        """
+        Current weights of equity and cash and their drift from target_portfolio_weights, as a one-row DataFrame (see utils.compute_drift).
+        """
+        equity_value = self.positions['equity'][asset] * asset_price_dict['equity'][asset]
+        return compute_drift({'equity': equity_value, 'cash': self._cash - self._cash_liability}, self.target_portfolio_weights, self.collateral_ratio)
+
+
+    def rebalance_schedule(self, dates, close_prices, cash_flows_per_unit, asset, rebalance_config, quantity=None, cash=None, next_date=None, day_offset=0):
+        """
+        Rebalance trades of the equity position over the given days, computed before simulating them (see utils.rebalance_schedule).
+        quantity and cash default to the current equity position and cash, next_date is the trading day after the given days if any,
+        day_offset the number of trading days of the backtest before the first given day.
+        """
+        quantity = self.positions['equity'][asset] if quantity is None else quantity
+        cash = self._cash - self._cash_liability if cash is None else cash
+        return rebalance_schedule(dates, close_prices, cash_flows_per_unit, quantity, cash, self.target_portfolio_weights, self.collateral_ratio,
+                                  rebalance_config['rule'], rebalance_config['frequency'], rebalance_config['tolerance'], next_date, day_offset)
+
+
+    def rebalance(self, date, asset, price, quantity=None):
+        """
+        Buy or sell the equity asset at price to reach quantity units, by default the quantity matching target_portfolio_weights.
+        """
+        if quantity is None:
+            port_value = self.get_port_value({'equity': {asset: price}})
+            quantity = target_quantity(port_value, price, self.target_portfolio_weights['equity'], self.collateral_ratio)
+        orders = rebalance_orders(asset, price, self.positions['equity'][asset], quantity)
+        if orders:
+            self.execute_orders(date, orders, raise_on_reject=True)
 
 
     def print_transaction_history(self):
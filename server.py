@@ -0,0 +1,189 @@
+"""
+A long-lived local backtest server which keeps market data, fetched option prices, the Polygon client and a process pool warm.
+
+Start the server:
+    python server.py --port 8765 --api-key <polygon api key>
+
+Submit a job with a config payload (keys of config.py, missing keys fall back to config.py) and read the streamed results:
+    for event in request_backtest({'collateral_ratio': 1.2, 'portolio_weights_config': {'equity': 0.8, 'cash': 0.4}}):
+        print(event)
+
+The response is newline-delimited JSON: an 'accepted' event, a 'metrics' event, a 'nav' event with the NAV and exposure histories,
+and a final 'done' event. Failed jobs stream an 'error' event instead.
+"""
+import os
+import json
+import time
+import argparse
+import itertools
+import http.client
+import concurrent.futures
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from data_processing import get_spy_data
+from pipeline import make_config, prepare_backtest, simulate_and_summarize, stage_keys
+from utils import PolygonAPI, StageCache
+
+
+DEFAULT_HOST = '127.0.0.1'
+DEFAULT_PORT = 8765
+
+
+def warm_up_worker(_=None):
+    # importing the pipeline is the main startup cost of a worker process
+    import pipeline
+    return os.getpid()
+
+
+class BacktestRequestHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        if self.path != '/health':
+            self.send_error(404, 'Use GET /health or POST /backtest')
+            return
+        self.send_json_line(200, self.server.status())
+
+
+    def do_POST(self):
+        if self.path != '/backtest':
+            self.send_error(404, 'Use GET /health or POST /backtest')
+            return
+
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            config = make_config(json.loads(self.rfile.read(length) or b'{}'))
+        except Exception as e:
+            self.send_json_line(400, {'event': 'error', 'message': str(e)})
+            return
+
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        for event in self.server.run_job(config):
+            self.write_event(event)
+
+
+    def send_json_line(self, status, content):
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        self.write_event(content)
+
+
+    def write_event(self, event):
+        self.wfile.write((json.dumps(event) + '\n').encode())
+        self.wfile.flush()
+
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+
+class BacktestServer(ThreadingHTTPServer):
+    """
+    Local HTTP server which runs backtests from config payloads.
+
+    SPY data is loaded once, PolygonAPI keeps its client and caches every fetched option price, so repeated what-if queries
+    (e.g. a different collateral_ratio on the same dates) don't request any option price again.
+    Fetching and option selection run in the request thread, portfolio simulations run in a warm process pool.
+    """
+    daemon_threads = True
+
+    def __init__(self, data_api=None, api_key=None, host=DEFAULT_HOST, port=DEFAULT_PORT, max_workers=None, verbose=False, stage_cache=None):
+        if data_api is None:
+            data_api = PolygonAPI(api_key, cache_prices=True)
+        self.data_api = data_api
+        self.asset_data = get_spy_data('0000-00-00', '9999-99-99')
+        max_workers = max_workers or os.cpu_count()
+        self.process_pool = concurrent.futures.ProcessPoolExecutor(max_workers)
+        # start all worker processes now, so the first job doesn't pay the startup cost
+        self.worker_pids = set(self.process_pool.map(warm_up_worker, range(max_workers)))
+        self.verbose = verbose
+        self.stage_cache = stage_cache      # utils.StageCache, if set stage artifacts are reused across jobs and server restarts
+        self.job_ids = itertools.count(1)
+        self.n_jobs = 0
+        super().__init__((host, port), BacktestRequestHandler)
+
+
+    def run_job(self, config):
+        """
+        Yield the events of a backtest job.
+        """
+        job_id = next(self.job_ids)
+        self.n_jobs = job_id
+        t0 = time.time()
+        yield {'event': 'accepted', 'job_id': job_id}
+
+        try:
+            keys = stage_keys(config, self.asset_data, self.data_api) if self.stage_cache is not None else None
+            result = self.stage_cache.get('simulation', keys['simulation']) if keys else None
+            if result is None:
+                backtest, strategy = prepare_backtest(config, self.asset_data, self.data_api, stage_cache=self.stage_cache, keys=keys)
+                backtest.data_api = None        # the API client stays in this process, only data is sent to the worker
+                result = self.process_pool.submit(simulate_and_summarize, backtest, strategy).result()
+                if keys:
+                    self.stage_cache.put('simulation', keys['simulation'], result)
+        except Exception as e:
+            yield {'event': 'error', 'job_id': job_id, 'message': str(e)}
+            return
+
+        yield {'event': 'metrics', 'job_id': job_id, **result['metrics']}
+        yield {'event': 'nav', 'job_id': job_id, 'dates': result['dates'], 'nav': result['nav'],
+               'equity_exposure': result['equity_exposure'], 'cash_exposure': result['cash_exposure']}
+        yield {'event': 'done', 'job_id': job_id, 'seconds': round(time.time() - t0, 4)}
+
+
+    def status(self):
+        price_cache = getattr(self.data_api, 'price_cache', None)
+        return {
+            'event': 'status',
+            'n_jobs': self.n_jobs,
+            'n_workers': len(self.worker_pids),
+            'n_cached_prices': len(price_cache) if price_cache is not None else 0,
+            'n_days_of_data': len(self.asset_data)
+        }
+
+
+    def server_close(self):
+        super().server_close()
+        self.process_pool.shutdown()
+
+
+
+def request_backtest(config: dict=None, host=DEFAULT_HOST, port=DEFAULT_PORT, timeout=None):
+    """
+    Submit a backtest job to a running BacktestServer and yield the streamed events as dicts.
+    """
+    connection = http.client.HTTPConnection(host, port, timeout=timeout)
+    try:
+        connection.request('POST', '/backtest', body=json.dumps(config or {}), headers={'Content-Type': 'application/json'})
+        response = connection.getresponse()
+        for line in response:
+            if line.strip():
+                yield json.loads(line)
+    finally:
+        connection.close()
+
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run a local backtest server with warm data and caches.')
+    parser.add_argument('--host', default=DEFAULT_HOST)
+    parser.add_argument('--port', type=int, default=DEFAULT_PORT)
+    parser.add_argument('--api-key', default=os.environ.get('POLYGON_API_KEY'))
+    parser.add_argument('--max-workers', type=int, default=None)
+    parser.add_argument('--verbose', action='store_true')
+    parser.add_argument('--stage-cache', default=None, help='directory of a stage artifact cache (utils.StageCache), not cached if not given')
+    args = parser.parse_args()
+
+    server = BacktestServer(api_key=args.api_key, host=args.host, port=args.port, max_workers=args.max_workers, verbose=args.verbose,
+                            stage_cache=StageCache(args.stage_cache) if args.stage_cache else None)
+    print(f"Backtest server listening on http://{args.host}:{args.port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
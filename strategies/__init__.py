@@ -1,5 +1,6 @@
 from .buy_and_hold import BuyAndHold
 from .zero_cost_collar_0dte import ZeroCostCollar0DTE
+from .option_structure_0dte import OptionStructure0DTE, STRUCTURE_PRESETS, structure_legs, leg_strikes, structure_values
 
 
-__all__ = ['BuyAndHold', 'ZeroCostCollar0DTE']
+__all__ = ['BuyAndHold', 'ZeroCostCollar0DTE', 'OptionStructure0DTE', 'STRUCTURE_PRESETS', 'structure_legs', 'leg_strikes', 'structure_values']
@@ -0,0 +1,214 @@
+import copy
+from typing import TYPE_CHECKING
+
+import pandas as pd
+import numpy as np
+
+from .strategy import Strategy
+from .buy_and_hold import BuyAndHold
+from utils import calculate_strike, OptionPriceCube, AssetClassValidator as ACV
+
+if TYPE_CHECKING:
+    from backtest import Backtest       # only for type hints, strategies do not import the backtest engine
+
+
+# legs of common hedge structures, strikes relative to the base price (see config.structure_config)
+STRUCTURE_PRESETS = {
+    'collar': [
+        {'option_type': 'put', 'side': 'long', 'K_multiplier': 0.99},
+        {'option_type': 'call', 'side': 'short', 'K_multiplier': 1.02}
+    ],
+    'put_spread': [
+        {'option_type': 'put', 'side': 'long', 'K_multiplier': 0.995},
+        {'option_type': 'put', 'side': 'short', 'K_multiplier': 0.98}
+    ],
+    'seagull': [
+        {'option_type': 'put', 'side': 'long', 'K_multiplier': 0.995},
+        {'option_type': 'put', 'side': 'short', 'K_multiplier': 0.98},
+        {'option_type': 'call', 'side': 'short', 'K_multiplier': 1.01}
+    ],
+    'iron_condor': [
+        {'option_type': 'put', 'side': 'long', 'K_multiplier': 0.98},
+        {'option_type': 'put', 'side': 'short', 'K_multiplier': 0.99},
+        {'option_type': 'call', 'side': 'short', 'K_multiplier': 1.01},
+        {'option_type': 'call', 'side': 'long', 'K_multiplier': 1.02}
+    ]
+}
+LEG_DEFAULTS = {'ratio': 1, 'K_adjust': 0, 'K_method': 'floor'}
+SIDE_SIGNS = {'long': 1, 'short': -1}
+
+
+def structure_legs(structure_config: dict) -> list:
+    """
+    Validated legs of structure_config['legs'], a list of leg dicts or the name of a preset in STRUCTURE_PRESETS.
+    Each leg has option_type ('call' or 'put'), side ('long' or 'short'), ratio (contracts per unit of the underlying position)
+    and K_multiplier, K_adjust, K_method: the strike is K_method(base price * K_multiplier) + K_adjust, like strike_selection_config.
+    """
+    legs = structure_config['legs']
+    if isinstance(legs, str):
+        if legs not in STRUCTURE_PRESETS:
+            raise ValueError(f"Unknown structure {legs}, please use one of {list(STRUCTURE_PRESETS)} or a list of legs")
+        legs = STRUCTURE_PRESETS[legs]
+    if not legs:
+        raise ValueError('A structure needs at least one leg')
+
+    validated = []
+    for leg in legs:
+        leg = {**LEG_DEFAULTS, **copy.deepcopy(leg)}
+        if leg['option_type'] not in ['call', 'put']:
+            raise ValueError(f"option_type of a leg must be 'call' or 'put', got {leg['option_type']}")
+        if leg['side'] not in SIDE_SIGNS:
+            raise ValueError(f"side of a leg must be 'long' or 'short', got {leg['side']}")
+        if leg['ratio'] <= 0:
+            raise ValueError(f"ratio of a leg must be positive, got {leg['ratio']}")
+        validated.append(leg)
+    return validated
+
+
+def leg_strikes(base_prices, legs: list) -> np.ndarray:
+    """
+    Strikes of all legs on all days, shape (n_days, n_legs).
+    """
+    base_prices = np.asarray(base_prices, dtype=float)
+    multipliers = np.array([leg['K_multiplier'] for leg in legs], dtype=float)
+    adjusts = np.array([leg['K_adjust'] for leg in legs], dtype=float)
+    methods = np.array([leg['K_method'] for leg in legs])
+
+    strikes = np.empty((len(base_prices), len(legs)))
+    for method in np.unique(methods):
+        is_method = methods == method
+        strikes[:, is_method] = calculate_strike(base_prices[:, None], multipliers[is_method], adjusts[is_method], method)
+    return strikes
+
+
+def structure_values(legs: list, strikes, open_prices, close_prices) -> dict:
+    """
+    Cost at the open, payoff at expiration and pnl of the structure per unit of the underlying position on all days.
+    strikes and open_prices have shape (n_days, n_legs). The open prices and intrinsic values of all legs and days are weighted by
+    +ratio (long) or -ratio (short) in one tensor contraction.
+
+    Returns
+    -------
+    dict
+        'leg_close_prices': (n_days, n_legs) intrinsic values at the close, 'cost', 'payoff' and 'pnl': (n_days,) arrays
+    """
+    is_call = np.array([leg['option_type'] == 'call' for leg in legs])
+    weights = np.array([SIDE_SIGNS[leg['side']] * leg['ratio'] for leg in legs], dtype=float)
+    leg_close_prices = np.maximum(np.where(is_call, 1, -1) * (np.asarray(close_prices, dtype=float)[:, None] - strikes), 0)
+
+    cost, payoff = np.einsum('vdl,l->vd', np.stack([np.asarray(open_prices, dtype=float), leg_close_prices]), weights)
+    return {'leg_close_prices': leg_close_prices, 'cost': cost, 'payoff': payoff, 'pnl': payoff - cost}
+
+
+class OptionStructure0DTE(Strategy):
+    """
+    Strategy 3: trade a multi-leg structure of 0DTE options (config.structure_config) on the whole equity position every day,
+    opened at the open and expiring at the close. The two-leg 'collar' preset trades the same options as strategy 2.
+
+    Columns of main_df, leg i from 0:
+        leg{i}_strike, leg{i}_price_at_open, leg{i}_price_at_close
+        structure_cost, structure_payoff, structure_pnl     per unit of the underlying position, excluding the underlying
+    """
+    cash_flow_column = 'structure_pnl'
+
+    def __init__(self, portfolio, underlying_asset: str, asset_data: pd.DataFrame, structure_config: dict):
+        super().__init__(portfolio, underlying_asset, asset_data)
+        self.underlying_asset = underlying_asset
+        self.structure_config = structure_config
+        self.legs = structure_legs(structure_config)
+        self.strike_cols = [f"leg{i}_strike" for i in range(len(self.legs))]
+        self.open_price_cols = [f"leg{i}_price_at_open" for i in range(len(self.legs))]
+        self.close_price_cols = [f"leg{i}_price_at_close" for i in range(len(self.legs))]
+        self.required_columns = ['Date', 'Close'] + self.strike_cols + self.open_price_cols + self.close_price_cols
+
+
+    def register_columns(self, columns):
+        columns.register(self.close_price_cols + ['structure_cost', 'structure_payoff', 'structure_pnl'],
+                         inputs=['Close'] + self.strike_cols + self.open_price_cols, func=self.compute_structure_pnl)
+
+
+    def compute_strikes(self, df):
+        strikes = leg_strikes(df[self.structure_config['base_price']].values, self.legs)
+        return {col: strikes[:, i] for i, col in enumerate(self.strike_cols)}
+
+
+    def compute_structure_pnl(self, df):
+        """
+        Only calculates pnl of the option positions (i.e. excluding pnl from holding underlying asset)
+        """
+        values = structure_values(self.legs, df[self.strike_cols].values, df[self.open_price_cols].values, df['Close'].values)
+        result = {col: values['leg_close_prices'][:, i] for i, col in enumerate(self.close_price_cols)}
+        result.update({'structure_cost': values['cost'], 'structure_payoff': values['payoff'], 'structure_pnl': values['pnl']})
+        return result
+
+
+    def select_structure(self, backtest_instance: 'Backtest'):
+        """
+        Add the strikes of all legs to main_df and make get_option_price fetch the options of every leg.
+        Pass update_leg_prices as select_options_func of get_option_price to copy their open prices to main_df.
+        """
+        backtest_instance.columns.register(self.strike_cols, inputs=[self.structure_config['base_price']], func=self.compute_strikes,
+                                           params=copy.deepcopy(self.structure_config))
+        backtest_instance.columns.compute(self.strike_cols)
+        backtest_instance.strike_columns = [(leg['option_type'], col) for leg, col in zip(self.legs, self.strike_cols)]
+        for col in self.open_price_cols:
+            if col not in backtest_instance.main_df.columns:
+                backtest_instance.main_df[col] = np.nan
+
+
+    def update_leg_prices(self, backtest_instance: 'Backtest'):
+        """
+        Copy the open prices of the legs from backtest_instance.option_data to main_df, for the days in option_data.
+        """
+        cube = OptionPriceCube.from_option_data(backtest_instance.option_data)
+        days = cube.day_labels
+        strikes = backtest_instance.main_df.loc[days, self.strike_cols].values
+        option_types = np.array([leg['option_type'] for leg in self.legs])
+        prices = cube.lookup(np.arange(len(days))[:, None], strikes, option_types[None, :])
+        backtest_instance.main_df.loc[days, self.open_price_cols] = prices
+        backtest_instance.columns.touch(self.open_price_cols)
+
+
+    @ACV.validate_asset_class
+    def execute_buy_and_hold_underlying(self, asset_class: str, execution_date: str, execution_price: float, quantity: float, leverage: float=1):
+        buy_and_hold = BuyAndHold(self.portfolio, asset_class, self.underlying_asset, self.asset_data)
+        buy_and_hold.execute(execution_date, execution_price, quantity, leverage)
+
+
+    def structure_orders(self, row_data):
+        """
+        Orders of one day as a basket for Portfolio.execute_orders: open the short legs then the long legs at the open,
+        then close the long legs and the short legs at their intrinsic value at the close.
+        """
+        n_structures = self.portfolio.positions['equity'][self.underlying_asset]
+        legs = [(leg, f"{leg['option_type']} K={row_data[strike_col]}", row_data[open_col], row_data[close_col], n_structures * leg['ratio'])
+                for leg, strike_col, open_col, close_col in zip(self.legs, self.strike_cols, self.open_price_cols, self.close_price_cols)]
+        short_legs = [leg for leg in legs if leg[0]['side'] == 'short']
+        long_legs = [leg for leg in legs if leg[0]['side'] == 'long']
+
+        return ([{'action': 'short', 'asset_class': 'option', 'asset': asset, 'price': open_price, 'quantity': quantity}
+                 for _, asset, open_price, _, quantity in short_legs]
+                + [{'action': 'buy', 'asset_class': 'option', 'asset': asset, 'price': open_price, 'quantity': quantity}
+                   for _, asset, open_price, _, quantity in long_legs]
+                + [{'action': 'sell', 'asset_class': 'option', 'asset': asset, 'price': close_price, 'quantity': quantity}
+                   for _, asset, _, close_price, quantity in long_legs]
+                + [{'action': 'cover_short', 'asset_class': 'option', 'asset': asset, 'price': close_price, 'quantity': quantity}
+                   for _, asset, _, close_price, quantity in short_legs])
+
+
+    def execute(self, row_data):
+        self.portfolio.execute_orders(row_data['Date'], self.structure_orders(row_data), raise_on_reject=True)
+
+
+    def order_schedule(self, df):
+        """
+        structure_orders of all days of df, see Strategy.order_schedule.
+        """
+        legs = list(enumerate(self.legs))
+        short_legs = [(i, leg) for i, leg in legs if leg['side'] == 'short']
+        long_legs = [(i, leg) for i, leg in legs if leg['side'] == 'long']
+        return ([{'action': 'short', 'leg': f"leg{i}", 'price': df[self.open_price_cols[i]].values, 'ratio': leg['ratio']} for i, leg in short_legs]
+                + [{'action': 'buy', 'leg': f"leg{i}", 'price': df[self.open_price_cols[i]].values, 'ratio': leg['ratio']} for i, leg in long_legs]
+                + [{'action': 'sell', 'leg': f"leg{i}", 'price': df[self.close_price_cols[i]].values, 'ratio': leg['ratio']} for i, leg in long_legs]
+                + [{'action': 'cover_short', 'leg': f"leg{i}", 'price': df[self.close_price_cols[i]].values, 'ratio': leg['ratio']}
+                   for i, leg in short_legs])
@@ -1,10 +1,17 @@
+from typing import TYPE_CHECKING
+
 import pandas as pd
 
 from utils import calculate_strike
 from portfolio import Portfolio
-from backtest import Backtest
+
+if TYPE_CHECKING:
+    from backtest import Backtest       # only for type hints, strategies do not import the backtest engine
 
 class Strategy:
+    required_columns = []       # columns of Backtest.main_df used by execute, computed by Backtest.run before simulation
+    cash_flow_column = None     # column of Backtest.main_df with the daily cash flow per unit of the underlying position, used to schedule rebalancing
+
     def __init__(self, portfolio: Portfolio, asset: str, asset_data: pd.DataFrame):
         if not isinstance(portfolio, Portfolio):
             raise ValueError("portfolio must be an instance of Portfolio")
@@ -23,27 +30,46 @@ class Strategy:
         self.option_data = option_data
 
 
-    def select_options(self, backtest_instance: Backtest, selection_rules: dict):
+    def register_columns(self, columns):
         """
-        this function will select options based on self.option_selection_rules defined by users and add option columns to Backtest.main_df by changing result_df in-place
+        Register the derived main_df columns of this strategy in a utils.ColumnRegistry (Backtest.columns). Override in child classes.
         """
-        self.add_option_selection_rules(selection_rules)
+        pass
+
 
+    def compute_selected_strikes(self, df):
+        result = {}
         for option_type in ['call', 'put']:
             multiplier = self.option_selection_rules[option_type + '_K_multiplier']
             method = self.option_selection_rules[option_type + '_K_method']
             addition = self.option_selection_rules[option_type + '_K_adjust']
-    
-            strikes = backtest_instance.main_df[self.option_selection_rules['base_price']].apply(
-                lambda base: calculate_strike(base, multiplier, addition, method)
-            )
-            
-            col_name = f"selected_{option_type}_strike"
-            backtest_instance.main_df[col_name] = strikes
+            result[f"selected_{option_type}_strike"] = calculate_strike(df[self.option_selection_rules['base_price']], multiplier, addition, method)
+
+        return result
+
+
+    def select_options(self, backtest_instance: 'Backtest', selection_rules: dict):
+        """
+        this function will select options based on self.option_selection_rules defined by users and add option columns to Backtest.main_df by changing result_df in-place
+        Strikes are registered in backtest_instance.columns, so they (and the columns depending on them) are only recomputed if the rules change.
+        """
+        self.add_option_selection_rules(selection_rules)
+        backtest_instance.columns.register(['selected_call_strike', 'selected_put_strike'], inputs=[selection_rules['base_price']],
+                                           func=self.compute_selected_strikes, params=dict(selection_rules))
+        backtest_instance.columns.compute(['selected_call_strike', 'selected_put_strike'])
 
 
     def execute(self, *args, **kwargs):
         raise NotImplementedError("Strategy.execute() should be overridden by specific strategy.")
+
+
+    def order_schedule(self, df):
+        """
+        The daily orders of execute for all days of df at once, per unit of the underlying position, used by feasibility.check_feasibility.
+        Returns a list of orders in execution order, each a dict with 'action', 'leg' (orders of the same option share a leg),
+        'price' (array with one price per day), 'ratio' (quantity per unit of the underlying position) and optionally 'leverage'.
+        """
+        raise NotImplementedError("Strategy.order_schedule() should be overridden by specific strategy.")
     
 
 
@@ -1,27 +1,49 @@
+from typing import TYPE_CHECKING
+
 import pandas as pd
 import numpy as np
-from tqdm import tqdm
-tqdm.pandas()
 
 from .strategy import Strategy
-from backtest import Backtest
 from .buy_and_hold import BuyAndHold
-from utils import generate_option_ticker, find_indices_closest_to_zero_sum, AssetClassValidator as ACV
+from utils import generate_option_ticker, find_indices_closest_to_zero_sum, OptionPriceCube, AssetClassValidator as ACV
+
+if TYPE_CHECKING:
+    from backtest import Backtest       # only for type hints, strategies do not import the backtest engine
 
 
 class ZeroCostCollar0DTE(Strategy):
+    required_columns = ['Date', 'Close', 'selected_call_strike', 'selected_put_strike', 'call_price_at_open', 'put_price_at_open',
+                        'call_price_at_close', 'put_price_at_close']
+    cash_flow_column = 'collar_pnl'         # the collar is traded on the whole equity position every day
+
     def __init__(self, portfolio, underlying_asset: str, asset_data: pd.DataFrame):
         super().__init__(portfolio, underlying_asset, asset_data)
         self.underlying_asset = underlying_asset
 
 
+    def register_columns(self, columns):
+        columns.register(['collar_cost', 'collar_payoff', 'collar_pnl'],
+                         inputs=['put_price_at_open', 'call_price_at_open', 'put_price_at_close', 'call_price_at_close'],
+                         func=ZeroCostCollar0DTE.compute_collar_pnl)
+
+
+    @staticmethod
+    def compute_collar_pnl(df):
+        """
+        Only calculates pnl of the option positions (i.e. excluding pnl from holding underlying asset)
+        """
+        collar_cost = df['put_price_at_open'] - df['call_price_at_open']
+        collar_payoff = df['put_price_at_close'] - df['call_price_at_close']
+        return {'collar_cost': collar_cost, 'collar_payoff': collar_payoff, 'collar_pnl': collar_payoff - collar_cost}
+
+
     def update_collar_pnl(self, backtest_main_df: pd.DataFrame):
         """
         Only calculates pnl of the option positions (i.e. excluding pnl from holding underlying asset)
+        Use backtest.columns.compute(['collar_pnl']) after register_columns to compute it lazily instead.
         """
-        backtest_main_df['collar_cost'] = backtest_main_df['put_price_at_open'] - backtest_main_df['call_price_at_open']
-        backtest_main_df['collar_payoff'] = backtest_main_df['put_price_at_close'] - backtest_main_df['call_price_at_close']
-        backtest_main_df['collar_pnl'] = backtest_main_df['collar_payoff'] - backtest_main_df['collar_cost']
+        for col, values in ZeroCostCollar0DTE.compute_collar_pnl(backtest_main_df).items():
+            backtest_main_df[col] = values
     
 
     @ACV.validate_asset_class
@@ -45,29 +67,28 @@ class ZeroCostCollar0DTE(Strategy):
         return data
     
 
-    def find_zero_cost_collar(self, backtest_instance: Backtest):
-
-        backtest_instance.main_df[['selected_call_strike', 'call_price_at_open', 
-                                   'selected_put_strike', 'put_price_at_open']] = np.nan
+    def find_zero_cost_collar(self, backtest_instance: 'Backtest'):
+        """
+        Select the call and put whose open prices are closest to a zero-cost collar on every day in backtest_instance.option_data.
+        option_data may only cover a chunk of days (see Backtest.get_option_price), selections of other days are kept.
+        """
+        selected_cols = ['selected_call_strike', 'call_price_at_open', 'selected_put_strike', 'put_price_at_open']
+        missing_cols = [col for col in selected_cols if col not in backtest_instance.main_df.columns]
+        backtest_instance.main_df[missing_cols] = np.nan
         
-        for index, row in backtest_instance.main_df.iterrows():
-            daily_option_chain = backtest_instance.option_data[backtest_instance.option_data['main_df_index'] == index]
-            
-            call_options = daily_option_chain[daily_option_chain['option_type'] == 'call']
-            put_options = daily_option_chain[daily_option_chain['option_type'] == 'put']
-            
-            call_prices = call_options['open_price'].values
-            put_prices = put_options['open_price'].values
-            
-            indices = find_indices_closest_to_zero_sum(-call_prices, put_prices)    # short call long put
-            
-            selected_call = call_options.iloc[indices[0]]
-            selected_put = put_options.iloc[indices[1]]
-            
-            backtest_instance.main_df.at[index, 'selected_call_strike'] = selected_call['strike']
-            backtest_instance.main_df.at[index, 'call_price_at_open'] = selected_call['open_price']
-            backtest_instance.main_df.at[index, 'selected_put_strike'] = selected_put['strike']
-            backtest_instance.main_df.at[index, 'put_price_at_open'] = selected_put['open_price']
+        cube = OptionPriceCube.from_option_data(backtest_instance.option_data)      # each day's chain is a row of the cube, no filtering of option_data
+        selections = np.full((cube.n_days, len(selected_cols)), np.nan)
+        for position in range(cube.n_days):
+            call_strikes, call_prices = cube.day_chain(position, 'call')
+            put_strikes, put_prices = cube.day_chain(position, 'put')
+            if len(call_prices) == 0 or len(put_prices) == 0:
+                continue
+
+            call_index, put_index = find_indices_closest_to_zero_sum(-call_prices, put_prices)    # short call long put
+            selections[position] = [call_strikes[call_index], call_prices[call_index], put_strikes[put_index], put_prices[put_index]]
+
+        backtest_instance.main_df.loc[cube.day_labels, selected_cols] = selections
+        backtest_instance.columns.touch(selected_cols)
             
 
     def short_call_long_put(self, row_data):
@@ -85,9 +106,34 @@ class ZeroCostCollar0DTE(Strategy):
         self.portfolio.cover_short(date=data['current_date'], asset_class='option', asset=data['call'], price=data['call_price_close'], quantity=call_quantity)
         
 
+    def collar_orders(self, row_data):
+        """
+        Orders of one day as a basket for Portfolio.execute_orders: short call and long put at open, then let both expire at close.
+        """
+        data = ZeroCostCollar0DTE.extract_data(row_data)
+        n_collar = self.portfolio.positions['equity'][self.underlying_asset]
+        return [
+            {'action': 'short', 'asset_class': 'option', 'asset': data['call'], 'price': data['call_price_open'], 'quantity': n_collar},
+            {'action': 'buy', 'asset_class': 'option', 'asset': data['put'], 'price': data['put_price_open'], 'quantity': n_collar},
+            {'action': 'sell', 'asset_class': 'option', 'asset': data['put'], 'price': data['put_price_close'], 'quantity': n_collar},
+            {'action': 'cover_short', 'asset_class': 'option', 'asset': data['call'], 'price': data['call_price_close'], 'quantity': n_collar},
+        ]
+
+
     def execute(self, row_data):
-        self.short_call_long_put(row_data)
-        self.let_0dte_expire(row_data)
+        self.portfolio.execute_orders(row_data['Date'], self.collar_orders(row_data), raise_on_reject=True)
+
+
+    def order_schedule(self, df):
+        """
+        collar_orders of all days of df, see Strategy.order_schedule.
+        """
+        return [
+            {'action': 'short', 'leg': 'call', 'price': df['call_price_at_open'].values, 'ratio': 1},
+            {'action': 'buy', 'leg': 'put', 'price': df['put_price_at_open'].values, 'ratio': 1},
+            {'action': 'sell', 'leg': 'put', 'price': df['put_price_at_close'].values, 'ratio': 1},
+            {'action': 'cover_short', 'leg': 'call', 'price': df['call_price_at_close'].values, 'ratio': 1},
+        ]
 
     
 '''
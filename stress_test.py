@@ -0,0 +1,207 @@
+"""
+Monte Carlo stress test of the zero-cost collar strategy.
+
+SPY Open and Close prices are simulated with blackscholes_mc on thousands of paths, with an overnight share of the daily variance
+and random overnight gaps. Every day the collar legs are selected and priced on all paths at once (2-D arrays of days x paths)
+and the portfolio accounting of ZeroCostCollar0DTE.collar_orders (short call and long put at open, both expire at close)
+is done on all paths together. Paths are simulated in chunks of chunk_paths paths to bound memory, chunks run in a process pool.
+
+    result = run_stress_test(make_config({'collateral_ratio': 1.2, 'portolio_weights_config': {'equity': 0.8, 'cash': 0.4}}), n_days=252)
+    result['breach_probability'], result['min_nav_quantiles']
+
+Options are priced by the BS model with implied_vol (bs_config['vol'] by default), which can differ from the realized vol of the paths.
+"""
+import math
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+
+from backtest import Backtest
+from data_processing import get_spy_data
+from pipeline import make_config, NAV_FLOOR
+from utils import blackscholes_price, blackscholes_mc, calculate_strike
+
+
+TRADING_DAYS_PER_YEAR = 252
+
+DEFAULT_SCENARIO = {
+    'vol': 0.15,                        # annualized realized vol of the paths
+    'implied_vol': None,                # vol used to price the options, None uses bs_config['vol']
+    'overnight_variance_share': 0.25,   # share of the daily variance between the previous close and the open
+    'gap_intensity': 4,                 # expected number of overnight gaps per year
+    'gap_mean': -0.02,                  # mean and std of the log return of a gap
+    'gap_vol': 0.02
+}
+
+MIN_NAV_QUANTILES = [0.001, 0.01, 0.05, 0.25, 0.5]
+
+
+def make_scenario(overrides: dict=None) -> dict:
+    scenario = dict(DEFAULT_SCENARIO)
+    for key, value in (overrides or {}).items():
+        if key not in scenario:
+            raise ValueError(f"Unknown scenario key {key}, please use one of {list(DEFAULT_SCENARIO)}")
+        scenario[key] = value
+    return scenario
+
+
+def simulate_spy_paths(S0, n_days, n_paths, scenario: dict, r=0, q=0):
+    """
+    Returns (opens, closes), arrays of shape (n_days, n_paths). Every path starts at the open of the first day at S0.
+    Uses the global numpy random state, seed it with np.random.seed for reproducible paths.
+    """
+    dt = 1 / TRADING_DAYS_PER_YEAR
+    intraday_dt = (1 - scenario['overnight_variance_share']) * dt
+    day_starts = np.arange(n_days) * dt
+    ts = np.column_stack([day_starts, day_starts + intraday_dt]).ravel()       # open, close, next open, next close, ...
+    paths = blackscholes_mc(S0, scenario['vol'], r, q, ts, n_paths)
+
+    # overnight gaps move every price from the open of the day of the gap onwards
+    n_gaps = np.random.poisson(scenario['gap_intensity'] * dt, size=(n_days, n_paths))
+    n_gaps[0] = 0
+    log_gaps = n_gaps * scenario['gap_mean'] + np.sqrt(n_gaps) * scenario['gap_vol'] * np.random.randn(n_days, n_paths)
+    gap_factors = np.exp(np.cumsum(log_gaps, axis=0))
+
+    return paths[0::2] * gap_factors, paths[1::2] * gap_factors
+
+
+def option_prices(strikes, spot_prices, option_type, bs_config: dict, vol):
+    """
+    BS prices of options on one day, strikes are either one per path or a 2-D array of candidate strikes per path.
+    """
+    if np.ndim(strikes) == 2:
+        spot_prices = spot_prices[:, None]
+    return blackscholes_price(strikes, bs_config['time_to_expiration'], spot_prices, vol, bs_config['r'], bs_config['q'], option_type)
+
+
+def select_strikes(config: dict, spot_prices, implied_vol):
+    """
+    Returns (call_strikes, put_strikes, call_prices, put_prices) of one day on all paths, priced by the BS model with implied_vol.
+    Strategy 1 selects the pair of integer strikes within zero_cost_search_config bounds with the put/call price difference closest to zero,
+    like ZeroCostCollar0DTE.find_zero_cost_collar. Strategy 2 uses strike_selection_config, like Strategy.select_options.
+    """
+    if config['strategy_selected'] == 1:
+        bounds = config['zero_cost_search_config']
+        lower_strikes = (spot_prices * (1 + bounds['lower_bound'])).astype(int)
+        upper_strikes = (spot_prices * (1 + bounds['upper_bound'])).astype(int)
+        strikes = lower_strikes[:, None] + np.arange((upper_strikes - lower_strikes).max() + 1)      # paths x candidate strikes
+        valid = strikes <= upper_strikes[:, None]
+        call_prices = option_prices(strikes, spot_prices, 'call', config['bs_config'], implied_vol)
+        put_prices = option_prices(strikes, spot_prices, 'put', config['bs_config'], implied_vol)
+
+        # |put - call| of every (call strike, put strike) pair, pairs with a strike outside the bounds are never selected
+        cost = np.abs(put_prices[:, None, :] - call_prices[:, :, None])
+        cost[~(valid[:, :, None] & valid[:, None, :])] = np.inf
+        n_candidates = strikes.shape[1]
+        pair = cost.reshape(len(strikes), -1).argmin(axis=1)
+        call_position, put_position = pair // n_candidates, pair % n_candidates
+        rows = np.arange(len(strikes))
+        return (strikes[rows, call_position], strikes[rows, put_position],
+                call_prices[rows, call_position], put_prices[rows, put_position])
+
+    elif config['strategy_selected'] == 2:
+        rules = config['strike_selection_config']
+        if rules['base_price'] != 'Open':
+            raise ValueError("Stress test only supports strike_selection_config['base_price'] = 'Open'")
+        call_strikes = calculate_strike(spot_prices, rules['call_K_multiplier'], rules['call_K_adjust'], rules['call_K_method'])
+        put_strikes = calculate_strike(spot_prices, rules['put_K_multiplier'], rules['put_K_adjust'], rules['put_K_method'])
+        return (call_strikes, put_strikes, option_prices(call_strikes, spot_prices, 'call', config['bs_config'], implied_vol),
+                option_prices(put_strikes, spot_prices, 'put', config['bs_config'], implied_vol))
+
+    else:
+        raise ValueError("Check config, strategy does not exist. ")
+
+
+def simulate_collar(config: dict, opens, closes, implied_vol):
+    """
+    Simulate the strategy on price paths of shape (n_days, n_paths), all paths at once.
+
+    Returns
+    -------
+    dict
+        'min_nav': minimum NAV of each path, including the initial NAV of 1
+        'final_nav': NAV at the last close, or at the close before the day the strategy failed
+        'failed_day': first day on which the collar could not be traded (not enough cash), -1 if never
+    """
+    nominal_value = config['initial_portfolio_nominal_value']
+    collateral_ratio = config['collateral_ratio']
+    n_days, n_paths = opens.shape
+
+    # buy and hold at the open of the first day, all paths start at the same price
+    n_shares = math.floor(nominal_value * config['portolio_weights_config']['equity'] / opens[0, 0])
+    cash = np.full(n_paths, nominal_value * collateral_ratio - n_shares * opens[0, 0])
+    nav = np.ones(n_paths)
+    min_nav = np.ones(n_paths)
+    failed_day = np.full(n_paths, -1)
+
+    for day in range(n_days):
+        call_strikes, put_strikes, call_open, put_open = select_strikes(config, opens[day], implied_vol)
+        expiration = Backtest.compute_option_price_at_expiration({'Close': closes[day], 'selected_call_strike': call_strikes, 'selected_put_strike': put_strikes})
+
+        # the same checks and cash flows as Portfolio.execute_orders on the basket of collar_orders, the short call is fully margined
+        margin = call_open * n_shares
+        cash_after_put = cash - put_open * n_shares + expiration['put_price_at_close'] * n_shares
+        feasible = (cash >= margin) & (cash >= put_open * n_shares) & (cash_after_put + margin >= expiration['call_price_at_close'] * n_shares)
+        newly_failed = (failed_day == -1) & ~feasible
+        failed_day[newly_failed] = day
+        alive = failed_day == -1
+
+        cash = np.where(alive, cash_after_put + margin - expiration['call_price_at_close'] * n_shares, cash)
+        nav = np.where(alive, (cash + n_shares * closes[day]) / collateral_ratio / nominal_value, nav)
+        min_nav = np.minimum(min_nav, nav)
+
+    return {'min_nav': min_nav, 'final_nav': nav, 'failed_day': failed_day}
+
+
+def simulate_chunk(config: dict, scenario: dict, S0, n_days, n_paths, seed):
+    np.random.seed(seed)
+    bs_config = config['bs_config']
+    opens, closes = simulate_spy_paths(S0, n_days, n_paths, scenario, bs_config['r'], bs_config['q'])
+    implied_vol = scenario['implied_vol'] if scenario['implied_vol'] is not None else bs_config['vol']
+    return simulate_collar(config, opens, closes, implied_vol)
+
+
+def run_stress_test(config: dict=None, scenario: dict=None, n_days=TRADING_DAYS_PER_YEAR, n_paths=10000, S0=None,
+                    chunk_paths=2000, max_workers=None, seed=0) -> dict:
+    """
+    Simulate the strategy of config (see pipeline.make_config) on n_paths simulated SPY paths of n_days days.
+
+    Parameters
+    ----------
+    scenario: dict
+        Overrides of DEFAULT_SCENARIO (vols, overnight variance share and gaps).
+    S0: scalar
+        Price of SPY at the first open, default is the last close in data/SPY.csv.
+    chunk_paths: int
+        Number of paths simulated at once by a worker, memory is about 3 * n_days * chunk_paths floats per worker.
+    max_workers: int
+        Number of worker processes, default is the number of cores. 1 runs all chunks in this process.
+    seed: int
+        Chunk i is simulated with seed + i, so results don't depend on max_workers.
+
+    Returns
+    -------
+    dict
+        min_nav, final_nav and failed_day arrays of all paths (see simulate_collar), the probability of the minimum NAV breaching
+        pipeline.NAV_FLOOR, the probability of failing to trade the collar, and quantiles of the minimum NAV.
+    """
+    config = config or make_config()
+    scenario = make_scenario(scenario)
+    if S0 is None:
+        S0 = get_spy_data('0000-00-00', '9999-99-99')['Close'].values[-1]
+
+    chunk_sizes = [min(chunk_paths, n_paths - start) for start in range(0, n_paths, chunk_paths)]
+    args = [(config, scenario, S0, n_days, size, seed + i) for i, size in enumerate(chunk_sizes)]
+    if max_workers == 1:
+        results = [simulate_chunk(*arg) for arg in args]
+    else:
+        with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+            results = list(executor.map(simulate_chunk, *zip(*args)))
+
+    result = {key: np.concatenate([chunk[key] for chunk in results]) for key in ['min_nav', 'final_nav', 'failed_day']}
+    result['breach_probability'] = float(np.mean(result['min_nav'] < NAV_FLOOR))
+    result['failure_probability'] = float(np.mean(result['failed_day'] >= 0))
+    result['min_nav_quantiles'] = pd.Series(np.quantile(result['min_nav'], MIN_NAV_QUANTILES), index=MIN_NAV_QUANTILES)
+
+    return result
@@ -0,0 +1,162 @@
+"""
+Grid evaluation of Strategy 2 strike rules (strike_selection_config) without simulating every rule.
+
+With a fixed equity position, the daily collar pnl is closed-form given the open prices and the intrinsic values at the close,
+so the NAV of every rule is computed from cumulative collar pnl. Strikes of every day and rule are selected with broadcasting,
+each distinct (day, type, strike) is priced once (fetched price if known, otherwise the BS model), and the collar pnl and NAV
+of all days x put rules x call rules are computed in one NumPy pass.
+
+    grid = make_grid({'put_K_multiplier': np.arange(0.97, 1.0, 0.0025), 'call_K_multiplier': np.arange(1.0, 1.03, 0.0025)})
+    result = evaluate_strike_grid(backtest, grid, config['bs_config'])
+    grid_to_frame(result).sort_values('min_nav')
+"""
+import numpy as np
+import pandas as pd
+
+import config as default_config
+from backtest import Backtest
+from pipeline import initial_equity_quantity, NAV_FLOOR
+from utils import blackscholes_price, calculate_strike, generate_option_ticker_vectorized
+
+
+LEG_PARAMS = {
+    'put': ['put_K_multiplier', 'put_K_adjust', 'put_K_method'],
+    'call': ['call_K_multiplier', 'call_K_adjust', 'call_K_method']
+}
+GRID_AXES = LEG_PARAMS['put'] + LEG_PARAMS['call']
+
+
+def make_grid(overrides: dict=None) -> dict:
+    """
+    Returns {parameter: array of values} for every axis in GRID_AXES. Missing axes use the single value in config.strike_selection_config.
+    """
+    grid = {axis: np.atleast_1d(default_config.strike_selection_config[axis]) for axis in GRID_AXES}
+    for axis, values in (overrides or {}).items():
+        if axis not in grid:
+            raise ValueError(f"Unknown grid axis {axis}, please use one of {GRID_AXES}")
+        grid[axis] = np.atleast_1d(values)
+    return grid
+
+
+def leg_strikes(base_prices, grid: dict, option_type: str):
+    """
+    Strikes of one leg for every day and rule of that leg, shape (n_days, n_multipliers, n_adjusts, n_methods).
+    """
+    multiplier_axis, adjust_axis, method_axis = LEG_PARAMS[option_type]
+    multipliers = np.asarray(grid[multiplier_axis], dtype=float)[None, :, None]
+    adjusts = np.asarray(grid[adjust_axis], dtype=float)[None, None, :]
+    return np.stack([calculate_strike(base_prices[:, None, None], multipliers, adjusts, method) for method in grid[method_axis]], axis=-1)
+
+
+def known_option_prices(backtest: Backtest, open_price_config: dict=None) -> pd.Series:
+    """
+    Open prices already fetched, indexed by option ticker: backtest.option_data (if it still has tickers)
+    and prices cached by the data API (PolygonAPI(cache_prices=True)) with the same open_price_config.
+    """
+    known = []
+    option_data = backtest.option_data
+    if option_data is not None and 'option_tickers' in option_data and 'open_price' in option_data:
+        known.append(pd.Series(option_data['open_price'].values, index=option_data['option_tickers'].values))
+
+    price_cache = getattr(backtest.data_api, 'price_cache', None)
+    if price_cache and open_price_config:
+        cached = {key[0]: price for key, price in price_cache.items()
+                  if price is not None and key[1:3] == (open_price_config['bar_multiplier'], open_price_config['bar_timespan'])
+                  and key[5] == open_price_config['price_type'] and key[3] == key[4]}
+        known.append(pd.Series(cached, dtype=float))
+
+    if not known:
+        return pd.Series(dtype=float)
+    known = pd.concat(known)
+    return known[~known.index.duplicated(keep='first')]
+
+
+def price_strikes(strikes, option_type, dates, spot_prices, bs_config: dict, known_prices: pd.Series, underlying_ticker='SPY'):
+    """
+    Open prices of the options of an (n_days, ...) array of strikes. Every distinct (day, strike) is priced once,
+    with its known price if any, otherwise with the BS model.
+
+    Returns
+    -------
+    (prices, is_known): arrays with the shape of strikes
+    """
+    n_days = strikes.shape[0]
+    day_positions = np.broadcast_to(np.arange(n_days).reshape((-1,) + (1,) * (strikes.ndim - 1)), strikes.shape).ravel()
+    pairs, inverse = np.unique(np.column_stack([day_positions, strikes.ravel()]), axis=0, return_inverse=True)
+    unique_days, unique_strikes = pairs[:, 0].astype(int), pairs[:, 1]
+
+    tickers = generate_option_ticker_vectorized(np.array([underlying_ticker] * len(pairs)), dates[unique_days],
+                                                np.array([option_type] * len(pairs)), unique_strikes)
+    positions = known_prices.index.get_indexer(tickers) if len(known_prices) else np.full(len(pairs), -1)
+    is_known = positions >= 0
+    prices = np.where(is_known, known_prices.values[positions], np.nan)
+    prices[~is_known] = blackscholes_price(unique_strikes[~is_known], bs_config['time_to_expiration'], spot_prices[unique_days[~is_known]],
+                                           bs_config['vol'], bs_config['r'], bs_config['q'], option_type)
+
+    inverse = inverse.ravel()
+    return prices[inverse].reshape(strikes.shape), is_known[inverse].reshape(strikes.shape)
+
+
+def evaluate_strike_grid(backtest: Backtest, grid: dict, bs_config: dict, open_price_config: dict=None, base_price='Open', underlying_ticker='SPY') -> dict:
+    """
+    Evaluate every combination of the grid axes (see make_grid) on all days of backtest.main_df, with the strategy executed
+    as in pipeline.simulate (buy and hold the equity at the first open, a collar on the whole position every day).
+    Trades are assumed to have enough cash, there is no rebalancing.
+
+    Returns
+    -------
+    dict
+        'coords': {axis: values} of the grid, in the order of GRID_AXES,
+        'min_nav', 'final_nav', 'mean_collar_cost', 'known_price_ratio' and 'breached_nav_floor': metrics cubes with one dimension per axis,
+        mean_collar_cost is per unit of the underlying, known_price_ratio is the share of option prices found in known_option_prices
+        (including BS fallback prices of the fetch), the rest are priced by the BS model here.
+    """
+    main_df = backtest.main_df
+    portfolio = backtest.portfolio
+    dates = main_df['Date'].values
+    open_prices = main_df['Open'].values.astype(float)
+    close_prices = main_df['Close'].values.astype(float)
+    base_prices = main_df[base_price].values.astype(float)
+    known_prices = known_option_prices(backtest, open_price_config)
+
+    # leg pnl per unit of the underlying, short call and long put, for days x rules of each leg
+    legs = {}
+    for option_type in ['put', 'call']:
+        strikes = leg_strikes(base_prices, grid, option_type)
+        open_option_prices, is_known = price_strikes(strikes, option_type, dates, open_prices, bs_config, known_prices, underlying_ticker)
+        sign = 1 if option_type == 'put' else -1
+        close_option_prices = np.maximum(sign * (strikes - close_prices.reshape(-1, 1, 1, 1)), 0)      # intrinsic value at expiration
+        legs[option_type] = {
+            'cost': (sign * open_option_prices).reshape(len(dates), -1),
+            'pnl': (sign * (close_option_prices - open_option_prices)).reshape(len(dates), -1),
+            'known': is_known.reshape(len(dates), -1)
+        }
+
+    # days x put rules x call rules
+    collar_pnl = legs['put']['pnl'][:, :, None] + legs['call']['pnl'][:, None, :]
+    n_shares = initial_equity_quantity(backtest)
+    cash = portfolio.initial_portfolio_nominal_value * portfolio.collateral_ratio - n_shares * open_prices[0]
+    port_values = cash + n_shares * np.cumsum(collar_pnl, axis=0) + n_shares * close_prices[:, None, None]
+    nav = port_values / portfolio.collateral_ratio / portfolio.shares
+
+    shape = tuple(len(grid[axis]) for axis in GRID_AXES)
+    min_nav = np.minimum(nav.min(axis=0), 1)         # including the initial NAV of 1
+    collar_cost = legs['put']['cost'].mean(axis=0)[:, None] + legs['call']['cost'].mean(axis=0)[None, :]
+    known_ratio = (legs['put']['known'].mean(axis=0)[:, None] + legs['call']['known'].mean(axis=0)[None, :]) / 2
+
+    return {
+        'coords': {axis: grid[axis] for axis in GRID_AXES},
+        'min_nav': min_nav.reshape(shape),
+        'final_nav': nav[-1].reshape(shape),
+        'mean_collar_cost': collar_cost.reshape(shape),
+        'known_price_ratio': known_ratio.reshape(shape),
+        'breached_nav_floor': (min_nav < NAV_FLOOR).reshape(shape)
+    }
+
+
+def grid_to_frame(result: dict) -> pd.DataFrame:
+    """
+    Flatten the metrics cubes of evaluate_strike_grid into a DataFrame with one row per rule and one column per metric.
+    """
+    index = pd.MultiIndex.from_product(list(result['coords'].values()), names=list(result['coords']))
+    return pd.DataFrame({metric: values.ravel() for metric, values in result.items() if metric != 'coords'}, index=index)
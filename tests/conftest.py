@@ -0,0 +1,19 @@
+import os
+import sys
+
+import pytest
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if REPO_DIR not in sys.path:
+    sys.path.insert(0, REPO_DIR)
+
+
+@pytest.fixture
+def asset_data(monkeypatch):
+    """
+    SPY prices of data/SPY.csv, the working directory is the repo so paths relative to it resolve like in main.ipynb.
+    """
+    from data_processing import get_spy_data
+    monkeypatch.chdir(REPO_DIR)
+    return get_spy_data('0000-00-00', '9999-99-99')
@@ -0,0 +1,55 @@
+import pytest
+
+from backtest import Backtest
+from feasibility import ModelPriceAPI
+from pipeline import make_config, prepare_backtest, fetch_and_select_options, simulate, make_strategy
+
+
+class CrashingPriceAPI(ModelPriceAPI):
+    """
+    Prices like ModelPriceAPI and raises on the n_fetches + 1-th fetch, like a worker killed while fetching.
+    """
+
+    def __init__(self, n_fetches):
+        self.n_fetches = n_fetches
+
+    def try_get_polygon_price_multithread(self, *args, **kwargs):
+        if self.n_fetches == 0:
+            raise ConnectionError('connection lost')
+        self.n_fetches -= 1
+        return super().try_get_polygon_price_multithread(*args, **kwargs)
+
+
+def make_backtest_config(strategy_selected, fetch_chunk_days=None):
+    return make_config({'start_date': '2023-01-03', 'end_date': '2023-03-31', 'strategy_selected': strategy_selected,
+                        'fetch_chunk_days': fetch_chunk_days})
+
+
+@pytest.mark.parametrize('strategy_selected', [1, 2, 3])
+def test_chunked_fetch_matches_fetching_all_days(asset_data, strategy_selected):
+    navs = []
+    for fetch_chunk_days in [None, 7]:
+        backtest, strategy = prepare_backtest(make_backtest_config(strategy_selected, fetch_chunk_days), asset_data, ModelPriceAPI())
+        simulate(backtest, strategy)
+        navs.append(backtest.portfolio.nav_history)
+    assert navs[0] == navs[1]
+
+
+@pytest.mark.parametrize('strategy_selected', [1, 2, 3])
+def test_crash_while_fetching_resumes_from_checkpoint(asset_data, tmp_path, strategy_selected):
+    config = make_backtest_config(strategy_selected)
+    expected, strategy = prepare_backtest(config, asset_data, ModelPriceAPI())
+    simulate(expected, strategy)
+
+    path = str(tmp_path / 'backtest.pkl')
+    backtest, strategy = prepare_backtest(config, asset_data, CrashingPriceAPI(n_fetches=2), fetch=False)
+    backtest.enable_checkpoints(path, fetch_chunk_days=10)
+    with pytest.raises(ConnectionError):
+        fetch_and_select_options(backtest, strategy, config)
+
+    backtest = Backtest.load_checkpoint(path, ModelPriceAPI())
+    assert backtest.n_priced_days == 20         # the chunks fetched before the crash are kept
+    strategy = make_strategy(config, backtest.portfolio, 'SPY', backtest.main_df)
+    fetch_and_select_options(backtest, strategy, config)
+    simulate(backtest, strategy)
+    assert backtest.portfolio.nav_history == expected.portfolio.nav_history
@@ -0,0 +1,18 @@
+from config_search import trial_score
+
+
+def make_trial(min_nav, final_nav=1.01, stop_reason=None, error=None):
+    return {'metrics': {'min_nav': min_nav, 'final_nav': final_nav, 'breached_nav_floor': min_nav < 0.995,
+                        'stop_reason': stop_reason, 'error': error}}
+
+
+def test_trial_score_uses_the_floor_of_the_search():
+    trial = make_trial(min_nav=0.99)
+    assert trial_score(trial, 'final_nav', nav_floor=0.98) == (True, 1.01)
+    assert trial_score(trial, 'final_nav', nav_floor=0.995) == (False, 1.01)
+    assert trial_score(trial, 'final_nav', nav_floor=None) == (True, 1.01)
+
+
+def test_trial_score_eliminates_stopped_and_failed_trials():
+    assert not trial_score(make_trial(1.0, stop_reason='Drawdown 0.03 exceeded 0.02 on 2023-02-21'), 'final_nav', 0.98)[0]
+    assert not trial_score(make_trial(1.0, error='not enough cash'), 'final_nav', 0.98)[0]
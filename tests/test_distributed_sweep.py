@@ -0,0 +1,81 @@
+import time
+import multiprocessing
+
+import pytest
+
+from distributed_sweep import submit_sweep, run_worker
+from feasibility import ModelPriceAPI
+from utils import open_job_queue
+
+
+COLLATERAL_RATIOS = [1.0, 1.1, 1.2, 1.3, 1.4, 1.5]
+
+
+def sweep_configs():
+    return [{'start_date': '2023-01-03', 'end_date': '2023-01-31', 'strategy_selected': 2, 'collateral_ratio': ratio,
+             'portolio_weights_config': {'equity': 0.8, 'cash': ratio - 0.8}} for ratio in COLLATERAL_RATIOS]
+
+
+def worker(queue_path, asset_data, worker_id):
+    run_worker(open_job_queue(queue_path), ModelPriceAPI(), asset_data, worker_id=worker_id, poll_seconds=0.1)
+
+
+@pytest.fixture(params=['directory', 'sqlite'])
+def queue_path(request, tmp_path):
+    return str(tmp_path / 'queue') if request.param == 'directory' else str(tmp_path / 'queue.sqlite')
+
+
+def test_workers_run_every_job_once(queue_path, asset_data):
+    queue = open_job_queue(queue_path)
+    job_ids = submit_sweep(queue, sweep_configs())
+    assert submit_sweep(queue, sweep_configs()) == job_ids          # resubmitting the grid adds no job
+    assert queue.status() == {'pending': len(COLLATERAL_RATIOS), 'running': 0, 'done': 0, 'failed': 0}
+
+    context = multiprocessing.get_context('spawn')
+    workers = [context.Process(target=worker, args=(queue_path, asset_data, f"worker-{i}")) for i in range(3)]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join(timeout=300)
+        assert process.exitcode == 0
+
+    results = queue.results()
+    assert queue.status() == {'pending': 0, 'running': 0, 'done': len(COLLATERAL_RATIOS), 'failed': 0}
+    assert sorted(result['job_id'] for result in results) == sorted(job_ids)
+    assert all(result['metrics']['error'] is None and result['metrics']['n_days'] > 0 for result in results)
+
+
+def test_expired_lease_is_requeued_then_failed(queue_path):
+    queue = open_job_queue(queue_path, lease_seconds=0.2, max_attempts=2)
+    job_id, = queue.submit([{'collateral_ratio': 1.3}])
+
+    job = queue.claim('crashed-1')
+    assert job['job_id'] == job_id and queue.state(job_id) == 'running'
+    time.sleep(0.3)
+    assert queue.requeue_stale() == 1
+    assert queue.state(job_id) == 'pending'
+
+    job = queue.claim('crashed-2')
+    assert job['attempts'] == 1
+    time.sleep(0.3)
+    assert queue.requeue_stale() == 1
+    assert queue.state(job_id) == 'failed'
+    assert queue.failures()[0]['error'] == 'lease of worker crashed-2 expired'
+
+    # results of workers whose lease expired are discarded
+    assert not queue.complete(job_id, 'crashed-2', {'job_id': job_id})
+    assert not queue.heartbeat(job_id, 'crashed-2')
+    assert queue.status() == {'pending': 0, 'running': 0, 'done': 0, 'failed': 1}
+
+
+def test_late_result_does_not_complete_a_requeued_job(queue_path):
+    queue = open_job_queue(queue_path, lease_seconds=0.2)
+    job_id, = queue.submit([{'collateral_ratio': 1.3}])
+    queue.claim('slow')
+    time.sleep(0.3)
+    assert queue.claim('fast')['job_id'] == job_id          # the claim requeues the expired job first
+
+    assert not queue.complete(job_id, 'slow', {'job_id': job_id, 'worker_id': 'slow'})
+    assert queue.complete(job_id, 'fast', {'job_id': job_id, 'worker_id': 'fast'})
+    assert queue.status() == {'pending': 0, 'running': 0, 'done': 1, 'failed': 0}
+    assert queue.results() == [{'job_id': job_id, 'worker_id': 'fast'}]
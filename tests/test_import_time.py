@@ -0,0 +1,36 @@
+import json
+import os
+import subprocess
+import sys
+
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+IMPORT_BUDGET_MS = 1500         # cold import of the core engine, mostly numpy and pandas
+LAZY_MODULES = ['matplotlib', 'scipy', 'tqdm', 'polygon']
+
+IMPORT_SCRIPT = """
+import json, sys, time
+start = time.perf_counter()
+import backtest
+elapsed_ms = (time.perf_counter() - start) * 1000
+print(json.dumps({'elapsed_ms': elapsed_ms, 'modules': sorted({name.split('.')[0] for name in sys.modules})}))
+"""
+
+
+def cold_import_backtest() -> dict:
+    """
+    Import backtest in a new interpreter and return the import time in ms and the top-level modules loaded.
+    """
+    result = subprocess.run([sys.executable, '-c', IMPORT_SCRIPT], cwd=REPO_DIR, capture_output=True, text=True, check=True,
+                            env={**os.environ, 'PYTHONDONTWRITEBYTECODE': '1'})
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def test_import_backtest_within_budget():
+    elapsed_ms = cold_import_backtest()['elapsed_ms']
+    assert elapsed_ms < IMPORT_BUDGET_MS, f"import backtest took {elapsed_ms:.0f} ms, budget is {IMPORT_BUDGET_MS} ms"
+
+
+def test_import_backtest_does_not_load_heavy_dependencies():
+    loaded = set(cold_import_backtest()['modules'])
+    assert not loaded & set(LAZY_MODULES), f"imported at import time: {sorted(loaded & set(LAZY_MODULES))}"
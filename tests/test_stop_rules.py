@@ -0,0 +1,28 @@
+import pytest
+
+from feasibility import ModelPriceAPI
+from pipeline import make_config, prepare_backtest, simulate, simulate_pipelined
+
+
+def run_with_stop_rules(config, asset_data, pipelined, nav_floor=None, max_drawdown=None):
+    backtest, strategy = prepare_backtest(config, asset_data, ModelPriceAPI(), fetch=not pipelined)
+    backtest.nav_floor = nav_floor
+    backtest.max_drawdown = max_drawdown
+    if pipelined:
+        simulate_pipelined(backtest, strategy, config, chunk_days=7)
+    else:
+        simulate(backtest, strategy)
+    return backtest
+
+
+@pytest.mark.parametrize('strategy_selected', [2, 3])
+@pytest.mark.parametrize('stop_rules', [{'nav_floor': 0.995}, {'max_drawdown': 0.02}])
+def test_pipelined_run_stops_like_plain_run(asset_data, strategy_selected, stop_rules):
+    config = make_config({'start_date': '2023-01-03', 'end_date': '2023-06-30', 'strategy_selected': strategy_selected})
+    plain = run_with_stop_rules(config, asset_data, False, **stop_rules)
+    pipelined = run_with_stop_rules(config, asset_data, True, **stop_rules)
+
+    assert plain.stop_reason is not None
+    assert pipelined.stop_reason == plain.stop_reason
+    assert pipelined.n_simulated_days == plain.n_simulated_days < len(plain.main_df)
+    assert pipelined.portfolio.nav_history == plain.portfolio.nav_history
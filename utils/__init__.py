@@ -1,6 +1,17 @@
 from .asset_class_validator import AssetClassValidator
-from .option_functions import blackscholes_price, blackscholes_mc, blackscholes_impv_scalar, blackscholes_impv
+from .option_functions import blackscholes_price, blackscholes_mc, blackscholes_impv_scalar, blackscholes_impv, blackscholes_impv_bisect
 from .polygon_functions import DataNotAvailableError, PolygonAPI
+from .data_schema import compact_option_data, compact_main_df, memory_report, get_strike, encode_contract_id, decode_contract_id
+from .vol_smile import fit_vol_smiles, smile_vols, log_moneyness, implied_vols_from_prices
+from .column_registry import ColumnRegistry
+from .contract_index import ContractIndex
+from .run_store import RunStore
+from .option_book import OptionBook, parse_option_tickers
+from .option_store import OptionStore, ingest_flat_files, parse_flat_file
+from .stage_cache import StageCache, freeze_config, config_digest, frame_digest, source_digest
+from .job_queue import DirectoryJobQueue, SQLiteJobQueue, open_job_queue
+from .price_cube import OptionPriceCube
+from .rebalancing import calendar_rebalance_days, compute_drift, target_quantity, rebalance_schedule, rebalance_orders
 from .utils import find_indices_closest_to_zero_sum, calculate_strike, plot_distribution, convert_date_format, generate_option_ticker, generate_option_ticker_vectorized
 
 __all__ = [
@@ -9,6 +20,7 @@ __all__ = [
     'blackscholes_mc', 
     'blackscholes_impv_scalar', 
     'blackscholes_impv',
+    'blackscholes_impv_bisect',
     'calculate_strike',
     'plot_distribution',
     'convert_date_format',
@@ -16,5 +28,37 @@ __all__ = [
     'generate_option_ticker',
     'DataNotAvailableError',
     'PolygonAPI',
-    'generate_option_ticker_vectorized'
+    'generate_option_ticker_vectorized',
+    'compact_option_data',
+    'compact_main_df',
+    'memory_report',
+    'get_strike',
+    'encode_contract_id',
+    'decode_contract_id',
+    'fit_vol_smiles',
+    'smile_vols',
+    'log_moneyness',
+    'implied_vols_from_prices',
+    'ColumnRegistry',
+    'ContractIndex',
+    'RunStore',
+    'calendar_rebalance_days',
+    'compute_drift',
+    'target_quantity',
+    'rebalance_schedule',
+    'rebalance_orders',
+    'OptionBook',
+    'parse_option_tickers',
+    'OptionStore',
+    'ingest_flat_files',
+    'parse_flat_file',
+    'StageCache',
+    'freeze_config',
+    'config_digest',
+    'frame_digest',
+    'source_digest',
+    'DirectoryJobQueue',
+    'SQLiteJobQueue',
+    'open_job_queue',
+    'OptionPriceCube'
 ]
\ No newline at end of file
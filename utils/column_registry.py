@@ -0,0 +1,109 @@
+class ColumnRegistry:
+    """
+    ColumnRegistry declares how derived columns of a DataFrame (Backtest.main_df) are computed from other columns,
+    and computes them lazily in dependency order.
+
+    - A spec registers output columns, the columns they depend on (inputs) and a function func(df) returning {output: values}.
+    - compute(names) computes the requested columns and, first, any of their inputs that are missing or out of date.
+    - Results are memoized: a column is recomputed only if the version of one of its inputs changed since it was computed,
+      or if its spec was registered again with a different function or params.
+    - Columns written outside the registry (e.g. fetched option prices) are source columns. Call touch(names) after writing them,
+      so columns depending on them are recomputed the next time they are needed.
+
+    The owner (e.g. a Backtest) is referenced instead of the DataFrame itself, as the owner may replace its main_df (e.g. Backtest.extend).
+
+    Usage:
+        columns = ColumnRegistry(backtest)
+        columns.register(['collar_cost'], inputs=['put_price_at_open', 'call_price_at_open'], func=compute_collar_cost)
+        columns.compute(['collar_cost'])
+    """
+
+    def __init__(self, owner, df_attribute='main_df'):
+        self.owner = owner
+        self.df_attribute = df_attribute
+        self.specs = {}             # {output column: spec}, outputs of the same spec share the spec dict
+        self.versions = {}          # {column: version}, bumped every time a column is computed or touched
+        self.computed_with = {}     # {output column: {input column: version of the input used in the last computation}}
+
+
+    @property
+    def df(self):
+        return getattr(self.owner, self.df_attribute)
+
+
+    def register(self, outputs, inputs, func, params=None):
+        """
+        Register or replace the spec of output columns. Registering the same func and params again keeps memoized results.
+        """
+        for name in outputs:
+            spec = self.specs.get(name)
+            if spec is not None and spec['func'] == func and spec['params'] == params and spec['inputs'] == list(inputs):
+                continue
+            self.computed_with.pop(name, None)
+
+        spec = {'outputs': list(outputs), 'inputs': list(inputs), 'func': func, 'params': params}
+        for name in outputs:
+            self.specs[name] = spec
+
+
+    def is_registered(self, name):
+        return name in self.specs
+
+
+    def version(self, name):
+        return self.versions.get(name, 0)
+
+
+    def touch(self, names):
+        """
+        Mark columns as changed, columns depending on them will be recomputed when needed.
+        """
+        for name in names:
+            self.versions[name] = self.version(name) + 1
+
+
+    def is_up_to_date(self, name):
+        """
+        Whether a column exists and none of the columns it depends on (directly or indirectly) changed since it was computed.
+        """
+        if name not in self.specs:
+            return name in self.df.columns
+        if not self._is_computed_with_current_inputs(name):
+            return False
+        return all(self.is_up_to_date(col) for col in self.specs[name]['inputs'])
+
+
+    def _is_computed_with_current_inputs(self, name):
+        if name not in self.df.columns or name not in self.computed_with:
+            return False
+        return all(self.computed_with[name].get(col) == self.version(col) for col in self.specs[name]['inputs'])
+
+
+    def compute(self, names):
+        """
+        Compute the given columns if they are missing or out of date, inputs are computed first.
+        """
+        for name in names:
+            self._compute(name, visiting=())
+
+
+    def _compute(self, name, visiting):
+        if name not in self.specs:
+            if name not in self.df.columns:
+                raise KeyError(f"Column {name} is neither in the DataFrame nor registered in the ColumnRegistry")
+            return
+        if name in visiting:
+            raise ValueError(f"Circular column dependency: {' -> '.join(visiting + (name,))}")
+
+        spec = self.specs[name]
+        for col in spec['inputs']:
+            self._compute(col, visiting + (name,))
+        if self._is_computed_with_current_inputs(name):
+            return
+
+        result = spec['func'](self.df)
+        df = self.df
+        for output in spec['outputs']:
+            df[output] = result[output]
+            self.touch([output])
+            self.computed_with[output] = {col: self.version(col) for col in spec['inputs']}
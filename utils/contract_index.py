@@ -0,0 +1,110 @@
+import os
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+
+from .option_book import parse_option_tickers
+
+
+CONTRACT_COLS = ['underlying', 'expiration_date', 'option_type', 'strike', 'ticker']
+CALENDAR_COLS = ['underlying', 'date', 'n_contracts']
+
+
+class ContractIndex:
+    """
+    Local index of listed option contracts per underlying and expiration date, built from the contracts reference data of the data API
+    (PolygonAPI.fetch_listed_contracts) and saved as CSV files, so each expiration date is only requested once.
+
+    The calendar table records every (underlying, date) that has been indexed, with the number of contracts expiring on that date.
+    Dates with 0 contracts are known gaps (e.g. SPY had no 0DTE options on most days before Nov 2022),
+    options on these dates are priced by the BS model without any price request.
+
+    Usage:
+        index = ContractIndex(data_api)
+        index.update('SPY', backtest.main_df['Date'].values)     # only requests dates not indexed yet
+        index.save()
+        backtest.contract_index = index
+    """
+
+    def __init__(self, data_api=None, directory=None):
+        self.data_api = data_api
+        self.directory = directory or os.path.join(os.getcwd(), 'data', 'contract_index')
+        self.contracts = pd.DataFrame(columns=CONTRACT_COLS)
+        self.calendar = pd.DataFrame(columns=CALENDAR_COLS)
+        self._listed_tickers = set()
+        self.load()
+
+
+    @property
+    def contracts_path(self):
+        return os.path.join(self.directory, 'contracts.csv')
+
+
+    @property
+    def calendar_path(self):
+        return os.path.join(self.directory, 'calendar.csv')
+
+
+    def load(self):
+        if os.path.exists(self.contracts_path) and os.path.exists(self.calendar_path):
+            self.contracts = pd.read_csv(self.contracts_path)
+            self.calendar = pd.read_csv(self.calendar_path)
+            self._listed_tickers = set(self.contracts['ticker'].values)
+
+
+    def save(self):
+        os.makedirs(self.directory, exist_ok=True)
+        for df, path in [(self.contracts, self.contracts_path), (self.calendar, self.calendar_path)]:
+            temp_path = path + '.tmp'
+            df.to_csv(temp_path, index=False)
+            os.replace(temp_path, path)
+
+
+    def indexed_dates(self, underlying):
+        return set(self.calendar.loc[self.calendar['underlying'] == underlying, 'date'].values)
+
+
+    def update(self, underlying, dates, max_workers=10):
+        """
+        Request the contracts expiring on the given dates which have not been indexed yet and add them to the index.
+        """
+        new_dates = sorted(set(dates) - self.indexed_dates(underlying))
+        if not new_dates:
+            return
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+            results = list(executor.map(lambda date: self.data_api.fetch_listed_contracts(underlying, date), new_dates))
+
+        new_contracts = [pd.DataFrame(contracts, columns=CONTRACT_COLS) for contracts in results if contracts]
+        new_calendar = pd.DataFrame({
+            'underlying': underlying,
+            'date': new_dates,
+            'n_contracts': [len(contracts) for contracts in results]
+        })
+        contracts = [df for df in [self.contracts, *new_contracts] if not df.empty]
+        if contracts:                           # no contracts at all if every date is a gap
+            self.contracts = pd.concat(contracts, ignore_index=True)
+        self.calendar = pd.concat([df for df in [self.calendar, new_calendar] if not df.empty], ignore_index=True)
+        self._listed_tickers.update(self.contracts['ticker'].values)
+
+
+    def is_listed(self, tickers, dates=None):
+        """
+        Returns a boolean mask of the given option tickers which are listed.
+        If dates are given, tickers on dates not indexed yet for their underlying are assumed listed, so they are still requested.
+        """
+        listed = np.fromiter((ticker in self._listed_tickers for ticker in tickers), dtype=bool, count=len(tickers))
+        if dates is not None and len(tickers):
+            underlyings = parse_option_tickers(tickers)['underlying'].values
+            indexed = pd.MultiIndex.from_arrays([self.calendar['underlying'].values, self.calendar['date'].values])
+            listed |= ~pd.MultiIndex.from_arrays([underlyings, np.asarray(dates)]).isin(indexed)
+        return listed
+
+
+    def gap_dates(self, underlying):
+        """
+        Indexed dates without any contract expiring on that date.
+        """
+        calendar = self.calendar[self.calendar['underlying'] == underlying]
+        return calendar.loc[calendar['n_contracts'] == 0, 'date'].values
@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+
+STRIKE_SCALE = 1000         # strikes are stored as int32 strike * 1000, same precision as the strike part of an option ticker
+OPTION_TYPE_CODES = {'call': 0, 'put': 1}
+
+# descriptive columns of Backtest.main_df which can be stored as float32, no order, cash flow or NAV is computed from them
+MAIN_DF_FLOAT32_COLS = ['High', 'Low', 'Adj Close']
+
+
+def date_to_ordinal(dates):
+    """
+    Convert 'yyyy-mm-dd' dates to int32 ordinals (number of days since 1970-01-01).
+    """
+    return pd.to_datetime(np.asarray(dates), format='%Y-%m-%d').values.astype('datetime64[D]').astype(np.int32)
+
+
+def ordinal_to_date(ordinals):
+    """
+    Convert int32 date ordinals back to 'yyyy-mm-dd' strings.
+    """
+    return np.datetime_as_string(np.asarray(ordinals).astype('datetime64[D]'), unit='D')
+
+
+def encode_contract_id(date_ordinals, option_types, strikes_milli):
+    """
+    Encode an option contract of a single underlying as an int64 id: ((date_ordinal * 2 + type_code) * 10^8 + strike * 1000).
+    The id keeps the order of the option ticker (expiration date, type, strike). The underlying is not encoded.
+    """
+    type_codes = pd.Series(option_types).map(OPTION_TYPE_CODES).values.astype(np.int64)
+    return (np.asarray(date_ordinals, dtype=np.int64) * 2 + type_codes) * 10**8 + np.asarray(strikes_milli, dtype=np.int64)
+
+
+def decode_contract_id(contract_ids):
+    """
+    Returns (date_ordinals, option_types, strikes) of the given contract ids.
+    """
+    contract_ids = np.asarray(contract_ids, dtype=np.int64)
+    strikes = (contract_ids % 10**8) / STRIKE_SCALE
+    date_and_type = contract_ids // 10**8
+    option_types = np.where(date_and_type % 2 == 0, 'call', 'put')
+    date_ordinals = (date_and_type // 2).astype(np.int32)
+    return date_ordinals, option_types, strikes
+
+
+def get_strike(option_data):
+    """
+    Returns the strike price of option_data (DataFrame or a row of it) in either the original or the compact schema.
+    """
+    if 'strike' in option_data:
+        return option_data['strike']
+    return option_data['strike_milli'] / STRIKE_SCALE
+
+
+def compact_option_data(option_data: pd.DataFrame) -> pd.DataFrame:
+    """
+    Convert option_data generated by Backtest.generate_option_parameters to the compact schema:
+
+    - option_tickers, date_from, date_to -> contract_id (int64) and date_ordinal (int32)
+    - option_type                        -> categorical (int8 codes)
+    - strike                             -> strike_milli (int32, strike * 1000)
+    - spot_price                         -> float32
+    - main_df_index                      -> int32
+
+    open_price stays float64, because zero-cost collar selection compares sums of call and put prices
+    and float32 rounding would change the selected pair on near ties.
+
+    Must be called after option prices are fetched, because fetching needs the option tickers.
+    Column order and row order are unchanged, so the compact frame can be used by the same selection functions.
+    """
+    if 'contract_id' in option_data:
+        return option_data
+
+    date_ordinals = date_to_ordinal(option_data['date_from'].values)
+    strikes_milli = np.rint(option_data['strike'].values * STRIKE_SCALE).astype(np.int32)
+
+    compact_df = pd.DataFrame({
+        'contract_id': encode_contract_id(date_ordinals, option_data['option_type'].values, strikes_milli),
+        'date_ordinal': date_ordinals,
+        'option_type': pd.Categorical(option_data['option_type'].values, categories=list(OPTION_TYPE_CODES)),
+        'strike_milli': strikes_milli,
+        'spot_price': option_data['spot_price'].values.astype(np.float32),
+        'main_df_index': option_data['main_df_index'].values.astype(np.int32),
+        }, index=option_data.index)
+
+    for col in option_data.columns:
+        if col not in ['option_tickers', 'date_from', 'date_to', 'option_type', 'strike', 'spot_price', 'main_df_index']:
+            compact_df[col] = option_data[col]
+
+    return compact_df
+
+
+def compact_main_df(main_df: pd.DataFrame) -> pd.DataFrame:
+    """
+    Downcast the descriptive columns of Backtest.main_df (MAIN_DF_FLOAT32_COLS) to float32 in place.
+    Open and Close, strikes, option prices and pnl columns stay float64, as orders, cash and NAV are computed from them
+    and float32 rounding would change simulated results.
+    """
+    for col in MAIN_DF_FLOAT32_COLS:
+        if col in main_df.columns:
+            main_df[col] = main_df[col].astype(np.float32)
+
+    return main_df
+
+
+def memory_report(before: dict, after: dict) -> pd.DataFrame:
+    """
+    Compare the memory footprint of DataFrames before and after converting to the compact schema.
+
+    Parameters
+    ----------
+    before, after: dict
+        {name: DataFrame} of the same DataFrames in the original and compact schema.
+
+    Returns
+    -------
+    pd.DataFrame
+        Number of rows, total bytes and bytes per row before and after, and the reduction ratio of each DataFrame.
+    """
+    report = {}
+    for name in before:
+        n_rows = max(len(before[name]), 1)
+        bytes_before = before[name].memory_usage(index=True, deep=True).sum()
+        bytes_after = after[name].memory_usage(index=True, deep=True).sum()
+        report[name] = {
+            'rows': len(before[name]),
+            'bytes_before': bytes_before,
+            'bytes_after': bytes_after,
+            'bytes_per_row_before': bytes_before / n_rows,
+            'bytes_per_row_after': bytes_after / n_rows,
+            'reduction_ratio': bytes_before / bytes_after
+        }
+
+    return pd.DataFrame.from_dict(report, orient='index')
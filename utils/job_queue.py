@@ -0,0 +1,323 @@
+import os
+import json
+import time
+import random
+import sqlite3
+
+from .stage_cache import config_digest
+
+
+JOB_STATES = ['pending', 'running', 'done', 'failed']
+
+
+def job_id_of(config: dict) -> str:
+    """
+    Job ids are derived from the config, so submitting the same config twice doesn't run it twice.
+    """
+    return config_digest(config)[:20]
+
+
+def open_job_queue(path, lease_seconds=300, max_attempts=3):
+    """
+    SQLiteJobQueue if path is a .sqlite or .db file, otherwise DirectoryJobQueue.
+    """
+    if str(path).endswith(('.sqlite', '.db')):
+        return SQLiteJobQueue(path, lease_seconds, max_attempts)
+    return DirectoryJobQueue(path, lease_seconds, max_attempts)
+
+
+class DirectoryJobQueue:
+    """
+    Queue of backtest jobs on a shared directory, usable by workers on several hosts mounting the same directory (e.g. NFS):
+
+        <directory>/pending/<job_id>.json               config and number of failed attempts of a job waiting for a worker
+        <directory>/running/<job_id>@<worker_id>.json   claimed job, the modification time of the file is the last heartbeat of its worker
+        <directory>/done/<job_id>.json                  result row of the job
+        <directory>/failed/<job_id>.json                job which failed max_attempts times, with its last error
+
+    A worker claims a job by renaming its pending file, renames are atomic so a job is claimed by one worker only.
+    The lease of a claimed job expires lease_seconds after the last heartbeat, expired jobs are moved back to pending by requeue_stale
+    (called by every claim), e.g. when their worker crashed or its host went down. Files are written to hidden temp files then renamed.
+    """
+
+    def __init__(self, directory, lease_seconds=300, max_attempts=3):
+        self.directory = directory
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        for state in JOB_STATES:
+            os.makedirs(os.path.join(directory, state), exist_ok=True)
+
+
+    def path(self, state, name):
+        return os.path.join(self.directory, state, name + '.json')
+
+
+    def running_path(self, job_id, worker_id):
+        return self.path('running', f"{job_id}@{worker_id}")
+
+
+    def write(self, path, content: dict):
+        temp_path = os.path.join(os.path.dirname(path), '.' + os.path.basename(path) + f".{os.getpid()}.tmp")
+        with open(temp_path, 'w') as f:
+            json.dump(content, f)
+        os.replace(temp_path, path)
+
+
+    @staticmethod
+    def read(path):
+        with open(path) as f:
+            return json.load(f)
+
+
+    def list_names(self, state):
+        return [name[:-len('.json')] for name in os.listdir(os.path.join(self.directory, state)) if name.endswith('.json') and not name.startswith('.')]
+
+
+    def submit(self, configs) -> list:
+        """
+        Add a job per config, configs already submitted (pending, running, done or failed) are skipped. Returns the job ids of all configs.
+        """
+        job_ids = []
+        for config in configs:
+            job_id = job_id_of(config)
+            job_ids.append(job_id)
+            if self.state(job_id) is None:
+                self.write(self.path('pending', job_id), {'job_id': job_id, 'config': config, 'attempts': 0})
+        return job_ids
+
+
+    def state(self, job_id):
+        for state in ['done', 'failed', 'pending']:
+            if os.path.exists(self.path(state, job_id)):
+                return state
+        # running files being completed or requeued (.completing, .stale) are still running
+        if any(name.split('@')[0] == job_id for name in os.listdir(os.path.join(self.directory, 'running')) if not name.startswith('.')):
+            return 'running'
+        return None
+
+
+    def claim(self, worker_id):
+        """
+        Claim a pending job. Returns the job (job_id, config, attempts) or None if no job is pending.
+        """
+        self.requeue_stale()
+        names = self.list_names('pending')
+        random.shuffle(names)       # workers starting together don't all race for the same job
+        for job_id in names:
+            running_path = self.running_path(job_id, worker_id)
+            try:
+                os.rename(self.path('pending', job_id), running_path)
+            except FileNotFoundError:
+                continue            # claimed by another worker
+            try:
+                os.utime(running_path)      # the pending file kept the time it was written, it could look stale to requeue_stale
+                return self.read(running_path)
+            except FileNotFoundError:
+                continue
+        return None
+
+
+    def heartbeat(self, job_id, worker_id) -> bool:
+        """
+        Extend the lease of a claimed job. Returns False if the lease was lost (the job was requeued).
+        """
+        try:
+            os.utime(self.running_path(job_id, worker_id))
+            return True
+        except FileNotFoundError:
+            return False
+
+
+    def complete(self, job_id, worker_id, result: dict) -> bool:
+        """
+        Write the result of a claimed job. Returns False without writing it if the lease was lost (the job was requeued).
+        """
+        running_path = self.running_path(job_id, worker_id)
+        completing_path = running_path + '.completing'
+        try:
+            os.rename(running_path, completing_path)        # atomic, either this or requeue_stale takes the running file
+        except FileNotFoundError:
+            return False
+        self.write(self.path('done', job_id), result)
+        os.remove(completing_path)
+        return True
+
+
+    def fail(self, job_id, worker_id, error: str):
+        """
+        Requeue a job whose worker failed, or move it to failed after max_attempts attempts.
+        """
+        running_path = self.running_path(job_id, worker_id)
+        try:
+            job = self.read(running_path)
+        except FileNotFoundError:
+            return          # the lease was lost, the job was requeued already
+        self.retry(job, error)
+        self.release(job_id, worker_id)
+
+
+    def release(self, job_id, worker_id):
+        try:
+            os.remove(self.running_path(job_id, worker_id))
+        except FileNotFoundError:
+            pass
+
+
+    def retry(self, job: dict, error: str):
+        job = dict(job, attempts=job['attempts'] + 1, error=error)
+        state = 'failed' if job['attempts'] >= self.max_attempts else 'pending'
+        self.write(self.path(state, job['job_id']), job)
+
+
+    def requeue_stale(self) -> int:
+        """
+        Move jobs whose lease expired back to pending (or to failed after max_attempts). Returns the number of jobs moved.
+        """
+        now = time.time()
+        n_requeued = 0
+        for name in self.list_names('running'):
+            running_path = self.path('running', name)
+            try:
+                if os.path.getmtime(running_path) + self.lease_seconds > now:
+                    continue
+                stale_path = running_path + '.stale'
+                os.rename(running_path, stale_path)         # only one worker requeues a job
+            except FileNotFoundError:
+                continue
+            job_id = name.split('@')[0]
+            if not os.path.exists(self.path('done', job_id)):
+                self.retry(self.read(stale_path), f"lease of worker {name.split('@', 1)[1]} expired")
+                n_requeued += 1
+            os.remove(stale_path)
+        return n_requeued
+
+
+    def status(self) -> dict:
+        return {state: len(self.list_names(state)) for state in JOB_STATES}
+
+
+    def results(self) -> list:
+        return [self.read(self.path('done', job_id)) for job_id in sorted(self.list_names('done'))]
+
+
+    def failures(self) -> list:
+        return [self.read(self.path('failed', job_id)) for job_id in sorted(self.list_names('failed'))]
+
+
+class SQLiteJobQueue:
+    """
+    Queue of backtest jobs in a SQLite database, same interface as DirectoryJobQueue.
+    Claims are transactions, so any number of worker processes on the host of the database can share it.
+    SQLite locking is not reliable on network file systems, use DirectoryJobQueue for workers on several hosts.
+    """
+
+    def __init__(self, path, lease_seconds=300, max_attempts=3):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        with self.connect() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS jobs (job_id TEXT PRIMARY KEY, config TEXT, state TEXT, worker_id TEXT, "
+                               "lease_expires REAL, attempts INTEGER, result TEXT, error TEXT)")
+            connection.execute("CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state, lease_expires)")
+
+
+    def connect(self):
+        connection = sqlite3.connect(self.path, timeout=60, isolation_level=None)       # transactions are started explicitly
+        connection.execute('PRAGMA journal_mode=WAL')
+        return Transaction(connection)
+
+
+    def submit(self, configs) -> list:
+        jobs = [(job_id_of(config), json.dumps(config)) for config in configs]
+        with self.connect() as connection:
+            connection.executemany("INSERT OR IGNORE INTO jobs (job_id, config, state, attempts) VALUES (?, ?, 'pending', 0)", jobs)
+        return [job_id for job_id, _ in jobs]
+
+
+    def state(self, job_id):
+        with self.connect() as connection:
+            row = connection.execute("SELECT state FROM jobs WHERE job_id = ?", (job_id,)).fetchone()
+        return row[0] if row else None
+
+
+    def claim(self, worker_id):
+        with self.connect() as connection:
+            self._requeue_stale(connection)
+            row = connection.execute("SELECT job_id, config, attempts FROM jobs WHERE state = 'pending' LIMIT 1").fetchone()
+            if row is None:
+                return None
+            connection.execute("UPDATE jobs SET state = 'running', worker_id = ?, lease_expires = ? WHERE job_id = ?",
+                               (worker_id, time.time() + self.lease_seconds, row[0]))
+        return {'job_id': row[0], 'config': json.loads(row[1]), 'attempts': row[2]}
+
+
+    def heartbeat(self, job_id, worker_id) -> bool:
+        with self.connect() as connection:
+            cursor = connection.execute("UPDATE jobs SET lease_expires = ? WHERE job_id = ? AND worker_id = ? AND state = 'running'",
+                                        (time.time() + self.lease_seconds, job_id, worker_id))
+        return cursor.rowcount == 1
+
+
+    def complete(self, job_id, worker_id, result: dict) -> bool:
+        with self.connect() as connection:
+            cursor = connection.execute("UPDATE jobs SET state = 'done', result = ?, lease_expires = NULL "
+                                        "WHERE job_id = ? AND worker_id = ? AND state = 'running'", (json.dumps(result), job_id, worker_id))
+        return cursor.rowcount == 1
+
+
+    def fail(self, job_id, worker_id, error: str):
+        with self.connect() as connection:
+            connection.execute("UPDATE jobs SET attempts = attempts + 1, error = ?, lease_expires = NULL, "
+                               "state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END "
+                               "WHERE job_id = ? AND worker_id = ? AND state = 'running'", (error, self.max_attempts, job_id, worker_id))
+
+
+    def requeue_stale(self) -> int:
+        with self.connect() as connection:
+            return self._requeue_stale(connection)
+
+
+    def _requeue_stale(self, connection) -> int:
+        cursor = connection.execute("UPDATE jobs SET attempts = attempts + 1, error = 'lease of worker ' || worker_id || ' expired', lease_expires = NULL, "
+                                    "state = CASE WHEN attempts + 1 >= ? THEN 'failed' ELSE 'pending' END "
+                                    "WHERE state = 'running' AND lease_expires < ?", (self.max_attempts, time.time()))
+        return cursor.rowcount
+
+
+    def status(self) -> dict:
+        with self.connect() as connection:
+            counts = dict(connection.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        return {state: counts.get(state, 0) for state in JOB_STATES}
+
+
+    def results(self) -> list:
+        with self.connect() as connection:
+            rows = connection.execute("SELECT result FROM jobs WHERE state = 'done' ORDER BY job_id").fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+
+    def failures(self) -> list:
+        with self.connect() as connection:
+            rows = connection.execute("SELECT job_id, config, attempts, error FROM jobs WHERE state = 'failed' ORDER BY job_id").fetchall()
+        return [{'job_id': job_id, 'config': json.loads(config), 'attempts': attempts, 'error': error} for job_id, config, attempts, error in rows]
+
+
+class Transaction:
+    """
+    Context manager running the statements of a connection in one write transaction (BEGIN IMMEDIATE), and closing the connection.
+    """
+
+    def __init__(self, connection):
+        self.connection = connection
+
+
+    def __enter__(self):
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+
+    def __exit__(self, exc_type, exc, traceback):
+        try:
+            self.connection.execute('ROLLBACK' if exc_type else 'COMMIT')
+        finally:
+            self.connection.close()
@@ -0,0 +1,156 @@
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+
+from .option_functions import blackscholes_price
+from .data_schema import date_to_ordinal, encode_contract_id, decode_contract_id
+
+
+OPTION_TICKER_PATTERN = r'^O:(?P<underlying>[A-Z]+)(?P<expiration>\d{6})(?P<type>[CP])(?P<strike>\d{8})$'
+CLOSE_BAR = (1, 'day', 'close')     # (multiplier, timespan, price_type) of the daily close bars used as marks
+
+
+def parse_option_tickers(tickers) -> pd.DataFrame:
+    """
+    Parse option tickers (e.g. O:SPY240119P00470000) into underlying, expiration_date ('yyyy-mm-dd'), option_type and strike_milli (int, strike * 1000).
+    """
+    parsed = pd.Series(np.asarray(tickers, dtype=object), dtype=object).str.extract(OPTION_TICKER_PATTERN)
+    invalid = parsed['underlying'].isna().values
+    if invalid.any():
+        raise ValueError(f"Option positions held overnight must be named by their option ticker, e.g. O:SPY240119P00470000. "
+                         f"Invalid names: {list(np.asarray(tickers)[invalid][:5])}")
+
+    expiration = parsed['expiration']
+    return pd.DataFrame({
+        'underlying': parsed['underlying'].values,
+        'expiration_date': ('20' + expiration.str[0:2] + '-' + expiration.str[2:4] + '-' + expiration.str[4:6]).values,
+        'option_type': np.where(parsed['type'].values == 'C', 'call', 'put'),
+        'strike_milli': parsed['strike'].astype(np.int64).values
+    })
+
+
+class OptionBook:
+    """
+    Arrays of the option contracts held by a portfolio, so the whole book is marked to market and valued with array operations.
+
+    Contracts are identified by option tickers in Portfolio positions. The book is rebuilt from the positions only when they changed
+    (see Portfolio.positions_version), expiration date, type and strike of every contract are decoded from its contract id
+    (utils.encode_contract_id). All contracts are assumed to be on the same underlying.
+
+    Marks are daily closes cached by the data API (PolygonAPI(cache_prices=True), bars of CLOSE_BAR), contracts without a cached close
+    are priced together by the BS model with their remaining time to expiration, and at their intrinsic value on the expiration date.
+    """
+
+    def __init__(self):
+        self.version = None             # Portfolio.positions_version the book was built from
+        self.marked_version = None      # Portfolio.positions_version the marks were computed for
+        self.tickers = np.array([], dtype=object)
+        self.quantities = np.zeros(0)
+        self.contract_ids = np.zeros(0, dtype=np.int64)
+        self.expiration_ordinals = np.zeros(0, dtype=np.int32)
+        self.option_types = np.array([], dtype=object)
+        self.strikes = np.zeros(0)
+        self.marks = np.zeros(0)
+        self.mark_sources = np.array([], dtype=object)
+
+
+    def __len__(self):
+        return len(self.tickers)
+
+
+    def sync(self, option_positions: dict, version):
+        """
+        Rebuild the arrays from {ticker: quantity} if the positions changed since the last sync.
+        """
+        if version == self.version:
+            return
+
+        self.tickers = np.array(list(option_positions), dtype=object)
+        self.quantities = np.array(list(option_positions.values()), dtype=float)
+        parsed = parse_option_tickers(self.tickers)
+        self.contract_ids = encode_contract_id(date_to_ordinal(parsed['expiration_date'].values), parsed['option_type'].values, parsed['strike_milli'].values)
+        self.expiration_ordinals, self.option_types, self.strikes = decode_contract_id(self.contract_ids)
+        self.marks = np.full(len(self.tickers), np.nan)
+        self.mark_sources = np.full(len(self.tickers), None, dtype=object)
+        self.version = version
+        self.marked_version = None
+
+
+    def days_to_expiration(self, date):
+        return self.expiration_ordinals - date_to_ordinal([date])[0]
+
+
+    def expired(self, date):
+        """
+        Mask of contracts expiring on or before date.
+        """
+        return self.days_to_expiration(date) <= 0
+
+
+    def intrinsic_values(self, spot_price):
+        return np.where(self.option_types == 'call', np.maximum(spot_price - self.strikes, 0), np.maximum(self.strikes - spot_price, 0))
+
+
+    def cached_closes(self, date, data_api=None, fetch=False, max_workers=10):
+        """
+        Closes of date of every contract from the price cache of data_api, NaN if not cached.
+        If fetch is True, closes not cached yet are requested from data_api first (and cached by it).
+        """
+        price_cache = getattr(data_api, 'price_cache', None)
+        multiplier, timespan, price_type = CLOSE_BAR
+        keys = [(ticker, multiplier, timespan, date, date, price_type) for ticker in self.tickers]
+
+        if fetch and data_api is not None:
+            to_fetch = [ticker for ticker, key in zip(self.tickers, keys) if price_cache is None or key not in price_cache]
+            with concurrent.futures.ThreadPoolExecutor(max_workers=max_workers) as executor:
+                fetched = dict(zip(to_fetch, executor.map(lambda ticker: data_api.fetch_option_price(ticker, multiplier, timespan, date, date, price_type, raise_error=False), to_fetch)))
+            if price_cache is None:
+                return np.array([fetched.get(ticker) for ticker in self.tickers], dtype=float)
+
+        if not price_cache:
+            return np.full(len(self.tickers), np.nan)
+        return np.array([price_cache.get(key) for key in keys], dtype=float)
+
+
+    def mark_to_market(self, date, spot_price, bs_config: dict, data_api=None, fetch=False):
+        """
+        Mark every contract at the close of date. Returns the marks, sources are stored in self.mark_sources ('cache', 'bs' or 'intrinsic').
+        """
+        days_to_expiration = self.days_to_expiration(date)
+        marks = self.cached_closes(date, data_api, fetch)
+        sources = np.where(np.isnan(marks), None, 'cache').astype(object)
+
+        at_expiration = np.isnan(marks) & (days_to_expiration <= 0)
+        marks[at_expiration] = self.intrinsic_values(spot_price)[at_expiration]
+        sources[at_expiration] = 'intrinsic'
+
+        to_price = np.isnan(marks)
+        if to_price.any():
+            marks[to_price] = blackscholes_price(self.strikes[to_price], days_to_expiration[to_price] / 365, spot_price, bs_config['vol'],
+                                                 bs_config['r'], bs_config['q'], self.option_types[to_price])
+            sources[to_price] = 'bs'
+
+        self.marks = marks
+        self.mark_sources = sources
+        self.marked_version = self.version
+        return marks
+
+
+    def value(self):
+        if self.marked_version != self.version:
+            raise Exception("Option positions changed since they were marked to market, please call mark_to_market again")
+        return float(self.quantities @ self.marks)
+
+
+    def to_frame(self) -> pd.DataFrame:
+        return pd.DataFrame({
+            'ticker': self.tickers,
+            'contract_id': self.contract_ids,
+            'expiration_ordinal': self.expiration_ordinals,
+            'option_type': self.option_types,
+            'strike': self.strikes,
+            'quantity': self.quantities,
+            'mark': self.marks,
+            'mark_source': self.mark_sources
+        })
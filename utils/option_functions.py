@@ -1,6 +1,14 @@
 
 import numpy as np
-from scipy.stats import norm
+
+
+def norm_cdf(x):
+    """
+    Standard normal CDF, same as scipy.stats.norm.cdf.
+    scipy.special is imported on first use, because importing scipy.stats takes longer than importing the rest of the backtest engine.
+    """
+    from scipy.special import ndtr
+    return ndtr(x)
 
 
 
@@ -22,8 +30,8 @@ def blackscholes_price(K, T, S, vol, r=0, q=0, callput='call'):
         The annualized risk-free interest rate, continuously compounded.
     q: scalar or array_like
         The annualized continuous dividend yield.
-    callput: str
-        Must be either 'call' or 'put'.
+    callput: str or array_like
+        Must be either 'call' or 'put', or an array of them with the same shape as the other inputs.
 
     Returns
     -------
@@ -39,11 +47,17 @@ def blackscholes_price(K, T, S, vol, r=0, q=0, callput='call'):
     v = vol*np.sqrt(T)
     d1 = np.log(F/K)/v + 0.5*v
     d2 = d1 - v
-    try:
-        opttype = {'call':1, 'put':-1}[callput.lower()]
-    except:
-        raise ValueError('The value of callput must be either "call" or "put".')
-    price = opttype*(F*norm.cdf(opttype*d1)-K*norm.cdf(opttype*d2))*np.exp(-r*T)
+    if isinstance(callput, str):
+        try:
+            opttype = {'call':1, 'put':-1}[callput.lower()]
+        except:
+            raise ValueError('The value of callput must be either "call" or "put".')
+    else:
+        callput = np.char.lower(np.asarray(callput, dtype=str))
+        if not np.all(np.isin(callput, ['call', 'put'])):
+            raise ValueError('The values of callput must be either "call" or "put".')
+        opttype = np.where(callput == 'call', 1, -1)
+    price = opttype*(F*norm_cdf(opttype*d1)-K*norm_cdf(opttype*d2))*np.exp(-r*T)
     return price
 
 
@@ -124,20 +138,20 @@ def blackscholes_impv_scalar(K, T, S, value, r=0, q=0, callput='call', tol=1e-6,
     p = np.log(K)
     if K >= 1:
         x0 = np.sqrt(2 * p)
-        x1 = x0 - (0.5 - K * norm.cdf(-x0) - value) * np.sqrt(2*np.pi)
+        x1 = x0 - (0.5 - K * norm_cdf(-x0) - value) * np.sqrt(2*np.pi)
         while (abs(x0 - x1) > tol*np.sqrt(T)) and (j < maxiter):
             x0 = x1
             d1 = -p/x1+0.5*x1
-            x1 = x1 - (norm.cdf(d1) - K*norm.cdf(d1-x1)-value)*np.sqrt(2*np.pi)*np.exp(0.5*d1**2)
+            x1 = x1 - (norm_cdf(d1) - K*norm_cdf(d1-x1)-value)*np.sqrt(2*np.pi)*np.exp(0.5*d1**2)
             j += 1
         return x1 / np.sqrt(T)
     else:
         x0 = np.sqrt(-2 * p)
-        x1 = x0 - (0.5*K-norm.cdf(-x0)-value)*np.sqrt(2*np.pi)/K
+        x1 = x0 - (0.5*K-norm_cdf(-x0)-value)*np.sqrt(2*np.pi)/K
         while (abs(x0-x1) > tol*np.sqrt(T)) and (j < maxiter):
             x0 = x1
             d1 = -p/x1+0.5*x1
-            x1 = x1-(K*norm.cdf(x1-d1)-norm.cdf(-d1)-value)*np.sqrt(2*np.pi)*np.exp(0.5*d1**2)
+            x1 = x1-(K*norm_cdf(x1-d1)-norm_cdf(-d1)-value)*np.sqrt(2*np.pi)*np.exp(0.5*d1**2)
             j += 1
         return x1 / np.sqrt(T)
 
@@ -145,6 +159,36 @@ def blackscholes_impv_scalar(K, T, S, value, r=0, q=0, callput='call', tol=1e-6,
 blackscholes_impv = np.vectorize(blackscholes_impv_scalar, excluded={'callput', 'tol', 'maxiter'})
 
 
+# vectorized implied volatility by bisection, all inputs can be arrays (callput included)
+def blackscholes_impv_bisect(K, T, S, value, r=0, q=0, callput='call', vol_low=1e-4, vol_high=5, n_iter=60):
+    """Compute implied vols in Black-Scholes model for arrays of options at once
+
+    Slower per option than blackscholes_impv_scalar, but it's a fixed number of array operations,
+    which is much faster than calling the scalar function for thousands of options.
+
+    Returns
+    -------
+    vol: ndarray
+        The implied vols, nan if the value is outside the range of prices given by vol_low and vol_high.
+    """
+    K, T, S, value = np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in (K, T, S, value)))
+    if not isinstance(callput, str):
+        callput = np.broadcast_to(np.asarray(callput, dtype=str), K.shape)
+    low = np.full(K.shape, float(vol_low))
+    high = np.full(K.shape, float(vol_high))
+    price_low = blackscholes_price(K, T, S, low, r, q, callput)
+    price_high = blackscholes_price(K, T, S, high, r, q, callput)
+    valid = (value >= price_low) & (value <= price_high)
+
+    for _ in range(n_iter):
+        mid = 0.5 * (low + high)
+        too_high = blackscholes_price(K, T, S, mid, r, q, callput) > value
+        high = np.where(too_high, mid, high)
+        low = np.where(too_high, low, mid)
+
+    return np.where(valid, 0.5 * (low + high), np.nan)
+
+
 
 if __name__ == '__main__':
 
@@ -0,0 +1,245 @@
+import os
+import json
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+
+from .option_book import OPTION_TICKER_PATTERN, parse_option_tickers
+from .polygon_functions import add_prices_with_bs_fallback
+from .run_store import import_pyarrow
+
+
+TIMESPAN_NS = {'second': 10**9, 'minute': 60 * 10**9, 'hour': 3600 * 10**9, 'day': 86400 * 10**9}
+BAR_COLS = ['ticker', 'expiration_date', 'option_type', 'strike_milli', 'window_start', 'open', 'high', 'low', 'close', 'volume']
+MARKET_TIMEZONE = 'America/New_York'
+
+
+def parse_flat_file(path, underlyings=None) -> pd.DataFrame:
+    """
+    Parse a daily bulk file of option aggregates (e.g. Polygon flat files us_options_opra/minute_aggs_v1/2024/01/2024-01-02.csv.gz,
+    columns ticker, volume, open, close, high, low, window_start (ns since epoch), transactions) into the columns of the store.
+    Only options on the given underlyings are kept. A 'vwap' column is kept if the file has one.
+    """
+    bars = pd.read_csv(path)
+    bars = bars[bars['ticker'].str.match(OPTION_TICKER_PATTERN).values].reset_index(drop=True)     # e.g. skips adjusted contracts
+    parsed = parse_option_tickers(bars['ticker'].values)
+    keep = np.isin(parsed['underlying'].values, underlyings) if underlyings is not None else np.ones(len(bars), dtype=bool)
+    bars, parsed = bars[keep].reset_index(drop=True), parsed[keep].reset_index(drop=True)
+
+    # trading date of every bar in market time, converted once per distinct day
+    days = pd.to_datetime(bars['window_start'].values, utc=True).tz_convert(MARKET_TIMEZONE).normalize()
+    codes, unique_days = pd.factorize(days)
+    dates = unique_days.strftime('%Y-%m-%d').values[codes] if len(bars) else np.array([], dtype=object)
+
+    result = pd.DataFrame({
+        'underlying': parsed['underlying'].values,
+        'date': dates,
+        'ticker': bars['ticker'].values,
+        'expiration_date': parsed['expiration_date'].values,
+        'option_type': parsed['option_type'].values,
+        'strike_milli': parsed['strike_milli'].values,
+        'window_start': bars['window_start'].values.astype(np.int64),
+        'open': bars['open'].values,
+        'high': bars['high'].values,
+        'low': bars['low'].values,
+        'close': bars['close'].values,
+        'volume': bars['volume'].values
+    })
+    if 'vwap' in bars:
+        result['vwap'] = bars['vwap'].values
+
+    return result
+
+
+def ingest_flat_file(path, directory, underlyings=None) -> list:
+    """
+    Parse one bulk file and write one Parquet file per (underlying, date) partition, rows sorted by type, strike and time,
+    so reads filtered by strike only decode the row groups containing those strikes. Returns [(underlying, date, n_rows), ...].
+    """
+    pa = import_pyarrow()
+    bars = parse_flat_file(path, underlyings)
+    file_name = os.path.basename(path).split('.')[0] + '.parquet'
+
+    written = []
+    for (underlying, date), partition in bars.groupby(['underlying', 'date'], sort=False):
+        partition = partition.drop(columns=['underlying', 'date']).sort_values(['option_type', 'strike_milli', 'window_start'])
+        partition_path = os.path.join(directory, f"underlying={underlying}", f"date={date}")
+        os.makedirs(partition_path, exist_ok=True)
+        temp_path = os.path.join(partition_path, '.' + file_name + '.tmp')       # hidden files are skipped when reading a partition
+        pa.parquet.write_table(pa.Table.from_pandas(partition, preserve_index=False), temp_path, compression='zstd', row_group_size=20000)
+        os.replace(temp_path, os.path.join(partition_path, file_name))
+        written.append((underlying, date, len(partition)))
+
+    return written
+
+
+def ingest_flat_files(paths, directory=None, underlyings=None, resolution='minute', max_workers=None) -> pd.DataFrame:
+    """
+    Ingest bulk files of option aggregates into a local OptionStore, one file per worker process.
+
+    Parameters
+    ----------
+    resolution: str
+        Timespan of the bars in the files ('second' or 'minute'), the store can only build bars of this timespan or longer.
+
+    Returns
+    -------
+    pd.DataFrame
+        underlying, date and number of bars of every partition written.
+    """
+    directory = directory or OptionStore.default_directory()
+    if resolution not in TIMESPAN_NS:
+        raise ValueError(f"Unknown resolution {resolution}, please use one of {list(TIMESPAN_NS)}")
+    os.makedirs(directory, exist_ok=True)
+    OptionStore(directory).check_resolution(resolution)
+
+    paths = list(paths)
+    with concurrent.futures.ProcessPoolExecutor(max_workers) as executor:
+        results = list(executor.map(ingest_flat_file, paths, [directory] * len(paths), [underlyings] * len(paths)))
+
+    with open(os.path.join(directory, 'store.json'), 'w') as f:
+        json.dump({'resolution': resolution}, f)
+
+    return pd.DataFrame([row for result in results for row in result], columns=['underlying', 'date', 'n_bars'])
+
+
+class OptionStore:
+    """
+    Local store of option aggregates partitioned by underlying and date (<directory>/underlying=SPY/date=2024-01-02/*.parquet),
+    built by ingest_flat_files from bulk files.
+
+    OptionStore can be used as the data_api of a Backtest: get_option_price reads the open prices from the partitions of the
+    fetched days only, with only the strikes of the option chain decoded (predicate pushdown on strike_milli), and no network requests.
+    Options without bars are priced by the BS model. Days without a partition are requested from fallback_api if given.
+
+    Open prices are built like a Polygon aggregate request: the stored bars of the first bar_multiplier x bar_timespan window
+    with trades are aggregated into one bar. Bulk files have no vwap, so 'vwap' is the volume weighted (high + low + close) / 3 of the stored bars.
+    """
+
+    def __init__(self, directory=None, fallback_api=None, max_workers=8):
+        self.directory = directory or OptionStore.default_directory()
+        self.fallback_api = fallback_api
+        self.max_workers = max_workers
+
+
+    @staticmethod
+    def default_directory():
+        return os.path.join(os.getcwd(), 'data', 'option_store')
+
+
+    @property
+    def resolution(self):
+        path = os.path.join(self.directory, 'store.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)['resolution']
+
+
+    def check_resolution(self, resolution):
+        if self.resolution is not None and self.resolution != resolution:
+            raise ValueError(f"The store at {self.directory} has {self.resolution} bars, cannot add {resolution} bars")
+
+
+    def partition_path(self, underlying, date):
+        return os.path.join(self.directory, f"underlying={underlying}", f"date={date}")
+
+
+    def dates(self, underlying):
+        underlying_path = os.path.join(self.directory, f"underlying={underlying}")
+        if not os.path.exists(underlying_path):
+            return []
+        return sorted(name.split('=', 1)[1] for name in os.listdir(underlying_path) if name.startswith('date='))
+
+
+    def read_bars(self, underlying, date, strikes_milli=None, columns=None) -> pd.DataFrame:
+        """
+        Bars of one partition, only row groups with the given strikes are decoded.
+        """
+        pa = import_pyarrow()
+        partition_path = self.partition_path(underlying, date)
+        if not os.path.exists(partition_path):
+            return pd.DataFrame(columns=columns or BAR_COLS)
+
+        filters = [('strike_milli', 'in', sorted(set(int(strike) for strike in strikes_milli)))] if strikes_milli is not None else None
+        return pa.parquet.read_table(partition_path, columns=columns, filters=filters).to_pandas()
+
+
+    def first_bar_prices(self, bars: pd.DataFrame, bar_multiplier, bar_timespan, price_type) -> pd.Series:
+        """
+        Price of the first bar_multiplier x bar_timespan bar of every ticker in bars, indexed by ticker.
+        """
+        window_ns = bar_multiplier * TIMESPAN_NS[bar_timespan]
+        if self.resolution is not None and window_ns < TIMESPAN_NS[self.resolution]:
+            raise ValueError(f"The store has {self.resolution} bars, it cannot build bars of {bar_multiplier} {bar_timespan}")
+        if bars.empty:
+            return pd.Series(dtype=float)
+
+        bars = bars.assign(window=bars['window_start'].values // window_ns)
+        first_window = bars.groupby('ticker')['window'].transform('min')
+        bars = bars[bars['window'].values == first_window.values].sort_values(['ticker', 'window_start'])
+        grouped = bars.groupby('ticker', sort=False)
+
+        if price_type == 'open':
+            return grouped['open'].first()
+        elif price_type == 'close':
+            return grouped['close'].last()
+        elif price_type == 'high':
+            return grouped['high'].max()
+        elif price_type == 'low':
+            return grouped['low'].min()
+        elif price_type == 'vwap':
+            vwap = bars['vwap'] if 'vwap' in bars else (bars['high'] + bars['low'] + bars['close']) / 3
+            return (vwap * bars['volume']).groupby(bars['ticker'], sort=False).sum() / grouped['volume'].sum()
+        raise ValueError("price type input is wrong, please use one of ['open', 'high', 'low', 'close', 'vwap']. ")
+
+
+    def get_open_prices(self, option_data_df, bar_multiplier, bar_timespan, price_type) -> np.ndarray:
+        """
+        Open prices of the options in option_data_df from the store, NaN if there is no bar. Partitions are read in parallel threads.
+        """
+        tickers = option_data_df['option_tickers'].values
+        underlyings = parse_option_tickers(tickers)['underlying'].values
+        dates = option_data_df['date_from'].values
+        strikes_milli = np.rint(option_data_df['strike'].values * 1000).astype(np.int64)
+        columns = ['ticker', 'strike_milli', 'window_start', 'open', 'high', 'low', 'close', 'volume']
+
+        partitions = pd.DataFrame({'underlying': underlyings, 'date': dates, 'strike_milli': strikes_milli}).groupby(['underlying', 'date'])['strike_milli'].unique()
+
+        def read_partition_prices(key):
+            underlying, date = key
+            bars = self.read_bars(underlying, date, partitions[key], columns)
+            return self.first_bar_prices(bars, bar_multiplier, bar_timespan, price_type)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            partition_prices = list(executor.map(read_partition_prices, partitions.index))
+
+        if not partition_prices:
+            return np.full(len(tickers), np.nan)
+        # the same ticker (e.g. a longer-dated option) can have bars on several dates
+        prices = pd.concat(partition_prices, keys=[date for _, date in partitions.index])
+        return prices.reindex(pd.MultiIndex.from_arrays([dates, tickers])).values.astype(float)
+
+
+    def try_get_polygon_price_multithread(self, option_data_df, bar_multiplier, bar_timespan, price_type, bs_config, listed=None):
+        """
+        Same interface as PolygonAPI.try_get_polygon_price_multithread, prices are read from the store (price_source 'store').
+        """
+        prices = self.get_open_prices(option_data_df, bar_multiplier, bar_timespan, price_type)
+        sources = np.full(len(option_data_df), 'store', dtype=object)
+        if listed is not None:
+            prices[~np.asarray(listed)] = np.nan
+
+        if self.fallback_api is not None:
+            underlyings = parse_option_tickers(option_data_df['option_tickers'].values)['underlying'].values
+            keys = pd.MultiIndex.from_arrays([underlyings, option_data_df['date_from'].values])
+            codes, unique_keys = pd.factorize(keys)
+            stored = np.array([os.path.exists(self.partition_path(underlying, date)) for underlying, date in unique_keys], dtype=bool)[codes]
+            if not stored.all():
+                fetched = self.fallback_api.try_get_polygon_price_multithread(option_data_df[~stored].copy(), bar_multiplier, bar_timespan, price_type,
+                                                                              bs_config, None if listed is None else np.asarray(listed)[~stored])
+                prices[~stored] = fetched['open_price'].values
+                sources[~stored] = fetched['price_source'].astype(object).values
+
+        return add_prices_with_bs_fallback(option_data_df, prices, sources, bs_config)
@@ -1,32 +1,39 @@
+import os
 import concurrent.futures
 
 import numpy as np
-from polygon import RESTClient
-from tqdm import tqdm
+import pandas as pd
 
 from utils import blackscholes_price
 
 
+PRICE_SOURCES = ['polygon', 'bs', 'cache', 'store']    # values of option_data['price_source']: fetched from Polygon.io, Black-Scholes fallback, cached fetch, local OptionStore
+
+
 class DataNotAvailableError(Exception):
     """Exception raised when the required data is not available from the API."""
     pass
 
 
 class PolygonAPI():
-    def __init__(self, api_key):
+    def __init__(self, api_key, cache_prices=False, base_url=None, max_workers=20):
+        """
+        base_url is the URL of the API, default is the POLYGON_BASE_URL environment variable or https://api.polygon.io.
+        Point it at a local polygon_replay server to fetch recorded responses offline. max_workers is the number of fetching threads.
+        """
+        from polygon import RESTClient     # the Polygon client and tqdm are imported on first use to keep importing utils fast
         self.api_key = api_key
-        self.client = RESTClient(api_key)
+        self.base_url = base_url or os.environ.get('POLYGON_BASE_URL')
+        self.client = RESTClient(api_key, base=self.base_url.rstrip('/')) if self.base_url else RESTClient(api_key)
+        self.max_workers = max_workers
+        self.price_cache = {} if cache_prices else None     # {(ticker, multiplier, timespan, date_from, date_to, price_type): price or None}
 
 
     def fetch_option_price(self, ticker, multiplier, timespan, date_from, date_to, price_type, raise_error=True):
-        if price_type not in ['open', 'high', 'low', 'close', 'vwap']:
-            raise ValueError("price type input is wrong, please use one of ['open', 'high', 'low', 'close', 'vwap']. ")
-        
-        request = self.client.list_aggs(ticker, multiplier, timespan, from_=date_from, to=date_to)
-        bars = [b for b in request]
+        price, _ = self.fetch_option_price_and_source(ticker, multiplier, timespan, date_from, date_to, price_type)
 
-        if bars:
-            return getattr(bars[0], price_type)
+        if price is not None:
+            return price
         elif raise_error:
             error = (f"No data available or unsuccessful API request. "
                     f"option ticker: {ticker}, multiplier: {multiplier}, timespan: {timespan}, from: {date_from}, to: {date_to}. ")
@@ -35,66 +42,88 @@ class PolygonAPI():
             return None
 
 
-    def try_get_polygon_price(self, option_ticker, bar_multiplier, bar_timespan, date_from, date_to, price_type, option_type, spot_price, strike, bs_config, bs_days):
-        try:
-            return self.fetch_option_price(
-                option_ticker,
-                bar_multiplier, 
-                bar_timespan, 
-                date_from, 
-                date_to, 
-                price_type
-            )
+    def fetch_option_price_and_source(self, ticker, multiplier, timespan, date_from, date_to, price_type):
+        """
+        Returns (price, source), source is 'cache' if the price was fetched before and cached, otherwise 'polygon'.
+        price is None if no data is available.
+        """
+        if price_type not in ['open', 'high', 'low', 'close', 'vwap']:
+            raise ValueError("price type input is wrong, please use one of ['open', 'high', 'low', 'close', 'vwap']. ")
         
-        except DataNotAvailableError:
-            bs_days.append(f"{date_from} for {option_type}, K={strike}")
-            return blackscholes_price(
-                K=strike,
-                S=spot_price,
-                T=bs_config['time_to_expiration'],
-                vol=bs_config['vol'],
-                r=bs_config['r'],
-                q=bs_config['q'],
-                callput=option_type
-            )
-
-
-    def try_get_polygon_price_multithread(self, option_data_df, bar_multiplier, bar_timespan, price_type, bs_config):
-        option_data_df['open_price'] = np.nan
-        prices = {}
-        bs_days = []
-
-        with concurrent.futures.ThreadPoolExecutor(max_workers=20) as executor:
-            future_to_option = {
-                executor.submit(self.fetch_option_price, row['option_tickers'], bar_multiplier, bar_timespan, row['date_from'], 
-                                row['date_to'], price_type, raise_error=False): index for index, row in option_data_df.iterrows()
+        cache_key = (ticker, multiplier, timespan, date_from, date_to, price_type)
+        if self.price_cache is not None and cache_key in self.price_cache:
+            return self.price_cache[cache_key], 'cache'
+
+        request = self.client.list_aggs(ticker, multiplier, timespan, from_=date_from, to=date_to)
+        bars = [b for b in request]
+        price = getattr(bars[0], price_type) if bars else None
+        if self.price_cache is not None:
+            self.price_cache[cache_key] = price
+
+        return price, 'polygon'
+
+
+    def fetch_listed_contracts(self, underlying_ticker, expiration_date):
+        """
+        Returns [(underlying, expiration_date, option_type, strike, ticker), ...] of the contracts listed on underlying_ticker expiring on expiration_date,
+        used to build utils.ContractIndex.
+        """
+        request = self.client.list_options_contracts(underlying_ticker=underlying_ticker, expiration_date=expiration_date, 
+                                                     as_of=expiration_date, expired=True, limit=1000)
+        return [(underlying_ticker, expiration_date, c.contract_type, c.strike_price, c.ticker) for c in request]
+
+
+    def try_get_polygon_price_multithread(self, option_data_df, bar_multiplier, bar_timespan, price_type, bs_config, listed=None):
+        """
+        Fetch the prices of all options in option_data_df with multiple threads and add 'open_price' and 'price_source' columns.
+        Options without price data are priced together in one vectorized Black-Scholes call after all fetches complete.
+        If a boolean mask listed is given (see utils.ContractIndex), options not listed are not requested and priced by the BS model directly.
+        """
+        from tqdm import tqdm
+        prices = np.full(len(option_data_df), np.nan)
+        sources = np.full(len(option_data_df), 'polygon', dtype=object)
+
+        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            future_to_position = {
+                executor.submit(self.fetch_option_price_and_source, ticker, bar_multiplier, bar_timespan, date_from, date_to, price_type): position
+                for position, (ticker, date_from, date_to) in enumerate(zip(option_data_df['option_tickers'].values, 
+                                                                           option_data_df['date_from'].values, option_data_df['date_to'].values))
+                if listed is None or listed[position]
             }
 
-            futures = concurrent.futures.as_completed(future_to_option)
-            futures = tqdm(futures, total=len(future_to_option), desc="Fetching option prices using multithreading")
+            futures = concurrent.futures.as_completed(future_to_position)
+            futures = tqdm(futures, total=len(future_to_position), desc="Fetching option prices using multithreading")
 
             for future in futures:
-                index = future_to_option[future]
-                row = option_data_df.iloc[index]
-                price = future.result()
-                if price is None:
-                    # No price data available, use Black-Scholes model
-                    bs_days.append(f"{row['date_from']} for K={row['strike']} {row['option_type']} ")
-                    price = blackscholes_price(
-                        K=row['strike'],
-                        S=row['spot_price'],
-                        T=bs_config['time_to_expiration'],
-                        vol=bs_config['vol'],
-                        r=bs_config['r'],
-                        q=bs_config['q'],
-                        callput=row['option_type']
-                    )
-                prices[index] = price
-        
-        for index, price in prices.items():
-            option_data_df.at[index, 'open_price'] = price
-
-        return option_data_df, bs_days
-
-
-
+                position = future_to_position[future]
+                price, source = future.result()
+                if price is not None:
+                    prices[position] = price
+                    sources[position] = source
+
+        return add_prices_with_bs_fallback(option_data_df, prices, sources, bs_config)
+
+
+
+def add_prices_with_bs_fallback(option_data_df, prices, sources, bs_config):
+    """
+    Add 'open_price' and 'price_source' columns to option_data_df. Options without price data (NaN prices) are priced together
+    in one vectorized Black-Scholes call and their source is set to 'bs'.
+    """
+    missing = np.isnan(prices)
+    if missing.any():
+        prices[missing] = blackscholes_price(
+            K=option_data_df['strike'].values[missing],
+            S=option_data_df['spot_price'].values[missing],
+            T=bs_config['time_to_expiration'],
+            vol=bs_config['vol'],
+            r=bs_config['r'],
+            q=bs_config['q'],
+            callput=option_data_df['option_type'].values[missing]
+        )
+        sources[missing] = 'bs'
+    
+    option_data_df['open_price'] = prices
+    option_data_df['price_source'] = pd.Categorical(sources, categories=PRICE_SOURCES)
+
+    return option_data_df
@@ -0,0 +1,142 @@
+import numpy as np
+import pandas as pd
+
+from .data_schema import STRIKE_SCALE, OPTION_TYPE_CODES
+from .polygon_functions import PRICE_SOURCES
+
+
+class OptionPriceCube:
+    """
+    Dense arrays of option prices indexed by [day, strike offset, type], built from the long format option_data.
+
+    - day: position of the day in day_labels (e.g. main_df index labels), in order of first appearance in option_data
+    - strike offset: (strike - base strike of the day) / strike_step, the base strike of a day is its lowest strike
+    - type: OPTION_TYPE_CODES, 0 for calls and 1 for puts
+
+    prices is NaN where option_data has no price, sources holds the code of the price source (index in PRICE_SOURCES, -1 if missing),
+    rows the position of the option_data row a price comes from (-1 if missing), so every price can be traced back to its contract.
+    Lookups of (day, strike, type) are array indexing, without merges or filtering option_data.
+    """
+
+    def __init__(self, day_labels, base_strikes_milli, strike_step_milli, prices, sources, rows):
+        self.day_labels = pd.Index(day_labels)
+        self.base_strikes_milli = np.asarray(base_strikes_milli, dtype=np.int64)
+        self.strike_step_milli = int(strike_step_milli)
+        self.prices = prices
+        self.sources = sources
+        self.rows = rows
+
+
+    @classmethod
+    def build(cls, day_keys, strikes_milli, option_types, prices, sources=None) -> 'OptionPriceCube':
+        """
+        Build a cube from one value per option: its day (any label), strike * 1000, type ('call' or 'put'), price and price source.
+        If an option appears more than once, the last one is kept.
+        """
+        strikes_milli = np.asarray(strikes_milli, dtype=np.int64)
+        day_positions, day_labels = pd.factorize(np.asarray(day_keys))
+        type_codes = np.where(np.asarray(option_types, dtype=str) == 'put', OPTION_TYPE_CODES['put'], OPTION_TYPE_CODES['call'])
+
+        n_days = len(day_labels)
+        base_strikes_milli = np.full(n_days, np.iinfo(np.int64).max)
+        np.minimum.at(base_strikes_milli, day_positions, strikes_milli)
+        strike_offsets_milli = strikes_milli - base_strikes_milli[day_positions]
+        # the coarsest grid containing every strike, e.g. 1000 for integer strikes, 500 if some strikes end in .5
+        strike_step_milli = int(np.gcd.reduce(strike_offsets_milli)) if strike_offsets_milli.any() else STRIKE_SCALE
+        offsets = strike_offsets_milli // strike_step_milli
+        n_strikes = int(offsets.max()) + 1 if len(offsets) else 0
+
+        shape = (n_days, n_strikes, len(OPTION_TYPE_CODES))
+        cube_prices = np.full(shape, np.nan)
+        cube_sources = np.full(shape, -1, dtype=np.int8)
+        cube_rows = np.full(shape, -1, dtype=np.int64)
+        cube_prices[day_positions, offsets, type_codes] = np.asarray(prices, dtype=float)
+        if sources is not None:
+            cube_sources[day_positions, offsets, type_codes] = pd.Index(PRICE_SOURCES).get_indexer(np.asarray(sources, dtype=object))
+        cube_rows[day_positions, offsets, type_codes] = np.arange(len(strikes_milli))
+
+        return cls(day_labels, base_strikes_milli, strike_step_milli, cube_prices, cube_sources, cube_rows)
+
+
+    @classmethod
+    def from_option_data(cls, option_data: pd.DataFrame, price_col='open_price') -> 'OptionPriceCube':
+        """
+        Cube of the prices in option_data (original or compact schema, see utils.data_schema), days are main_df index labels.
+        """
+        if 'strike_milli' in option_data:
+            strikes_milli = option_data['strike_milli'].values
+        else:
+            strikes_milli = np.rint(option_data['strike'].values * STRIKE_SCALE)
+        sources = option_data['price_source'].values if 'price_source' in option_data else None
+        return cls.build(option_data['main_df_index'].values, strikes_milli, option_data['option_type'].values, option_data[price_col].values, sources)
+
+
+    @property
+    def n_days(self):
+        return self.prices.shape[0]
+
+
+    @property
+    def n_strikes(self):
+        return self.prices.shape[1]
+
+
+    def strikes(self) -> np.ndarray:
+        """
+        Strike of every [day, strike offset], shape (n_days, n_strikes).
+        """
+        return (self.base_strikes_milli[:, None] + np.arange(self.n_strikes) * self.strike_step_milli) / STRIKE_SCALE
+
+
+    def day_positions(self, day_labels) -> np.ndarray:
+        """
+        Positions of days in the cube, -1 for days not in the cube.
+        """
+        return self.day_labels.get_indexer(np.asarray(day_labels))
+
+
+    def locate(self, day_positions, strikes):
+        """
+        Returns (strike offsets, valid): valid is False for days not in the cube and strikes off the strike grid or outside the range of the day.
+        """
+        day_positions = np.asarray(day_positions)
+        known_day = day_positions >= 0
+        strikes_milli = np.rint(np.asarray(strikes, dtype=float) * STRIKE_SCALE)
+        offsets_milli = strikes_milli - self.base_strikes_milli[np.where(known_day, day_positions, 0)] if self.n_days else np.zeros_like(strikes_milli)
+        with np.errstate(invalid='ignore'):
+            offsets = np.floor_divide(offsets_milli, self.strike_step_milli)
+            valid = known_day & ~np.isnan(strikes_milli) & (offsets_milli % self.strike_step_milli == 0) & (offsets >= 0) & (offsets < self.n_strikes)
+        return np.where(valid, offsets, 0).astype(np.int64), valid
+
+
+    def lookup(self, day_positions, strikes, option_types, values='prices'):
+        """
+        Values of the given (day position, strike, type), option_types is 'call', 'put' or an array of them.
+        values is 'prices' (NaN if missing), 'sources' (price source names, None if missing) or 'rows' (option_data row positions, -1 if missing).
+        """
+        day_positions = np.asarray(day_positions)
+        offsets, valid = self.locate(day_positions, strikes)
+        type_codes = np.where(np.asarray(option_types, dtype=str) == 'put', OPTION_TYPE_CODES['put'], OPTION_TYPE_CODES['call'])
+        cube = getattr(self, values)
+        found = cube[np.where(valid, day_positions, 0), offsets, type_codes] if self.n_days else np.zeros(len(valid), dtype=cube.dtype)
+
+        if values == 'prices':
+            return np.where(valid, found, np.nan)
+        found = np.where(valid, found, -1)
+        if values == 'sources':
+            return np.where(found >= 0, np.asarray(PRICE_SOURCES, dtype=object)[found], None)
+        return found
+
+
+    def day_chain(self, day_position, option_type):
+        """
+        Returns (strikes, prices) of the options of one day and type with a price, in ascending strike order.
+        """
+        prices = self.prices[day_position, :, OPTION_TYPE_CODES[option_type]]
+        has_price = ~np.isnan(prices)
+        strikes = (self.base_strikes_milli[day_position] + np.flatnonzero(has_price) * self.strike_step_milli) / STRIKE_SCALE
+        return strikes, prices[has_price]
+
+
+    def memory_usage(self) -> int:
+        return self.prices.nbytes + self.sources.nbytes + self.rows.nbytes
@@ -0,0 +1,165 @@
+import math
+
+import numpy as np
+import pandas as pd
+
+
+REBALANCE_RULES = [None, 'calendar', 'band', 'calendar_band']
+CALENDAR_FREQUENCIES = {'W': 'W', 'M': 'M', 'Q': 'Q', 'Y': 'Y'}
+
+
+def calendar_rebalance_days(dates, frequency, next_date=None, day_offset=0):
+    """
+    Returns a boolean mask of the rebalance days of a calendar rule.
+
+    Parameters
+    ----------
+    dates: array_like
+        Trading days as 'yyyy-mm-dd' strings.
+    frequency: str or int
+        'W', 'M', 'Q' or 'Y' rebalances at the close of the last trading day of every week, month, quarter or year.
+        An int n rebalances at the close of every n-th trading day.
+    next_date: str, optional
+        The trading day after the last day of dates, if dates are only a part of the backtest (e.g. a chunk run by Backtest.run).
+        Without it, the last day is not a rebalance day as its period may continue after the backtest.
+    day_offset: int
+        Number of trading days of the backtest before the first day of dates (e.g. Backtest.n_simulated_days), so an int frequency
+        counts trading days from the start of the backtest, and chunked or resumed runs rebalance on the same days as a single run.
+    """
+    n_days = len(dates)
+    if isinstance(frequency, (int, np.integer)):
+        return (day_offset + np.arange(n_days) + 1) % frequency == 0
+    if frequency not in CALENDAR_FREQUENCIES:
+        raise ValueError(f"Unknown rebalance frequency {frequency}, please use one of {list(CALENDAR_FREQUENCIES)} or an int")
+    if not n_days:
+        return np.zeros(0, dtype=bool)
+
+    all_dates = np.append(np.asarray(dates), next_date) if next_date is not None else np.asarray(dates)
+    periods = pd.to_datetime(all_dates, format='%Y-%m-%d').to_period(CALENDAR_FREQUENCIES[frequency]).asi8
+    is_period_end = periods[1:] != periods[:-1]
+    return is_period_end if next_date is not None else np.append(is_period_end, False)
+
+
+def compute_drift(asset_values: dict, target_weights: dict, collateral_ratio=1):
+    """
+    Weights and drifts of asset classes for all days at once.
+    Weights are scaled like target_portfolio_weights, which sum to collateral_ratio.
+
+    Parameters
+    ----------
+    asset_values: dict
+        {asset class: values}, values are scalars or arrays of the same length (one value per day). Cash is an asset class.
+
+    Returns
+    -------
+    pd.DataFrame
+        '<asset class>_weight' and '<asset class>_drift' (weight - target weight) columns, and 'max_abs_drift'.
+    """
+    values = {asset_class: np.atleast_1d(np.asarray(value, dtype=float)) for asset_class, value in asset_values.items()}
+    total_value = sum(values.values())
+
+    result = {}
+    for asset_class, value in values.items():
+        weight = value / total_value * collateral_ratio
+        result[f"{asset_class}_weight"] = weight
+        result[f"{asset_class}_drift"] = weight - target_weights.get(asset_class, 0)
+    result['max_abs_drift'] = np.max(np.abs([result[f"{asset_class}_drift"] for asset_class in values]), axis=0)
+
+    return pd.DataFrame(result)
+
+
+def target_quantity(port_value, price, target_weight, collateral_ratio=1):
+    """
+    Whole number of units of an asset making its weight closest to target_weight without exceeding it.
+    """
+    return math.floor(port_value * target_weight / collateral_ratio / price)
+
+
+def rebalance_schedule(dates, close_prices, cash_flows_per_unit, quantity, cash, target_weights: dict, collateral_ratio=1,
+                       rule=None, frequency='M', tolerance=0.05, next_date=None, day_offset=0):
+    """
+    Rebalance days and trades of the equity position over all days, with one vectorized pass per rebalance.
+
+    Between two rebalances the equity quantity is constant, so the cash and the drift of every remaining day are computed at once
+    from the cumulative cash flows (e.g. collar pnl per share, the collar is traded on the whole equity position).
+    The first day matching the rule is rebalanced at its close, then the next pass starts on the following day.
+
+    Parameters
+    ----------
+    dates, close_prices, cash_flows_per_unit: array_like
+        One value per day, cash flows are received before the close of the day per unit of the equity position.
+    quantity, cash: scalar
+        Equity quantity and cash before the first day.
+    rule: str
+        None (never rebalance), 'calendar' (every calendar rebalance day), 'band' (any day the absolute drift of an asset class
+        exceeds tolerance) or 'calendar_band' (calendar rebalance days on which the drift exceeds tolerance).
+    next_date: str, optional
+        The trading day after the last day, see calendar_rebalance_days.
+    day_offset: int
+        Number of trading days of the backtest before the first day, see calendar_rebalance_days.
+
+    Returns
+    -------
+    dict
+        'trades': pd.DataFrame with the position, date, close price, equity quantity before and after of every rebalance,
+        'quantity', 'cash', 'max_abs_drift': arrays of the equity quantity, cash and max abs drift at the close of every day after rebalancing.
+    """
+    if rule not in REBALANCE_RULES:
+        raise ValueError(f"Unknown rebalance rule {rule}, please use one of {REBALANCE_RULES}")
+
+    dates = np.asarray(dates)
+    close_prices = np.asarray(close_prices, dtype=float)
+    cash_flows_per_unit = np.nan_to_num(np.asarray(cash_flows_per_unit, dtype=float))
+    n_days = len(dates)
+    calendar_days = calendar_rebalance_days(dates, frequency, next_date, day_offset) if rule in ['calendar', 'calendar_band'] else np.zeros(n_days, dtype=bool)
+
+    quantities = np.empty(n_days)
+    cash_balances = np.empty(n_days)
+    max_abs_drifts = np.empty(n_days)
+    trades = []
+    start = 0
+    while start < n_days:
+        cash_path = cash + quantity * np.cumsum(cash_flows_per_unit[start:])
+        equity_values = quantity * close_prices[start:]
+        max_abs_drift = compute_drift({'equity': equity_values, 'cash': cash_path}, target_weights, collateral_ratio)['max_abs_drift'].values
+
+        if rule == 'calendar':
+            triggered = calendar_days[start:]
+        elif rule == 'band':
+            triggered = max_abs_drift > tolerance
+        elif rule == 'calendar_band':
+            triggered = calendar_days[start:] & (max_abs_drift > tolerance)
+        else:
+            triggered = np.zeros(n_days - start, dtype=bool)
+
+        end = start + int(np.argmax(triggered)) if triggered.any() else n_days
+        quantities[start:end] = quantity
+        cash_balances[start:end] = cash_path[:end - start]
+        max_abs_drifts[start:end] = max_abs_drift[:end - start]
+        if end == n_days:
+            break
+
+        # rebalance at the close of day end
+        price = close_prices[end]
+        cash = cash_path[end - start]
+        new_quantity = target_quantity(cash + quantity * price, price, target_weights['equity'], collateral_ratio)
+        cash -= (new_quantity - quantity) * price
+        trades.append((end, dates[end], price, quantity, new_quantity))
+
+        quantities[end] = quantity = new_quantity
+        cash_balances[end] = cash
+        max_abs_drifts[end] = compute_drift({'equity': quantity * price, 'cash': cash}, target_weights, collateral_ratio)['max_abs_drift'].values[0]
+        start = end + 1
+
+    trades = pd.DataFrame(trades, columns=['position', 'Date', 'price', 'quantity_before', 'quantity_after'])
+    return {'trades': trades, 'quantity': quantities, 'cash': cash_balances, 'max_abs_drift': max_abs_drifts}
+
+
+def rebalance_orders(asset, price, quantity_before, quantity_after):
+    """
+    Orders for Portfolio.execute_orders moving the equity position from quantity_before to quantity_after.
+    """
+    if quantity_after == quantity_before:
+        return []
+    action = 'buy' if quantity_after > quantity_before else 'sell'
+    return [{'action': action, 'asset_class': 'equity', 'asset': asset, 'price': price, 'quantity': abs(quantity_after - quantity_before)}]
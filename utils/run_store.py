@@ -0,0 +1,196 @@
+import os
+import json
+import time
+import uuid
+import concurrent.futures
+
+import numpy as np
+import pandas as pd
+
+
+RUN_TABLES = ['main_df', 'history', 'ledger']
+INDEX_COLS = ['run_id', 'created_at', 'start_date', 'end_date', 'n_days', 'min_nav', 'final_nav', 'format']
+FILE_EXTENSIONS = {'feather': '.feather', 'parquet': '.parquet'}
+DEFAULT_COMPRESSION = {'feather': 'lz4', 'parquet': 'zstd'}
+
+
+def import_pyarrow():
+    try:
+        import pyarrow
+        import pyarrow.feather
+        import pyarrow.parquet
+    except ImportError:
+        raise ImportError("RunStore needs pyarrow, please install it with 'pip install pyarrow'")
+    return pyarrow
+
+
+class RunStore:
+    """
+    Store of backtest runs as compressed columnar files, one directory per run id:
+
+        <directory>/<run_id>/main_df.feather     Backtest.main_df
+        <directory>/<run_id>/history.feather     NAV, equity and cash exposure histories (step 0 is the initial value before the first day)
+        <directory>/<run_id>/ledger.feather      transaction history, one row per transaction
+        <directory>/<run_id>/config.json         the run config (e.g. pipeline.make_config)
+        <directory>/index.csv                    one row per run with its dates and NAV metrics, see list_runs
+
+    Files are written by a background thread, so saving doesn't block the next backtest. Tables are snapshotted when save is called.
+    Feather files are memory-mapped when loaded and only the requested columns are read.
+
+    Usage:
+        store = RunStore()
+        run_id = store.save(backtest, config)
+        store.list_runs()
+        store.load(run_id, 'main_df', columns=['Date', 'collar_pnl'])
+    """
+
+    def __init__(self, directory=None, file_format='feather', compression=None):
+        if file_format not in FILE_EXTENSIONS:
+            raise ValueError(f"Unknown file format {file_format}, please use one of {list(FILE_EXTENSIONS)}")
+        self.directory = directory or os.path.join(os.getcwd(), 'data', 'runs')
+        self.file_format = file_format
+        self.compression = compression or DEFAULT_COMPRESSION[file_format]
+        self.writer = concurrent.futures.ThreadPoolExecutor(max_workers=1)    # a single writer also serializes index updates
+        self.pending = {}       # {run_id: future of the write}
+
+
+    @property
+    def index_path(self):
+        return os.path.join(self.directory, 'index.csv')
+
+
+    def run_path(self, run_id):
+        return os.path.join(self.directory, run_id)
+
+
+    def table_path(self, run_id, table, file_format=None):
+        return os.path.join(self.run_path(run_id), table + FILE_EXTENSIONS[file_format or self.file_format])
+
+
+    def save(self, backtest, config: dict=None, run_id=None, wait=False):
+        """
+        Snapshot the tables of a backtest and write them in the background. Returns the run id.
+        """
+        import_pyarrow()
+        run_id = run_id or time.strftime('%Y%m%d-%H%M%S') + '-' + uuid.uuid4().hex[:6]
+        if os.path.exists(self.run_path(run_id)) or run_id in self.pending:
+            raise ValueError(f"Run {run_id} already exists in {self.directory}")
+
+        tables = self.run_tables(backtest)
+        self.pending[run_id] = self.writer.submit(self.write_run, run_id, tables, config, self.index_row(run_id, tables['history']))
+        if wait:
+            self.wait(run_id)
+        return run_id
+
+
+    @staticmethod
+    def run_tables(backtest) -> dict:
+        # lazily computed columns (e.g. collar_pnl) are stored too
+        backtest.columns.compute(list(backtest.columns.specs))
+        portfolio = backtest.portfolio
+        nav = np.asarray(portfolio.nav_history, dtype=float)
+        n_days = len(nav) - 1
+        history = pd.DataFrame({
+            'step': np.arange(len(nav)),
+            'Date': [None] + list(backtest.dates.values[:n_days]),
+            'nav': nav,
+            'equity_exposure': np.asarray(portfolio.equity_exposure, dtype=float),
+            'cash_exposure': np.asarray(portfolio.cash_exposure, dtype=float)
+        })
+
+        transactions = [(date, i, transaction) for date, day_transactions in portfolio.transaction_history.items()
+                        for i, transaction in enumerate(day_transactions)]
+        ledger = pd.DataFrame(transactions, columns=['Date', 'n', 'transaction'])
+
+        return {'main_df': backtest.main_df.copy(), 'history': history, 'ledger': ledger}
+
+
+    def index_row(self, run_id, history):
+        dates = history['Date'].values[1:]
+        return {
+            'run_id': run_id,
+            'created_at': time.strftime('%Y-%m-%d %H:%M:%S'),
+            'start_date': dates[0] if len(dates) else None,
+            'end_date': dates[-1] if len(dates) else None,
+            'n_days': len(dates),
+            'min_nav': history['nav'].min(),
+            'final_nav': history['nav'].values[-1],
+            'format': self.file_format
+        }
+
+
+    def write_run(self, run_id, tables, config, index_row):
+        pa = import_pyarrow()
+        temp_path = self.run_path(run_id) + '.tmp'
+        os.makedirs(temp_path, exist_ok=True)
+        for table, df in tables.items():
+            arrow_table = pa.Table.from_pandas(df)
+            path = os.path.join(temp_path, table + FILE_EXTENSIONS[self.file_format])
+            if self.file_format == 'feather':
+                pa.feather.write_feather(arrow_table, path, compression=self.compression)
+            else:
+                pa.parquet.write_table(arrow_table, path, compression=self.compression)
+        with open(os.path.join(temp_path, 'config.json'), 'w') as f:
+            json.dump(config, f, indent=4, default=str)
+
+        # the run directory appears complete or not at all
+        os.replace(temp_path, self.run_path(run_id))
+
+        index = pd.DataFrame(self.list_runs().to_dict('records') + [index_row], columns=INDEX_COLS)
+        index.to_csv(self.index_path + '.tmp', index=False)
+        os.replace(self.index_path + '.tmp', self.index_path)
+
+
+    def wait(self, run_id=None):
+        """
+        Wait until the given run (or all pending runs) is written, errors of the writer thread are raised here.
+        """
+        run_ids = [run_id] if run_id is not None else list(self.pending)
+        for run_id in run_ids:
+            future = self.pending.pop(run_id, None)
+            if future is not None:
+                future.result()
+
+
+    def close(self):
+        self.wait()
+        self.writer.shutdown()
+
+
+    def list_runs(self) -> pd.DataFrame:
+        if not os.path.exists(self.index_path):
+            return pd.DataFrame(columns=INDEX_COLS)
+        return pd.read_csv(self.index_path)
+
+
+    def load(self, run_id, table='main_df', columns=None) -> pd.DataFrame:
+        """
+        Load a table of a run ('main_df', 'history' or 'ledger'), only the given columns are read.
+        """
+        if table not in RUN_TABLES:
+            raise ValueError(f"Unknown table {table}, please use one of {RUN_TABLES}")
+        pa = import_pyarrow()
+        self.wait(run_id)
+
+        file_format = next((f for f in FILE_EXTENSIONS if os.path.exists(self.table_path(run_id, table, f))), None)
+        if file_format is None:
+            raise FileNotFoundError(f"Run {run_id} not found in {self.directory}")
+
+        path = self.table_path(run_id, table, file_format)
+        if file_format == 'feather':
+            arrow_table = pa.feather.read_table(path, columns=columns, memory_map=True)
+        else:
+            arrow_table = pa.parquet.read_table(path, columns=columns, memory_map=True)
+        return arrow_table.to_pandas()
+
+
+    def load_config(self, run_id) -> dict:
+        with open(os.path.join(self.run_path(run_id), 'config.json')) as f:
+            return json.load(f)
+
+
+    def load_runs(self, run_ids, table='history', columns=None) -> pd.DataFrame:
+        """
+        Load the same table of several runs into one DataFrame with a run_id column, e.g. to compare NAV histories.
+        """
+        return pd.concat([self.load(run_id, table, columns).assign(run_id=run_id) for run_id in run_ids], ignore_index=True)
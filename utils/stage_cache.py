@@ -0,0 +1,131 @@
+import os
+import json
+import pickle
+import hashlib
+
+import numpy as np
+import pandas as pd
+
+
+def freeze_config(value):
+    """
+    Hashable copy of a config value: dicts become tuples of sorted (key, value) pairs, lists and arrays become tuples,
+    numpy scalars become Python scalars. Frozen configs can be compared, used as dict keys and hashed by config_digest.
+    """
+    if isinstance(value, dict):
+        return tuple((key, freeze_config(value[key])) for key in sorted(value))
+    if isinstance(value, (list, tuple, np.ndarray)):
+        return tuple(freeze_config(item) for item in value)
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def config_digest(value) -> str:
+    """
+    sha256 of a config value that doesn't depend on dict key order, e.g. config_digest({'bs_config': ..., 'strategy_selected': 1}).
+    """
+    return hashlib.sha256(json.dumps(freeze_config(value), default=str).encode()).hexdigest()
+
+
+def frame_digest(df: pd.DataFrame) -> str:
+    """
+    sha256 of the values, index and column names of a DataFrame.
+    """
+    hasher = hashlib.sha256(pd.util.hash_pandas_object(df, index=True).values.tobytes())
+    hasher.update(json.dumps([str(col) for col in df.columns]).encode())
+    return hasher.hexdigest()
+
+
+def source_digest(paths) -> str:
+    """
+    sha256 of the source code of Python files and packages (every .py file under a directory), used as the code version of a stage.
+    """
+    hasher = hashlib.sha256()
+    for path in paths:
+        if os.path.isdir(path):
+            files = sorted(os.path.join(root, name) for root, _, names in os.walk(path) for name in names if name.endswith('.py'))
+        else:
+            files = [path]
+        for file in files:
+            hasher.update(os.path.basename(file).encode())
+            with open(file, 'rb') as f:
+                hasher.update(f.read())
+    return hasher.hexdigest()
+
+
+class StageCache:
+    """
+    Content-addressed cache of pipeline stage artifacts, one pickle file per stage and key:
+
+        <directory>/<stage>/<key>.pkl
+
+    The key of an artifact is the sha256 of everything the stage depends on (the config keys it reads, the digest of its input data
+    and the source digest of its code), so a stage is only computed again when one of its inputs or its code changed.
+    Files are replaced atomically, an artifact is either complete or missing.
+
+    Usage:
+        cache = StageCache()
+        key = cache.key('options', {'config': ..., 'asset_data': frame_digest(asset_data)}, code_version)
+        artifact = cache.get('options', key)
+        if artifact is None:
+            artifact = ...
+            cache.put('options', key, artifact)
+    """
+
+    def __init__(self, directory=None):
+        self.directory = directory or os.path.join(os.getcwd(), 'data', 'stage_cache')
+        self.hits = {}          # {stage: number of artifacts found / not found by get}
+        self.misses = {}
+
+
+    @staticmethod
+    def key(stage, inputs: dict, code_version='') -> str:
+        return config_digest({'stage': stage, 'inputs': inputs, 'code_version': code_version})
+
+
+    def path(self, stage, key):
+        return os.path.join(self.directory, stage, key + '.pkl')
+
+
+    def __contains__(self, stage_key):
+        return os.path.exists(self.path(*stage_key))
+
+
+    def get(self, stage, key, default=None):
+        path = self.path(stage, key)
+        if not os.path.exists(path):
+            self.misses[stage] = self.misses.get(stage, 0) + 1
+            return default
+        with open(path, 'rb') as f:
+            artifact = pickle.load(f)
+        self.hits[stage] = self.hits.get(stage, 0) + 1
+        return artifact
+
+
+    def put(self, stage, key, artifact):
+        path = self.path(stage, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            pickle.dump(artifact, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_path, path)
+
+
+    def clear(self, stage=None):
+        """
+        Delete the artifacts of one stage, or of all stages.
+        """
+        stages = [stage] if stage is not None else (os.listdir(self.directory) if os.path.exists(self.directory) else [])
+        for stage in stages:
+            stage_path = os.path.join(self.directory, stage)
+            if not os.path.isdir(stage_path):
+                continue
+            for name in os.listdir(stage_path):
+                os.remove(os.path.join(stage_path, name))
+
+
+    def stats(self) -> pd.DataFrame:
+        stages = sorted(set(self.hits) | set(self.misses))
+        return pd.DataFrame({'hits': [self.hits.get(stage, 0) for stage in stages],
+                             'misses': [self.misses.get(stage, 0) for stage in stages]}, index=stages)
@@ -1,5 +1,4 @@
 import numpy as np
-import matplotlib.pyplot as plt
 import pandas as pd
 
 
@@ -13,6 +12,7 @@ def calculate_strike(base, multiplier, addition, method='floor'):
 
 
 def plot_distribution(data, x_label, title, bins=30, color='blue'):
+    import matplotlib.pyplot as plt     # imported on first use to keep importing utils fast
     plt.hist(data, bins=bins, color=color, alpha=0.7)
     plt.grid(True)
     plt.xlabel(x_label)
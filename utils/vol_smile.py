@@ -0,0 +1,93 @@
+"""
+Per-day volatility smiles for pricing options without market data.
+
+On each day, implied vols of the options with market prices are fitted by a quadratic function of log-moneyness k = log(K / F):
+    vol(k) = a + b * k + c * k^2
+Days with fewer than 3 implied vols are fitted by a constant (b = c = 0), days without any implied vol are not fitted.
+"""
+import numpy as np
+import pandas as pd
+
+from .option_functions import blackscholes_impv_bisect
+from .data_schema import get_strike
+
+
+SMILE_COLS = ['a', 'b', 'c', 'n_points']
+MIN_VOL = 0.01
+MAX_VOL = 3
+
+
+def log_moneyness(K, S, T, r=0, q=0):
+    F = np.asarray(S) * np.exp((r - q) * np.asarray(T))
+    return np.log(np.asarray(K) / F)
+
+
+def fit_vol_smiles(day_ids, k, implied_vols, ridge=1e-8) -> pd.DataFrame:
+    """
+    Fit the smiles of all days in one pass with batched normal equations.
+
+    Parameters
+    ----------
+    day_ids: array_like
+        Day of each implied vol, e.g. main_df_index.
+    k: array_like
+        Log-moneyness of each implied vol.
+    implied_vols: array_like
+        Implied vols, nan values are ignored.
+
+    Returns
+    -------
+    pd.DataFrame
+        Coefficients a, b, c and the number of fitted points of each day, indexed by day.
+    """
+    day_ids, k, implied_vols = np.asarray(day_ids), np.asarray(k, dtype=float), np.asarray(implied_vols, dtype=float)
+    valid = np.isfinite(implied_vols) & np.isfinite(k)
+    days, day_positions = np.unique(day_ids[valid], return_inverse=True)
+    k, implied_vols = k[valid], implied_vols[valid]
+
+    X = np.stack([np.ones_like(k), k, k**2], axis=1)
+    n_points = np.bincount(day_positions, minlength=len(days))
+    XtX = np.zeros((len(days), 3, 3))
+    Xty = np.zeros((len(days), 3))
+    np.add.at(XtX, day_positions, X[:, :, np.newaxis] * X[:, np.newaxis, :])
+    np.add.at(Xty, day_positions, X * implied_vols[:, np.newaxis])
+
+    # days with fewer than 3 points: constant smile at the mean implied vol
+    constant = n_points < 3
+    XtX[constant, 1:, :] = 0
+    XtX[constant, :, 1:] = 0
+    XtX[constant, 1, 1] = XtX[constant, 2, 2] = 1
+    Xty[constant, 1:] = 0
+    XtX += ridge * np.eye(3)
+
+    coefs = np.linalg.solve(XtX, Xty[:, :, np.newaxis])[:, :, 0] if len(days) else np.zeros((0, 3))
+    smiles = pd.DataFrame(coefs, index=days, columns=SMILE_COLS[:3])
+    smiles['n_points'] = n_points
+    return smiles
+
+
+def smile_vols(smiles: pd.DataFrame, day_ids, k, default_vol):
+    """
+    Vols given by the fitted smiles, default_vol for days without a smile. Vols are clipped to [MIN_VOL, MAX_VOL],
+    as a quadratic fit can go far off outside the fitted strikes.
+    """
+    coefs = smiles.reindex(np.asarray(day_ids))[SMILE_COLS[:3]].values
+    k = np.asarray(k, dtype=float)
+    vols = coefs[:, 0] + coefs[:, 1] * k + coefs[:, 2] * k**2
+    vols = np.where(np.isnan(vols), default_vol, vols)
+    return np.clip(vols, MIN_VOL, MAX_VOL)
+
+
+def implied_vols_from_prices(option_data: pd.DataFrame, bs_config: dict, price_col='open_price'):
+    """
+    Implied vols of all options in option_data at once, using the strike, spot_price and option_type columns.
+    """
+    return blackscholes_impv_bisect(
+        K=get_strike(option_data).values,
+        T=bs_config['time_to_expiration'],
+        S=option_data['spot_price'].values,
+        value=option_data[price_col].values,
+        r=bs_config['r'],
+        q=bs_config['q'],
+        callput=np.asarray(option_data['option_type'].values, dtype=str)
+    )